@@ -0,0 +1,234 @@
+import gc
+import random
+import string
+import time
+import tracemalloc
+from array import array
+import fire
+import simulation
+import snapshot_topology
+import utils
+from simulation_context import SimulationContext
+
+
+class _Timer:
+    """
+    Sums the time spent in the functions it wraps.
+    """
+    def __init__(self):
+        self.elapsed = 0
+
+    def wrap(self, f):
+        def wrapper(*args):
+            start = time.perf_counter()
+            result = f(*args)
+            self.elapsed += time.perf_counter() - start
+            return result
+        return wrapper
+
+
+def _run_payments(context, network, number_of_payments, use_gp_protocol):
+    """
+    Sends `number_of_payments` payments between random nodes of `network` (one per block) and settles them all.
+    @return: the time (in seconds) the nodes spent on sending and settling (path finding and scheduling excluded) and the
+    number of hops.
+    """
+    timer = _Timer()
+    function_collector_append = context.function_collector.append
+    context.function_collector.append = lambda f, k: function_collector_append(timer.wrap(f), k)
+    send_transaction = timer.wrap(simulation.send_transaction)
+    hops = 0
+    try:
+        for _ in range(number_of_payments):
+            sender_node, receiver_node = random.sample(network.nodes, 2)
+            amount_in_msat = simulation.how_much_to_send(context)
+            _, node_to_path = network.find_shortest_path(receiver_node, sender_node, amount_in_msat,
+                                                         simulation.GRIEFING_PENALTY_RATE, use_gp_protocol)
+            if send_transaction(receiver_node, sender_node, use_gp_protocol, amount_in_msat, node_to_path):
+                hops += len(node_to_path[sender_node])
+            simulation.increase_block(context, 1)
+        simulation.increase_block(context, context.function_collector.get_max_k())
+    finally:
+        del context.function_collector.append
+    return timer.elapsed, hops
+
+
+def per_hop(number_of_payments=10000, number_of_nodes=100, use_gp_protocol=True, seed=0):
+    """
+    Measures the cpu time per hop of sending and settling payments, and the memory every node holds at the end.
+    """
+    simulation.NUMBER_OF_NODES = number_of_nodes
+    for trace_memory in [False, True]:
+        context = SimulationContext()
+        random.seed(seed)
+        network, _, _ = simulation.generate_redundancy_network(context, None, simulation.DELTA_DEFAULT,
+                                                               simulation.MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT)
+        if not trace_memory:
+            elapsed, hops = _run_payments(context, network, number_of_payments, use_gp_protocol)
+            print(f"payments: {number_of_payments:,}, hops: {hops:,}")
+            print(f"time per hop: {elapsed / max(hops, 1) * 1e6:.2f} us")
+            continue
+        tracemalloc.start()
+        start_memory, _ = tracemalloc.get_traced_memory()
+        _run_payments(context, network, number_of_payments, use_gp_protocol)
+        end_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"memory held per node after the run: {(end_memory - start_memory) / number_of_nodes:,.0f} bytes")
+        print(f"peak memory per node during the run: {(peak_memory - start_memory) / number_of_nodes:,.0f} bytes")
+
+
+def allocations(number_of_payments=10000, number_of_nodes=50, use_gp_protocol=True, seed=0):
+    """
+    Compares the garbage collections, allocations and time per hop of a payment workload without and with the object pool.
+    """
+    simulation.NUMBER_OF_NODES = number_of_nodes
+    for use_object_pool in [False, True]:
+        context = SimulationContext(use_object_pool=use_object_pool)
+        random.seed(seed)
+        network, _, _ = simulation.generate_redundancy_network(context, None, simulation.DELTA_DEFAULT,
+                                                               simulation.MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT)
+        gc.collect()
+        collections_before = [generation['collections'] for generation in gc.get_stats()]
+        elapsed, hops = _run_payments(context, network, number_of_payments, use_gp_protocol)
+        collections = [generation['collections'] - before for generation, before in zip(gc.get_stats(), collections_before)]
+        print(f"object pool {'enabled' if use_object_pool else 'disabled'}: payments: {number_of_payments:,}, "
+              f"hops: {hops:,}, time per hop: {elapsed / max(hops, 1) * 1e6:.2f} us")
+        print(f"\tgc collections per generation: {collections}, infos and contracts: {context.object_pool.get_counts()}")
+
+
+def _old_secret_and_id(_):
+    """
+    The secrets and id of a payment as they were generated before `utils.SecretGenerator`.
+    """
+    secrets = [''.join(random.choices(string.ascii_uppercase + string.digits, k=8)) for _ in range(3)]
+    return hash(secrets[0]), hash(secrets[1]), hash(secrets[2])
+
+
+def _new_secret_and_id(secret_generator):
+    hash_x = utils.hash_secret(secret_generator.generate_secret())
+    hash_r = utils.hash_secret(secret_generator.generate_secret())
+    return hash_x, hash_r, secret_generator.generate_id()
+
+
+def secrets(number_of_payments=10000000, seed=0, number_of_timed_payments=1000000):
+    """
+    Compares the time of generating the secrets and id of a payment the old way and with `utils.SecretGenerator`, then
+    checks that the secret hashes and ids of `number_of_payments` payments have no collisions.
+    """
+    random.seed(seed)
+    for name, generate in [('random.choices + hash', _old_secret_and_id), ('SecretGenerator', _new_secret_and_id)]:
+        secret_generator = utils.SecretGenerator()
+        secret_generator.init_parameters(seed)
+        start = time.perf_counter()
+        for _ in range(number_of_timed_payments):
+            generate(secret_generator)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / number_of_timed_payments * 1e9:.0f} ns per payment")
+
+    # The hashes are split by their top byte so every part can be checked with a small set.
+    secret_generator = utils.SecretGenerator()
+    secret_generator.init_parameters(seed)
+    hashes_by_top_byte = [array('Q') for _ in range(256)]
+    previous_id = 0
+    ids_increase = True
+    for _ in range(number_of_payments):
+        hash_x, hash_r, transaction_id = _new_secret_and_id(secret_generator)
+        hashes_by_top_byte[hash_x >> 56].append(hash_x)
+        hashes_by_top_byte[hash_r >> 56].append(hash_r)
+        ids_increase = ids_increase and transaction_id > previous_id
+        previous_id = transaction_id
+    collisions = sum(len(hashes) - len(set(hashes)) for hashes in hashes_by_top_byte)
+    print(f"payments: {number_of_payments:,}, secret hash collisions: {collisions}, "
+          f"ids {'unique' if ids_increase else 'NOT unique'}")
+
+
+def settlement(number_of_nodes=5000, number_of_payments=2000, seed=0):
+    """
+    Compares the time of closing all the channels at the end of a run one by one and in bulk, and checks that the balances
+    are identical.
+    """
+    simulation.NUMBER_OF_NODES = number_of_nodes
+    balances = {}
+    for bulk_settlement in [False, True]:
+        context = SimulationContext()
+        random.seed(seed)
+        network, _, victims = simulation.generate_redundancy_network(context, None, simulation.DELTA_DEFAULT,
+                                                                     simulation.MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT)
+        _run_payments(context, network, number_of_payments, True)
+        simulation.BULK_SETTLEMENT = bulk_settlement
+        start = time.perf_counter()
+        simulation.close_channel_and_log_metrics(context, network, victims)
+        elapsed = time.perf_counter() - start
+        balances[bulk_settlement] = [context.blockchain.get_balance_for_node(node) for node in network.nodes]
+        print(f"{'bulk' if bulk_settlement else 'one by one'}: closed {len(network.channels):,} channels in {elapsed:.3f} s")
+    simulation.BULK_SETTLEMENT = True
+    print(f"balances {'identical' if balances[False] == balances[True] else 'DIFFERENT'}")
+
+
+def _networkx_largest_connected_component(topology):
+    """
+    The largest connected component of a snapshot topology as it was found with networkx, as (node1, node2, capacity)
+    edges in the networkx order.
+    """
+    import networkx as nx  # only needed for this check
+    G = nx.Graph()
+    G.add_nodes_from(range(topology.number_of_nodes))
+    G.add_edges_from((node1, node2, {'capacity': capacity}) for node1, node2, capacity in
+                     zip(topology.node1.tolist(), topology.node2.tolist(), topology.capacity.tolist()))
+    G.remove_nodes_from(list(nx.isolates(G)))
+    largest_connected_component = G.subgraph(max(nx.connected_components(G), key=len))
+    return list(largest_connected_component.nodes), \
+        [(node1, node2, capacity) for node1, node2, capacity in largest_connected_component.edges.data('capacity')]
+
+
+def largest_component(snapshot_path=None):
+    """
+    Compares the time of finding the largest connected component of the snapshot with networkx and with the union-find
+    over the topology arrays, and checks that both find the same nodes and edges (in the same order).
+    """
+    topology = snapshot_topology.load_snapshot(snapshot_path or simulation.SNAPSHOT_PATH)
+    start = time.perf_counter()
+    networkx_nodes, networkx_edges = _networkx_largest_connected_component(topology)
+    print(f"networkx: {time.perf_counter() - start:.3f} s")
+    start = time.perf_counter()
+    nodes, edge_indexes = snapshot_topology.find_largest_connected_component(topology.number_of_nodes, topology.node1,
+                                                                             topology.node2)
+    print(f"union-find: {time.perf_counter() - start:.3f} s")
+    edges = [(*sorted((topology.node1[i], topology.node2[i])), topology.capacity[i]) for i in edge_indexes]
+    print(f"nodes: {len(nodes):,}, edges: {len(edges):,}, "
+          f"{'identical' if (nodes, edges) == (networkx_nodes, networkx_edges) else 'DIFFERENT'}")
+
+
+def synthetic_topology(sizes=(10000, 100000), model=simulation.SYNTHETIC_MODEL, build_network=True, seed=0):
+    """
+    Measures the time of generating a synthetic topology of every size in `sizes` in `model`, finding its largest connected
+    component and (if `build_network`) building the network of the simulation from it.
+    """
+    simulation.SYNTHETIC_MODEL = model
+    for number_of_nodes in sizes:
+        simulation.NUMBER_OF_NODES = number_of_nodes
+        start = time.perf_counter()
+        topology = simulation.get_synthetic_topology()
+        generation_time = time.perf_counter() - start
+        start = time.perf_counter()
+        nodes, edges = simulation.get_largest_connected_component(topology)
+        component_time = time.perf_counter() - start
+        print(f"{model}, {number_of_nodes:,} nodes: generated {topology.number_of_edges:,} edges in {generation_time:.2f} s, "
+              f"largest component of {len(nodes):,} nodes and {len(edges):,} edges in {component_time:.2f} s")
+        if build_network:
+            context = SimulationContext(seed)
+            random.seed(seed)
+            start = time.perf_counter()
+            simulation.generate_synthetic_network(context, None, simulation.DELTA_DEFAULT,
+                                                  simulation.MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT)
+            print(f"\tbuilt the network in {time.perf_counter() - start:.2f} s")
+
+
+def main():
+    fire.Fire({'per_hop': per_hop, 'allocations': allocations, 'secrets': secrets,
+               'settlement': settlement, 'largest_component': largest_component,
+               'synthetic_topology': synthetic_topology})
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 import contract_htlc as cn
 import lightning_node as lc
 import channel_manager as cm
-from typing import Dict, Optional
+import utils
+from typing import Callable, Dict, List, Optional
 
 
 class BlockChain:
@@ -16,11 +17,14 @@ class BlockChain:
         Used to reset this instance.
         """
         self._block_number = 0
-        self._open_channels: Dict[str, 'cm.Channel'] = {}
-        self._channels_to_htlcs: Dict[str, 'cn.Contract_HTLC'] = {}
-        self._nodes_addresses_to_balances: Dict[str, int] = {}
-        self._hash_image_to_pre_images: Dict[int, str] = {}
+        self._open_channels: Dict[int, 'cm.Channel'] = {}
+        self._number_of_channels = 0
+        self._channels_to_htlcs: Dict[int, 'cn.Contract_HTLC'] = {}
+        self._nodes: List['lc.LightningNode'] = []  # indexed by node id.
+        self._nodes_balances: List[int] = []  # indexed by node id.
+        self._hash_image_to_pre_images: Dict[int, int] = {}
         self._fee = 0.1
+        self._block_listeners: List[Callable[[int], None]] = []
 
     @property
     def block_number(self):
@@ -34,7 +38,7 @@ class BlockChain:
         """
         @return: returns the total balance currently held in the blockchain.
         """
-        return int(sum(self._nodes_addresses_to_balances.values()))
+        return int(sum(self._nodes_balances))
 
     @property
     def fee(self):
@@ -47,49 +51,96 @@ class BlockChain:
         """
         @return: returns the current balance of `node`.
         """
-        return self._nodes_addresses_to_balances.get(node.address)
+        return self._nodes_balances[node.node_id]
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self._nodes)
+
+    def copy_from(self, other: 'BlockChain', nodes: List['lc.LightningNode'], channels: List['cm.Channel']):
+        """
+        Sets this (empty) blockchain to the state of `other`, which no block passed in yet, with `nodes` and `channels` (the
+        copies of the nodes and open channels of `other`, with the same ids) in place of the originals.
+        """
+        assert not self._nodes and other._block_number == 0
+        self._nodes = list(nodes)
+        self._nodes_balances = other._nodes_balances.copy()
+        self._open_channels = {channel.channel_state.channel_data.channel_id: channel for channel in channels}
+        self._number_of_channels = other._number_of_channels
+        self._fee = other._fee
+
+    def get_node(self, node_id: int) -> 'lc.LightningNode':
+        """
+        @return: the node with the id `node_id`.
+        """
+        return self._nodes[node_id]
 
     def wait_k_blocks(self, k):
         """
-        Increments the current block number by `k` blocks.
+        Increments the current block number by `k` blocks, then notifies the block listeners.
         """
         self._block_number += k
+        if k and self._block_listeners:
+            for listener in self._block_listeners:
+                listener(self._block_number)
 
-    def add_channel(self, channel: 'cm.Channel'):
+    def subscribe_to_blocks(self, listener: Callable[[int], None]):
+        """
+        Registers `listener` to be called with the new block number whenever blocks pass.
+        """
+        self._block_listeners.append(listener)
+
+    def add_channel(self, channel: 'cm.Channel') -> int:
         """
         Adds channel `channel` to the blockchain.
+        @return: the id of the channel (ids are dense, starting from 0).
         """
         self.apply_transaction(channel.channel_state.channel_data.owner1, channel.channel_state.message_state.owner1_balance)
-        self._open_channels[channel.channel_state.channel_data.address] = channel
+        channel_id = self._number_of_channels
+        self._number_of_channels += 1
+        self._open_channels[channel_id] = channel
+        return channel_id
 
     def close_channel(self, message_state: 'cm.MessageState'):
         """
         Closes the channel that corresponds to the given `message_state`.
         """
-        channel: cm.Channel = self._open_channels[message_state.channel_address]
+        channel: cm.Channel = self._open_channels[message_state.channel_id]
         owner2_balance = channel.channel_state.channel_data.total_msat - message_state.owner1_balance
-        self._nodes_addresses_to_balances[channel.channel_state.channel_data.owner1.address] += \
+        self._nodes_balances[channel.channel_state.channel_data.owner1.node_id] += \
             message_state.owner1_balance * (1 - self._fee)
-        self._nodes_addresses_to_balances[channel.channel_state.channel_data.owner2.address] += owner2_balance * (1 - self._fee)
+        self._nodes_balances[channel.channel_state.channel_data.owner2.node_id] += owner2_balance * (1 - self._fee)
+
+        del self._open_channels[message_state.channel_id]
 
-        del self._open_channels[message_state.channel_address]
+    def close_channels(self, message_states: List['cm.MessageState']):
+        """
+        Closes the channels that correspond to the given `message_states`, in order (the same as calling `close_channel` on
+        each of them).
+        """
+        factor = 1 - self._fee
+        nodes_balances = self._nodes_balances
+        for message_state in message_states:
+            channel_data = self._open_channels.pop(message_state.channel_id).channel_state.channel_data
+            nodes_balances[channel_data.owner1.node_id] += message_state.owner1_balance * factor
+            nodes_balances[channel_data.owner2.node_id] += (channel_data.total_msat - message_state.owner1_balance) * factor
         # if contract:
-        #     self._channels_to_htlcs[message_state.channel_address] = contract
+        #     self._channels_to_htlcs[message_state.channel_id] = contract
 
-    def report_pre_image(self, pre_image: str):
+    def report_pre_image(self, pre_image: int):
         """
         Used for reporting the given `pre_image` to the blockchain so it can be obtained later by other nodes in the network.
         """
-        self._hash_image_to_pre_images[hash(pre_image)] = pre_image
+        self._hash_image_to_pre_images[utils.hash_secret(pre_image)] = pre_image
 
-    def add_node(self, node: 'lc.LightningNode', balance: int):
+    def add_node(self, node: 'lc.LightningNode', balance: int) -> int:
         """
         Adds the given `node` to the blockchain with the given initial balance `balance`
+        @return: the id of the node (ids are dense, starting from 0).
         """
-        if node.address in self._nodes_addresses_to_balances:
-            return
-
-        self._nodes_addresses_to_balances[node.address] = balance
+        self._nodes.append(node)
+        self._nodes_balances.append(balance)
+        return len(self._nodes) - 1
 
     def get_pre_image_if_exists_onchain(self, hash_image: int) -> Optional[str]:
         """
@@ -103,6 +154,6 @@ class BlockChain:
         """
         @return: applies (takes fee and reduces balance) a transaction with amount `amount_in_msat` with `node` as the sender.
         """
-        self._nodes_addresses_to_balances[node.address] -= amount_in_msat * (1 + self._fee)
-        assert self._nodes_addresses_to_balances[node.address] >= 0
+        self._nodes_balances[node.node_id] -= amount_in_msat * (1 + self._fee)
+        assert self._nodes_balances[node.node_id] >= 0
 
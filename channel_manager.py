@@ -1,47 +1,250 @@
 import lightning_node as ln
-import random
-import string
-from typing import Optional, List
+from array import array
+from enum import IntFlag
+from collections import defaultdict
+from typing import Optional, List, Tuple, Dict, Iterator, Iterable, Callable
 import contract_htlc as cn
-from singletons import *
+import simulation_context
+
+MESSAGE_STATE_HISTORY_SIZE = 0  # number of latest message states every channel keeps (0 means no history is kept).
+MAX_ACCEPTED_HTLCS: Optional[int] = None  # max pending htlcs in each direction of a channel (LN uses 483), None for no limit.
+MAX_HTLC_VALUE_IN_FLIGHT_MSAT: Optional[int] = None  # max pending msat in each direction of a channel, None for no limit.
+
+
+class ChannelEvent(IntFlag):
+    """
+    The types of changes a channel notifies its listeners about (might be combined).
+    """
+    CAPACITY_CHANGED = 1  # the balance or the locked funds of the channel changed.
+    CONTRACT_ADDED = 2
+    CONTRACT_REMOVED = 4
+    CLOSED = 8
+
+
+CONTRACT_ADDED_EVENT = ChannelEvent.CONTRACT_ADDED | ChannelEvent.CAPACITY_CHANGED
+CONTRACT_REMOVED_EVENT = ChannelEvent.CONTRACT_REMOVED | ChannelEvent.CAPACITY_CHANGED
+CLOSED_EVENT = ChannelEvent.CLOSED | ChannelEvent.CAPACITY_CHANGED
+
+ChannelListener = Callable[['Channel', ChannelEvent], None]
+
+
+class ChannelEventBatcher:
+    """
+    Channel listener that collects the events of every channel during a block and passes them to `on_batch` once, with
+    all the events of each channel combined, as soon as the block passes (or upon `flush`).
+    """
+    def __init__(self, context: 'simulation_context.SimulationContext',
+                 on_batch: Callable[[Dict['Channel', ChannelEvent]], None]):
+        """
+        Initializes a new `ChannelEventBatcher`.
+        @param context: the simulation context of the channels.
+        @param on_batch: called with the combined events of every channel that changed during a block.
+        """
+        self._blockchain = context.blockchain
+        self._on_batch = on_batch
+        self._events: Dict['Channel', ChannelEvent] = {}
+        self._block_number = self._blockchain.block_number
+        self._blockchain.subscribe_to_blocks(self._on_new_block)
+
+    def _on_new_block(self, block_number: int):
+        self.flush()
+        self._block_number = block_number
+
+    def __call__(self, channel: 'Channel', event: ChannelEvent):
+        # in case the block number changed without the blockchain notifying (the events belong to the previous block).
+        if self._blockchain.block_number != self._block_number:
+            self._on_new_block(self._blockchain.block_number)
+        self._events[channel] = self._events.get(channel, 0) | event
+
+    def flush(self):
+        """
+        Passes the events collected so far to `on_batch`.
+        """
+        if not self._events:
+            return
+        events = self._events
+        self._events = {}
+        self._on_batch(events)
 
 
 class MessageState:
     """
     Class to represent a message state of a channel holding the current balance of the channel.
     """
-    def __init__(self, owner1_balance, serial, channel_address=None):
+    def __init__(self, owner1_balance, serial, channel_id=None):
         """
         Initializes a new `MessageState`.
         @param owner1_balance: owner1 current balance.
         @param serial: the serial number of this message - used to verify that new states are valid.
-        @param channel_address: the address of the corresponding channel.
+        @param channel_id: the id of the corresponding channel.
         """
         self.owner1_balance = owner1_balance
         self._serial = serial
-        self.channel_address = channel_address
+        self.channel_id = channel_id
 
     @property
     def serial_number(self):
         return self._serial
 
+    def advance(self, owner1_balance):
+        """
+        Moves this message state (in place) to the next serial number with `owner1_balance` as owner1 balance.
+        """
+        self.owner1_balance = owner1_balance
+        self._serial += 1
+
+
+class MessageStateHistory:
+    """
+    Ring buffer that holds the latest message states of a channel (used for modelling disputes and appeals).
+    """
+    def __init__(self, size: int):
+        """
+        Initializes a new `MessageStateHistory`.
+        @param size: the maximal number of message states to keep.
+        """
+        assert size > 0
+        self._size = size
+        self._serials = array('q', [0]) * size
+        self._owner1_balances = array('q', [0]) * size
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self._size)
+
+    def copy(self) -> 'MessageStateHistory':
+        history = MessageStateHistory(self._size)
+        history._serials = self._serials[:]
+        history._owner1_balances = self._owner1_balances[:]
+        history._count = self._count
+        return history
+
+    def record(self, message_state: 'MessageState'):
+        """
+        Adds `message_state` as the latest message state, overriding the oldest one if the buffer is full.
+        """
+        index = self._count % self._size
+        self._serials[index] = message_state.serial_number
+        self._owner1_balances[index] = int(message_state.owner1_balance)
+        self._count += 1
+
+    def states(self) -> List[Tuple[int, int]]:
+        """
+        @return: the kept message states as (serial number, owner1 balance) pairs, from the oldest to the latest.
+        """
+        first = self._count - len(self)
+        return [(self._serials[i % self._size], self._owner1_balances[i % self._size]) for i in range(first, self._count)]
+
+    def get_owner1_balance(self, serial_number: int) -> Optional[int]:
+        """
+        @return: owner1 balance in the message state with `serial_number` if it is still kept, `None` otherwise.
+        """
+        for serial, owner1_balance in self.states():
+            if serial == serial_number:
+                return owner1_balance
+        return None
+
 
 class ChannelData:
     """
     Class to holds the data of the channel.
     """
-    def __init__(self, owner1: 'ln.LightningNode', owner2: 'ln.LightningNode'):
+    def __init__(self, owner1: 'ln.LightningNode', owner2: 'ln.LightningNode', address: Optional[str] = None):
         """
         Initializes a new `ChannelData`.
         @param owner1: First owner of the channel.
         @param owner2: Second owner of the channel.
+        @param address: the address of the channel, a new one if not given.
         """
-        self.address = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+        # only used for output.
+        self.address = address if address is not None else owner1.context.secret_generator.generate_address()
+        self.channel_id: Optional[int] = None  # assigned by the blockchain when the channel is added to it.
         self.owner1 = owner1
         self.owner2 = owner2
         self.total_msat = 0  # will be changed as owners deposit funds.
 
 
+class HTLCTable:
+    """
+    Class to hold the in-flight htlc contracts of a channel, indexed by transaction id and direction.
+    """
+    def __init__(self, max_accepted_htlcs: Optional[int] = None, max_in_flight_msat: Optional[int] = None):
+        """
+        Initializes a new `HTLCTable`.
+        @param max_accepted_htlcs: the maximal number of contracts in each direction, `None` for no limit.
+        @param max_in_flight_msat: the maximal amount locked in contracts in each direction, `None` for no limit.
+        """
+        self._contracts: Dict[Tuple[int, bool], 'cn.Contract_HTLC'] = {}
+        self._max_accepted_htlcs = max_accepted_htlcs
+        self._max_in_flight_msat = max_in_flight_msat
+        self._count = {True: 0, False: 0}
+        self._in_flight_msat = {True: 0, False: 0}
+
+    def __len__(self):
+        return len(self._contracts)
+
+    def __iter__(self) -> Iterator['cn.Contract_HTLC']:
+        return iter(self._contracts.values())
+
+    def __contains__(self, contract: 'cn.Contract_HTLC'):
+        return any(self._contracts.get((contract.transaction_id, is_owner1_payer)) is contract
+                   for is_owner1_payer in (True, False))
+
+    def in_flight_msat(self, is_owner1_payer: bool) -> int:
+        """
+        @return: the amount locked in the contracts of the given direction.
+        """
+        return self._in_flight_msat[is_owner1_payer]
+
+    def count(self, is_owner1_payer: bool) -> int:
+        """
+        @return: the number of contracts in the given direction.
+        """
+        return self._count[is_owner1_payer]
+
+    def can_add(self, is_owner1_payer: bool, amount_in_msat: int) -> bool:
+        """
+        @return: True iff a contract with `amount_in_msat` in the given direction does not exceed the table's limits.
+        """
+        if self._max_accepted_htlcs is not None and self._count[is_owner1_payer] >= self._max_accepted_htlcs:
+            return False
+        if self._max_in_flight_msat is not None and \
+                self._in_flight_msat[is_owner1_payer] + amount_in_msat > self._max_in_flight_msat:
+            return False
+        return True
+
+    def add(self, contract: 'cn.Contract_HTLC', is_owner1_payer: bool):
+        """
+        Adds `contract`, where `is_owner1_payer` is True iff owner1 of the channel is the payer of `contract`.
+        """
+        key = (contract.transaction_id, is_owner1_payer)
+        assert key not in self._contracts
+        self._contracts[key] = contract
+        self._count[is_owner1_payer] += 1
+        self._in_flight_msat[is_owner1_payer] += contract.amount_in_msat
+
+    def remove(self, contract: 'cn.Contract_HTLC', is_owner1_payer: bool):
+        """
+        Removes `contract`, where `is_owner1_payer` is True iff owner1 of the channel is the payer of `contract`.
+        """
+        key = (contract.transaction_id, is_owner1_payer)
+        assert self._contracts.get(key) is contract
+        del self._contracts[key]
+        self._count[is_owner1_payer] -= 1
+        self._in_flight_msat[is_owner1_payer] -= contract.amount_in_msat
+
+    def clear(self) -> List['cn.Contract_HTLC']:
+        """
+        Removes all the contracts.
+        @return: the removed contracts.
+        """
+        contracts = list(self._contracts.values())
+        self._contracts = {}
+        self._count = {True: 0, False: 0}
+        self._in_flight_msat = {True: 0, False: 0}
+        return contracts
+
+
 class ChannelState:
     """
     Class to represent the state of a specific channel.
@@ -54,7 +257,8 @@ class ChannelState:
         """
         self.channel_data: ChannelData = channel_data
         self.message_state: 'MessageState' = message_state
-        self.htlc_contracts: List['cn.Contract_HTLC'] = []  # holds all the htlc contracts of the channel.
+        # holds all the htlc contracts of the channel.
+        self.htlc_contracts: HTLCTable = HTLCTable(MAX_ACCEPTED_HTLCS, MAX_HTLC_VALUE_IN_FLIGHT_MSAT)
 
 
 class Channel:
@@ -67,19 +271,31 @@ class Channel:
         @param data: the data of the channel.
         @param default_split: the first split in the channel.
         """
+        self._context: 'simulation_context.SimulationContext' = data.owner1.context
+        self._listeners: List[ChannelListener] = []
         self._owner1_htlc_locked: int = 0
         self._owner2_htlc_locked: int = 0
         self._state: ChannelState = ChannelState(data)
         self._state.channel_data.total_msat = default_split.owner1_balance
-        default_split.channel_address = data.address
+        self._message_history: Optional[MessageStateHistory] = \
+            MessageStateHistory(MESSAGE_STATE_HISTORY_SIZE) if MESSAGE_STATE_HISTORY_SIZE > 0 else None
         self.update_message(default_split)
         self._open = True
         self._amount_owner1_can_transfer_to_owner2 = self._state.message_state.owner1_balance
         self._amount_owner2_can_transfer_to_owner1 = (self.channel_state.channel_data.total_msat -
                                                       self._state.message_state.owner1_balance)
         self._is_bad_channel = is_bad_channel
+        self._owner1_id: int = data.owner1.node_id
 
-        BLOCKCHAIN_INSTANCE.add_channel(self)
+        data.channel_id = self._context.blockchain.add_channel(self)
+        default_split.channel_id = data.channel_id
+
+    @property
+    def context(self) -> 'simulation_context.SimulationContext':
+        """
+        Returns the simulation context of the owners of this channel.
+        """
+        return self._context
 
     @property
     def channel_state(self) -> ChannelState:
@@ -92,6 +308,29 @@ class Channel:
         """
         return self._open
 
+    def subscribe(self, listener: ChannelListener):
+        """
+        Subscribes `listener` to be called with this channel and a `ChannelEvent` whenever the channel changes.
+        """
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: ChannelListener):
+        """
+        Stops calling `listener` upon changes in this channel.
+        """
+        self._listeners.remove(listener)
+
+    def _notify_listeners(self, event: ChannelEvent):
+        for listener in self._listeners:
+            listener(self, event)
+
+    @property
+    def message_history(self) -> Optional[MessageStateHistory]:
+        """
+        @return: the latest message states of this channel, `None` if `MESSAGE_STATE_HISTORY_SIZE` is 0.
+        """
+        return self._message_history
+
     @property
     def owner1_balance(self):
         """
@@ -120,11 +359,12 @@ class Channel:
         """
         return self._amount_owner2_can_transfer_to_owner1
 
-    def _owner1_htlc_locked_setter(self, owner1_htlc_locked: int):
+    def _owner1_htlc_locked_setter(self, owner1_htlc_locked: int, compute_amount_can_transfer: bool = True):
         assert owner1_htlc_locked >= 0
         old_htlc_locked = self._owner1_htlc_locked
         self._owner1_htlc_locked = owner1_htlc_locked
-        self._compute_amount_owner1_can_transfer_to_owner2()
+        if compute_amount_can_transfer:
+            self._compute_amount_owner1_can_transfer_to_owner2()
         if not self._is_bad_channel:
             self._state.channel_data.owner1.notify_of_change_in_locked_funds(self._owner1_htlc_locked - old_htlc_locked)
 
@@ -132,11 +372,12 @@ class Channel:
         self._amount_owner1_can_transfer_to_owner2 = self._state.message_state.owner1_balance - self._owner1_htlc_locked
         assert self._amount_owner1_can_transfer_to_owner2 >= 0
 
-    def _owner2_htlc_locked_setter(self, owner2_htlc_locked: int):
+    def _owner2_htlc_locked_setter(self, owner2_htlc_locked: int, compute_amount_can_transfer: bool = True):
         assert owner2_htlc_locked >= 0
         old_htlc_locked = self._owner2_htlc_locked
         self._owner2_htlc_locked = owner2_htlc_locked
-        self._compute_amount_owner2_can_transfer_to_owner1()
+        if compute_amount_can_transfer:
+            self._compute_amount_owner2_can_transfer_to_owner1()
         if not self._is_bad_channel:
             self._state.channel_data.owner2.notify_of_change_in_locked_funds(self._owner2_htlc_locked - old_htlc_locked)
 
@@ -149,7 +390,7 @@ class Channel:
         """
         @return: True if node is owner1 of this channel.
         """
-        return node.address == self.channel_state.channel_data.owner1.address
+        return node.node_id == self._owner1_id
 
     def update_message(self, message_state: 'MessageState'):
         """
@@ -157,8 +398,12 @@ class Channel:
         """
         self._check_new_message_state(message_state)
         self.channel_state.message_state = message_state
+        if self._message_history is not None:
+            self._message_history.record(message_state)
         self._compute_amount_owner1_can_transfer_to_owner2()
         self._compute_amount_owner2_can_transfer_to_owner1()
+        if self._listeners:
+            self._notify_listeners(ChannelEvent.CAPACITY_CHANGED)
 
     def _check_new_message_state(self, message_state: 'MessageState'):
         if message_state.serial_number < 0 or message_state.owner1_balance > self._state.channel_data.total_msat:
@@ -170,13 +415,44 @@ class Channel:
         if self._state.message_state.serial_number >= message_state.serial_number:
             raise ValueError("Tried to update message with an older one.")
 
+    def clone(self, owner1: 'ln.LightningNode', owner2: 'ln.LightningNode') -> 'Channel':
+        """
+        Returns a copy of this channel, which has no contracts, between `owner1` and `owner2` (the copies of its owners, in
+        another context) with the same id, address and balances. The channel is added to its owners but not to the
+        blockchain of their context (see `network.NetworkTemplate`).
+        """
+        assert not self._owner1_htlc_locked and not self._owner2_htlc_locked and not len(self._state.htlc_contracts)
+        data = self._state.channel_data
+        channel_data = ChannelData(owner1, owner2, data.address)
+        channel_data.channel_id = data.channel_id
+        channel_data.total_msat = data.total_msat
+        message_state = self._state.message_state
+        channel = object.__new__(Channel)
+        channel._context = owner1.context
+        channel._listeners = []
+        channel._owner1_htlc_locked = 0
+        channel._owner2_htlc_locked = 0
+        channel._state = ChannelState(channel_data, MessageState(message_state.owner1_balance,
+                                                                 message_state.serial_number, message_state.channel_id))
+        channel._message_history = self._message_history.copy() if self._message_history is not None else None
+        channel._open = self._open
+        channel._amount_owner1_can_transfer_to_owner2 = self._amount_owner1_can_transfer_to_owner2
+        channel._amount_owner2_can_transfer_to_owner1 = self._amount_owner2_can_transfer_to_owner1
+        channel._is_bad_channel = self._is_bad_channel
+        channel._owner1_id = self._owner1_id
+        owner1.add_channel(owner2, channel)
+        owner2.add_channel(owner1, channel)
+        return channel
+
     def owner2_add_funds(self, owner2_amount_in_msat: int):
         """
         Adds `owner2_amount_in_msat` to the channel funds, as owner2 balance.
         """
-        BLOCKCHAIN_INSTANCE.apply_transaction(self.channel_state.channel_data.owner2, owner2_amount_in_msat)
-        self._state.channel_data.total_msat += (owner2_amount_in_msat * (1 - BLOCKCHAIN_INSTANCE.fee))
+        self._context.blockchain.apply_transaction(self.channel_state.channel_data.owner2, owner2_amount_in_msat)
+        self._state.channel_data.total_msat += (owner2_amount_in_msat * (1 - self._context.blockchain.fee))
         self._compute_amount_owner2_can_transfer_to_owner1()
+        if self._listeners:
+            self._notify_listeners(ChannelEvent.CAPACITY_CHANGED)
 
     def close_channel(self):
         """
@@ -184,25 +460,70 @@ class Channel:
         """
         if not self._open:
             return
-        for contract in self._state.htlc_contracts:
+        for contract in self._state.htlc_contracts.clear():
             contract.invalidate()
-        self._state.htlc_contracts = []
 
         self._owner1_htlc_locked_setter(0)
         self._owner2_htlc_locked_setter(0)
 
-        BLOCKCHAIN_INSTANCE.close_channel(self._state.message_state)
+        self._context.blockchain.close_channel(self._state.message_state)
 
+        self._detach_from_owners()
+        if self._listeners:
+            self._notify_listeners(CLOSED_EVENT)
+
+    def _detach_from_owners(self):
         self._state.channel_data.owner2.notify_of_closed_channel(self, self._state.channel_data.owner1)
         self._state.channel_data.owner1.notify_of_closed_channel(self, self._state.channel_data.owner2)
         self._open = False
 
+    @staticmethod
+    def close_channels(channels: Iterable['Channel']):
+        """
+        Closes `channels` with the same result as calling `close_channel` on each of them in order, but releases their locked
+        funds and settles them on the blockchain in bulk. The owners are notified as soon as every channel is taken, so
+        `channels` may be generated lazily from the owners' channels. All of `channels` must share a simulation context.
+        """
+        closed_channels: List[Channel] = []
+        for channel in channels:
+            if channel._open:
+                channel._detach_from_owners()
+                closed_channels.append(channel)
+
+        released_locked_funds: Dict[int, int] = defaultdict(int)  # node id to the funds released by its channels.
+        for channel in closed_channels:
+            if channel._state.htlc_contracts:
+                for contract in channel._state.htlc_contracts.clear():
+                    contract.invalidate()
+            if not channel._is_bad_channel:
+                released_locked_funds[channel._owner1_id] += channel._owner1_htlc_locked
+                released_locked_funds[channel._state.channel_data.owner2.node_id] += channel._owner2_htlc_locked
+            channel._owner1_htlc_locked = 0
+            channel._owner2_htlc_locked = 0
+            channel._compute_amount_owner1_can_transfer_to_owner2()
+            channel._compute_amount_owner2_can_transfer_to_owner1()
+        if not closed_channels:
+            return
+        context = closed_channels[0].context
+        for node_id, locked_funds in released_locked_funds.items():
+            context.locked_funds_integrator.update(node_id, -locked_funds)
+
+        context.blockchain.close_channels([channel._state.message_state for channel in closed_channels])
+        for channel in closed_channels:
+            if channel._listeners:
+                channel._notify_listeners(CLOSED_EVENT)
+
     def add_contract(self, contract: 'cn.Contract_HTLC') -> bool:
         """
         Adds a new contract `contract` to the channel.
-        @return: True iff the contract was added successfully.
+        @return: True iff the contract was added successfully (the payer has enough funds and the channel's htlc limits
+        are not exceeded).
         """
-        if self.is_owner1(contract.payer):
+        is_owner1_payer = self.is_owner1(contract.payer)
+        if not self._state.htlc_contracts.can_add(is_owner1_payer, contract.amount_in_msat):
+            contract.invalidate()
+            return False
+        if is_owner1_payer:
             if self.amount_owner1_can_transfer_to_owner2 < contract.amount_in_msat:
                 contract.invalidate()
                 return False
@@ -212,55 +533,90 @@ class Channel:
                 contract.invalidate()
                 return False
             self._owner2_htlc_locked_setter(self._owner2_htlc_locked + contract.amount_in_msat)
-        self._state.htlc_contracts.append(contract)
+        self._state.htlc_contracts.add(contract, is_owner1_payer)
+        if self._listeners:
+            self._notify_listeners(CONTRACT_ADDED_EVENT)
         return True
 
-    def _update_message_state(self, new_owner1_balance: int):
-        current_message_state = self._state.message_state
-        message_state = MessageState(new_owner1_balance, current_message_state.serial_number + 1,
-                                     self._state.channel_data.address)
-        self.update_message(message_state)
+    def _advance_message_state(self, owner1_balance_delta: int, is_owner1_payer: bool):
+        """
+        Moves the current message state (in place) to the next serial number with `owner1_balance_delta` added to owner1
+        balance. Same as creating the next `MessageState` and calling `update_message` with it, but only re-computes the
+        amount the payer can transfer, unless the balance changed.
+        """
+        message_state = self._state.message_state
+        new_owner1_balance = message_state.owner1_balance + owner1_balance_delta
+        if new_owner1_balance > self._state.channel_data.total_msat:
+            raise ValueError("Invalid message state received.")
+        message_state.advance(new_owner1_balance)
+        if self._message_history is not None:
+            self._message_history.record(message_state)
+
+        if is_owner1_payer or owner1_balance_delta:
+            self._compute_amount_owner1_can_transfer_to_owner2()
+        if not is_owner1_payer or owner1_balance_delta:
+            self._compute_amount_owner2_can_transfer_to_owner1()
 
     def notify_of_end_of_contract(self, contract: 'cn.Contract_HTLC'):
         """
         Used to notify this channel that the contract `contract` has ended.
         """
-        assert contract in self._state.htlc_contracts
+        is_owner1_payer = self.is_owner1(contract.payer)
+        self._state.htlc_contracts.remove(contract, is_owner1_payer)
 
-        self._state.htlc_contracts.remove(contract)
-
-        locked_for_owner1 = 0
-        locked_for_owner2 = 0
-        transfer_to_owner1 = 0
-        transfer_to_owner2 = 0
-        if self.is_owner1(contract.payer):
-            locked_for_owner1 = contract.amount_in_msat
-            transfer_to_owner2 = contract.transfer_amount_to_payee
+        if is_owner1_payer:
+            self._owner1_htlc_locked_setter(int(self._owner1_htlc_locked - contract.amount_in_msat), False)
+            self._advance_message_state(-contract.transfer_amount_to_payee, is_owner1_payer)
         else:
-            locked_for_owner2 = contract.amount_in_msat
-            transfer_to_owner1 = contract.transfer_amount_to_payee
-
-        self._owner1_htlc_locked_setter(int(self._owner1_htlc_locked - locked_for_owner1))
-        self._owner2_htlc_locked_setter(int(self._owner2_htlc_locked - locked_for_owner2))
-
-        new_owner1_balance = self._state.message_state.owner1_balance + transfer_to_owner1 - transfer_to_owner2
-        self._update_message_state(new_owner1_balance)
+            self._owner2_htlc_locked_setter(int(self._owner2_htlc_locked - contract.amount_in_msat), False)
+            self._advance_message_state(contract.transfer_amount_to_payee, is_owner1_payer)
+        if self._listeners:
+            self._notify_listeners(CONTRACT_REMOVED_EVENT)
 
         if contract.pre_image_x:
-            BLOCKCHAIN_INSTANCE.report_pre_image(contract.pre_image_x)
+            self._context.blockchain.report_pre_image(contract.pre_image_x)
         elif contract.pre_image_r:
-            BLOCKCHAIN_INSTANCE.report_pre_image(contract.pre_image_r)
+            self._context.blockchain.report_pre_image(contract.pre_image_r)
+
+    def notify_of_end_of_contracts(self, contracts: List['cn.Contract_HTLC']):
+        """
+        Used to notify this channel that all the (expired) `contracts` have ended, the same as calling
+        `notify_of_end_of_contract` with each of them but the locks and the message state are updated once.
+        """
+        owner1_released = owner2_released = owner1_balance_delta = 0
+        for contract in contracts:
+            is_owner1_payer = self.is_owner1(contract.payer)
+            self._state.htlc_contracts.remove(contract, is_owner1_payer)
+            if is_owner1_payer:
+                owner1_released += contract.amount_in_msat
+                owner1_balance_delta -= contract.transfer_amount_to_payee
+            else:
+                owner2_released += contract.amount_in_msat
+                owner1_balance_delta += contract.transfer_amount_to_payee
+            assert not contract.pre_image_x and not contract.pre_image_r
+
+        if owner1_released:
+            self._owner1_htlc_locked_setter(int(self._owner1_htlc_locked - owner1_released), False)
+        if owner2_released:
+            self._owner2_htlc_locked_setter(int(self._owner2_htlc_locked - owner2_released), False)
+        self._advance_message_state(owner1_balance_delta, bool(owner1_released))
+        if owner1_released and owner2_released and not owner1_balance_delta:
+            self._compute_amount_owner2_can_transfer_to_owner1()
+        if self._listeners:
+            self._notify_listeners(CONTRACT_REMOVED_EVENT)
 
     def pay_amount_to_owner(self, contract: 'cn.ContractCancellation'):
         """
         Pays the amount in the contract `contract` to the payee `contract.payee`
         """
-        owner1_new_balance_delta = contract.amount_in_msat
-        if self.is_owner1(contract.payee):
-            self._owner2_htlc_locked_setter(int(self._owner2_htlc_locked - contract.amount_in_msat))
+        is_owner1_payer = not self.is_owner1(contract.payee)
+        if is_owner1_payer:
+            self._owner1_htlc_locked_setter(int(self._owner1_htlc_locked - contract.amount_in_msat), False)
+            self._advance_message_state(-contract.amount_in_msat, is_owner1_payer)
         else:
-            self._owner1_htlc_locked_setter(int(self._owner1_htlc_locked - contract.amount_in_msat))
-            owner1_new_balance_delta = -contract.amount_in_msat
-        self._update_message_state(self._state.message_state.owner1_balance + owner1_new_balance_delta)
+            self._owner2_htlc_locked_setter(int(self._owner2_htlc_locked - contract.amount_in_msat), False)
+            self._advance_message_state(contract.amount_in_msat, is_owner1_payer)
         contract.invalidate()
-        self._state.htlc_contracts.remove(contract)
+        self._state.htlc_contracts.remove(contract, is_owner1_payer)
+        if self._listeners:
+            self._notify_listeners(CONTRACT_REMOVED_EVENT)
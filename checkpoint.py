@@ -0,0 +1,224 @@
+import io
+import os
+import pickle
+import random
+import sys
+import traceback
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import lightning_node
+import channel_manager
+import simulation_context
+import snapshot_topology
+from network import Network
+
+# Nodes and channels are pickled by reference and their states one after the other, so pickling a network does not recurse
+# along its paths (which would exceed the recursion limit on large networks).
+_GRAPH_TYPES = (lightning_node.LightningNode, channel_manager.Channel)
+
+
+class _CheckpointPickler(pickle.Pickler):
+    def __init__(self, f):
+        super(_CheckpointPickler, self).__init__(f, pickle.HIGHEST_PROTOCOL)
+        self.objects: List[Any] = []
+        self._indexes: Dict[int, int] = {}
+
+    def persistent_id(self, obj):
+        if not isinstance(obj, _GRAPH_TYPES):
+            return None
+        index = self._indexes.get(id(obj))
+        if index is None:
+            index = self._indexes[id(obj)] = len(self.objects)
+            self.objects.append(obj)
+        return type(obj), index
+
+    def dump_all(self, payload):
+        """
+        Pickles `payload`, then the states of the nodes and channels it references (and of the ones they reference).
+        """
+        self.dump(payload)
+        dumped = 0
+        while dumped < len(self.objects):
+            objects = self.objects[dumped:]
+            dumped = len(self.objects)
+            self.dump([_get_state(obj) for obj in objects])
+        self.dump(None)
+
+
+class _CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, f):
+        super(_CheckpointUnpickler, self).__init__(f)
+        self._objects: Dict[int, Any] = {}
+
+    def persistent_load(self, pid):
+        cls, index = pid
+        obj = self._objects.get(index)
+        if obj is None:
+            obj = self._objects[index] = cls.__new__(cls)
+        return obj
+
+    def load_all(self):
+        """
+        @return: the payload pickled by `_CheckpointPickler.dump_all`, with the states of its nodes and channels set.
+        """
+        payload = self.load()
+        index = 0
+        states = self.load()
+        while states is not None:
+            for state in states:
+                _set_state(self._objects[index], state)
+                index += 1
+            states = self.load()
+        return payload
+
+
+_slots_by_type: Dict[type, List[str]] = {}
+
+
+def _get_state(obj) -> Tuple[Optional[dict], Dict[str, Any]]:
+    """
+    @return: the attributes of `obj`, the ones in its `__dict__` and the ones in its slots (which are set).
+    """
+    slots = _slots_by_type.get(type(obj))
+    if slots is None:
+        slots = _slots_by_type[type(obj)] = [name for cls in type(obj).__mro__
+                                             for name in cls.__dict__.get('__slots__', ())]
+    return getattr(obj, '__dict__', None), {name: getattr(obj, name) for name in slots if hasattr(obj, name)}
+
+
+def _set_state(obj, state: Tuple[Optional[dict], Dict[str, Any]]):
+    attributes, slots = state
+    if attributes:
+        obj.__dict__.update(attributes)
+    for name, value in slots.items():
+        setattr(obj, name, value)
+
+
+class Checkpoint:
+    """
+    The full state of a run at the end of a block: its context (blockchain, channels, scheduled functions, metrics and
+    secret generator), network, attackers and victims, and the state of the `random` module. A run continues from a
+    checkpoint exactly as it would have continued from the state the checkpoint was taken of.
+    """
+    def __init__(self, context: 'simulation_context.SimulationContext', network: Network,
+                 attackers: List['lightning_node.LightningNode'], victims: List['lightning_node.LightningNode'],
+                 parameters: Optional[dict] = None, random_state: Optional[tuple] = None):
+        """
+        Initializes a new `Checkpoint`, taken of the given state (not a copy of it).
+        @param parameters: the parameters of the simulation the run belongs to.
+        @param random_state: the state of the `random` module, its current state if not given.
+        """
+        self.context = context
+        self.network = network
+        self.attackers = attackers
+        self.victims = victims
+        self.parameters = parameters or {}
+        self.random_state = random_state if random_state is not None else random.getstate()
+
+    @property
+    def block_number(self) -> int:
+        return self.context.blockchain.block_number
+
+    def _get_payload(self) -> dict:
+        return {'context': self.context, 'network': self.network, 'attackers': self.attackers, 'victims': self.victims,
+                'parameters': self.parameters, 'random_state': self.random_state}
+
+    @classmethod
+    def _from_payload(cls, payload: dict) -> 'Checkpoint':
+        return cls(payload['context'], payload['network'], payload['attackers'], payload['victims'], payload['parameters'],
+                   payload['random_state'])
+
+    def save(self, path: str):
+        """
+        Writes this checkpoint to `path`, so runs can be resumed from it later (see `load`).
+        """
+        with snapshot_topology.atomic_write(path, 'wb') as f:
+            _CheckpointPickler(f).dump_all(self._get_payload())
+
+    @classmethod
+    def load(cls, path: str) -> 'Checkpoint':
+        """
+        Reads the checkpoint saved in `path`.
+        """
+        with open(path, 'rb') as f:
+            return cls._from_payload(_CheckpointUnpickler(f).load_all())
+
+    def copy(self) -> 'Checkpoint':
+        """
+        @return: a deep copy of this checkpoint.
+        """
+        f = io.BytesIO()
+        _CheckpointPickler(f).dump_all(self._get_payload())
+        f.seek(0)
+        return Checkpoint._from_payload(_CheckpointUnpickler(f).load_all())
+
+    def restore(self) -> Tuple['simulation_context.SimulationContext', Network, List['lightning_node.LightningNode'],
+                               List['lightning_node.LightningNode']]:
+        """
+        Sets the state of the `random` module to the one of this checkpoint, so the run continues from this checkpoint.
+        @return: the context, network, attackers and victims of the run (which continuing the run changes).
+        """
+        random.setstate(self.random_state)
+        return self.context, self.network, self.attackers, self.victims
+
+    def branch(self, branches: List[Callable[['Checkpoint'], Any]], processes: Optional[int] = None) -> List[Any]:
+        """
+        Continues the run in several ways: calls every function in `branches` with its own copy of this checkpoint.
+        Where `os.fork` is available, every branch runs in a child process that shares the memory of this process until
+        it changes it (copy on write), at most `processes` (all the cpus by default) at a time, and its result is pickled
+        back. Otherwise every branch gets a deep copy (see `copy`). This checkpoint is left as is.
+        @return: the results of the branches, in order.
+        """
+        if not hasattr(os, 'fork'):
+            return [branch(self.copy()) for branch in branches]
+        processes = processes or os.cpu_count() or 1
+        results = [None] * len(branches)
+        errors = []
+        running = deque()
+        for index, branch in enumerate(branches):
+            if len(running) >= processes:
+                Checkpoint._collect(*running.popleft(), results, errors)
+            running.append((index,) + self._fork(branch))
+        while running:
+            Checkpoint._collect(*running.popleft(), results, errors)
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(branches)} branches failed, the first:\n{errors[0]}")
+        return results
+
+    def _fork(self, branch: Callable[['Checkpoint'], Any]) -> Tuple[int, int]:
+        """
+        Runs `branch` in a child process.
+        @return: the pid of the child and the pipe its result is written to.
+        """
+        read_fd, write_fd = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            os.close(write_fd)
+            return pid, read_fd
+        try:
+            os.close(read_fd)
+            try:
+                result = (True, branch(self))
+            except BaseException:
+                result = (False, traceback.format_exc())
+            with os.fdopen(write_fd, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(0)
+
+    @staticmethod
+    def _collect(index: int, pid: int, read_fd: int, results: List[Any], errors: List[str]):
+        with os.fdopen(read_fd, 'rb') as f:
+            try:
+                succeeded, result = pickle.load(f)
+            except EOFError:
+                succeeded, result = False, f"the process of branch {index} exited without a result"
+        os.waitpid(pid, 0)
+        if succeeded:
+            results[index] = result
+        else:
+            errors.append(result)
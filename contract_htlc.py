@@ -1,12 +1,16 @@
 import channel_manager as cm
 import lightning_node as ln
-from singletons import *
+import utils
 
 
 class Contract_HTLC:
     """
     An abstract class that represent a contract for transferring money in the lightning network.
     """
+    __slots__ = ('_transaction_id', '_amount_in_msat', '_hash_x', '_hash_r', '_expiration_block_number',
+                 '_channel_to_notify', '_pre_image_x', '_pre_image_r', '_payer', '_payee', '_is_valid', '_was_accepted',
+                 '_money_to_transfer_to_payee')
+
     def __init__(self, transaction_id: int, amount_in_msat: int, hash_x: int, hash_r: int, expiration_block_number: int,
                  attached_channel: cm.Channel, payer: 'ln.LightningNode', payee: 'ln.LightningNode'):
         """
@@ -36,20 +40,31 @@ class Contract_HTLC:
         self._was_accepted = False
         self._money_to_transfer_to_payee = 0
 
-        FUNCTION_COLLECTOR_INSTANCE.append(self._on_expired, expiration_block_number)
+        attached_channel.context.contract_expiry_sweeper.add(self)
+
+    def should_enforce_on_expiry(self) -> bool:
+        """
+        True iff this (expired) contract was not concluded and should be enforced.
+        """
+        return not (self._pre_image_r or self._pre_image_x) and self._channel_to_notify.is_open and self._is_valid
 
-    def _on_expired(self):
+    def on_expired(self):
         """
-        Called upon contract expiration.
+        Called upon contract expiration (if enforced), before its channel is notified of its end.
         """
         assert self.is_expired
 
+    def after_expired(self):
+        """
+        Called upon contract expiration (if enforced), after its channel was notified of its end.
+        """
+
     @property
     def is_expired(self):
         """
         True iff this contract is expired.
         """
-        return BLOCKCHAIN_INSTANCE.block_number >= self._expiration_block_number
+        return self._channel_to_notify.context.blockchain.block_number >= self._expiration_block_number
 
     @property
     def expiration_block_number(self):
@@ -114,24 +129,24 @@ class Contract_HTLC:
         """
         self._is_valid = False
 
-    def report_x(self, x: str):
+    def report_x(self, x: int):
         """
         Used to report the pre image of the `hash_x` given in the constructor.
         """
         assert not self.is_expired
         assert self._is_valid
         assert self._pre_image_x is None and self._pre_image_r is None
-        assert hash(x) == self.hash_x
+        assert utils.hash_secret(x) == self.hash_x
         self._pre_image_x = x
 
-    def report_r(self, r: str):
+    def report_r(self, r: int):
         """
         Used to report the pre image of the `hash_r` given in the constructor.
         """
         assert not self.is_expired
         assert self._is_valid
         assert self._pre_image_x is None and self._pre_image_r is None
-        assert hash(r) == self.hash_r
+        assert utils.hash_secret(r) == self.hash_r
         self._pre_image_r = r
 
     def accept_contract(self):
@@ -149,45 +164,40 @@ class ContractForward(Contract_HTLC):
     """
     Class to represent a forward contract ('classic' htlc) in the lightning network.
     """
+    __slots__ = ()
+
     def __init__(self, transaction_id: int, amount_in_msat: int, hash_x: int, hash_r: int, expiration_block_number: int,
                  attached_channel: cm.Channel, payer: 'ln.LightningNode', payee: 'ln.LightningNode'):
         super().__init__(transaction_id, amount_in_msat, hash_x, hash_r, expiration_block_number, attached_channel, payer, payee)
 
-    def _on_expired(self):
-        if self._pre_image_r or self._pre_image_x or not self._channel_to_notify.is_open or not self._is_valid:
-            return
-        super()._on_expired()
-
-        self._channel_to_notify.notify_of_end_of_contract(self)
-
-    def report_x(self, x: str):
+    def report_x(self, x: int):
         super().report_x(x)
         self._money_to_transfer_to_payee = self.amount_in_msat
         self.attached_channel.notify_of_end_of_contract(self)
 
-    def report_r(self, r: str):
+    def report_r(self, r: int):
         super().report_r(r)
         self.attached_channel.notify_of_end_of_contract(self)
 
 
 class ContractCancellation(Contract_HTLC):
+    __slots__ = ()
+
     def __init__(self, transaction_id: int, amount_in_msat: int, hash_x: int, hash_r: int, expiration_block_number: int,
                  attached_channel: cm.Channel, payer: 'ln.LightningNode', payee: 'ln.LightningNode'):
         super().__init__(transaction_id, amount_in_msat, hash_x, hash_r, expiration_block_number, attached_channel, payer, payee)
 
-    def _on_expired(self):
-        if self._pre_image_r or self._pre_image_x or not self._channel_to_notify.is_open or not self._is_valid:
-            return
-        super()._on_expired()
-
+    def on_expired(self):
+        super().on_expired()
         self._money_to_transfer_to_payee = self.amount_in_msat
-        self._channel_to_notify.notify_of_end_of_contract(self)
+
+    def after_expired(self):
         self.payee.notify_of_cancellation_contract_payment(self)
 
-    def report_x(self, x: str):
+    def report_x(self, x: int):
         super().report_x(x)
         self.attached_channel.notify_of_end_of_contract(self)
 
-    def report_r(self, r: str):
+    def report_r(self, r: int):
         super().report_r(r)
         self.attached_channel.notify_of_end_of_contract(self)
@@ -0,0 +1,96 @@
+import math
+import random
+from typing import Dict, List
+import lightning_node
+from network import Network
+from samplers import AliasSampler
+
+# the demand models of nodes: how likely every node is to send (or receive) a payment.
+UNIFORM = 'uniform'  # all nodes alike.
+ZIPF = 'zipf'  # the node of rank r (by degree, highest first) in proportion to 1 / r ^ exponent.
+DEGREE = 'degree'  # in proportion to the number of channels of the node.
+CAPACITY = 'capacity'  # in proportion to the total capacity of the channels of the node.
+NODE_DEMAND_MODELS = [UNIFORM, ZIPF, DEGREE, CAPACITY]
+
+# the models of payment amounts.
+NORMAL = 'normal'  # around the mean amount, with a small deviation.
+LOGNORMAL = 'lognormal'  # heavy tailed, the median is the mean amount.
+AMOUNT_MODELS = [NORMAL, LOGNORMAL]
+
+
+def get_degrees(network: Network, nodes: List['lightning_node.LightningNode']) -> List[int]:
+    return [len(network.edges.get(node, ())) for node in nodes]
+
+
+def get_capacities(network: Network, nodes: List['lightning_node.LightningNode']) -> List[int]:
+    """
+    @return: the total capacity (in msat) of the channels of every node in `nodes`.
+    """
+    capacities: Dict['lightning_node.LightningNode', int] = dict.fromkeys(nodes, 0)
+    for channel in network.channels:
+        channel_data = channel.channel_state.channel_data
+        for owner in [channel_data.owner1, channel_data.owner2]:
+            if owner in capacities:
+                capacities[owner] += channel_data.total_msat
+    return list(capacities.values())
+
+
+def get_node_weights(model: str, network: Network, nodes: List['lightning_node.LightningNode'],
+                     zipf_exponent: float = 1.0) -> List[float]:
+    """
+    @return: the weight of every node in `nodes` in the demand `model`, which the node is chosen in proportion to.
+    """
+    if model == UNIFORM:
+        return [1.0] * len(nodes)
+    if model == DEGREE:
+        return [float(degree) for degree in get_degrees(network, nodes)]
+    if model == CAPACITY:
+        return [float(capacity) for capacity in get_capacities(network, nodes)]
+    if model == ZIPF:
+        degrees = get_degrees(network, nodes)
+        # ties keep the order of `nodes`.
+        ranked = sorted(range(len(nodes)), key=lambda i: -degrees[i])
+        weights = [0.0] * len(nodes)
+        for rank, i in enumerate(ranked, 1):
+            weights[i] = 1 / rank ** zipf_exponent
+        return weights
+    raise ValueError(f"unknown demand model {model}, expected one of {NODE_DEMAND_MODELS}")
+
+
+class NodeSampler:
+    """
+    Samples the nodes of a demand model in O(1) with an alias table, built once for the nodes it samples.
+    """
+    def __init__(self, model: str, network: Network, nodes: List['lightning_node.LightningNode'],
+                 zipf_exponent: float = 1.0):
+        self._nodes = nodes
+        self._sampler = None
+        if model == UNIFORM:
+            return
+        weights = get_node_weights(model, network, nodes, zipf_exponent)
+        if sum(1 for weight in weights if weight > 0) < 2:
+            raise ValueError(f"the {model} demand model needs at least 2 nodes with a positive weight")
+        self._sampler = AliasSampler.from_counts(list(range(len(nodes))), weights, 1)
+
+    def sample(self, generator=random) -> 'lightning_node.LightningNode':
+        """
+        @return: a node drawn with `generator` (the `random` module by default). The uniform model draws exactly as
+        `generator.choice` does.
+        """
+        if self._sampler is None:
+            return generator.choice(self._nodes)
+        return self._nodes[self._sampler.sample(generator)]
+
+
+def draw_amount(model: str, mean_amount: int, sigma: float, min_amount: int, max_amount: int, generator=random) -> int:
+    """
+    @return: an amount (in msat) drawn with `generator` (the `random` module by default) in the amount `model`, in
+    [`min_amount`, `max_amount`].
+    """
+    if model == NORMAL:
+        amount = generator.gauss(mean_amount, sigma)
+    elif model == LOGNORMAL:
+        amount = generator.lognormvariate(math.log(mean_amount), sigma)
+    else:
+        raise ValueError(f"unknown amount model {model}, expected one of {AMOUNT_MODELS}")
+    return int(min(max(amount, min_amount), max_amount))
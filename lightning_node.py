@@ -1,8 +1,10 @@
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Callable, Tuple
+import functools
 import random
-import string
 import contract_htlc as cn
 import channel_manager as cm
+import utils
+import simulation_context
 from singletons import *
 
 BLOCKS_IN_DAY = 144
@@ -10,23 +12,100 @@ BLOCKS_IN_DAY = 144
 APPEAL_PERIOD = 3  # the appeal period in blocks.
 STARTING_SERIAL = 0  # first serial number
 
+# A step of a walk along the route of a transaction: a method of the node of the step and its arguments.
+Hop = Tuple[Callable[..., Optional['Hop']], tuple]
+
+
+# the functions wrapped by `random_delay_node` by their qualified names.
+_DELAYED_FUNCTIONS: Dict[str, Callable[..., None]] = {}
+
+
+def _run_delayed_function(name: str, node: 'LightningNode', args: tuple):
+    _DELAYED_FUNCTIONS[name](node, *args)
+
 
 def random_delay_node(f):
     """
     Wrapper for delaying a given function's execution in order to simulate an internet connection delays.
+    The delayed call is scheduled by the name of `f` (not as a closure) so the scheduled functions can be pickled.
     @param f: The function to delay.
     """
+    _DELAYED_FUNCTIONS[f.__qualname__] = f
+
     def wrapper(self, *args):
-        number_of_block_to_wait = random.randint(1, self._max_number_of_block_to_respond)
-        FUNCTION_COLLECTOR_INSTANCE.append(lambda: f(self, *args), BLOCKCHAIN_INSTANCE.block_number + number_of_block_to_wait)
+        number_of_block_to_wait = random.randint(1, self.max_number_of_block_to_respond)
+        self._context.function_collector.append(functools.partial(_run_delayed_function, f.__qualname__, self, args),
+                                                self._context.blockchain.block_number + number_of_block_to_wait)
 
     return wrapper
 
 
+def walk_route(hop: Optional[Hop]):
+    """
+    Walks along the route of a transaction, starting with `hop`. Every hop does its node's part and returns the next hop (or
+    `None` when the walk ends), so a whole route is processed in this loop instead of in a call stack as deep as the route.
+    """
+    while hop is not None:
+        method, args = hop
+        hop = method(*args)
+
+
+def calculate_griefing_penalty(griefing_penalty_rate: float, amount_in_msat: float, delta_wait_time: int) -> int:
+    """
+    returns the griefing penalty for locking `amount_in_msat` for `delta_wait_time` blocks.
+    """
+    return int(griefing_penalty_rate * amount_in_msat * delta_wait_time * 10)
+
+
+class RoutePlan:
+    """
+    The amounts, griefing penalties and expiration blocks of all the hops of a transaction's route, computed once when the
+    transaction starts. Index 0 is the sender's and index i is of the i-th node in `nodes` (the last is the final node).
+    """
+    __slots__ = ('nodes', 'total_fee', 'amounts', 'penalties', 'delta_wait_times', 'expiration_block_numbers')
+
+    def __init__(self, nodes: List['LightningNode'], amount_in_msat: int, starting_block: int, use_griefing_penalty: bool):
+        """
+        @param nodes: the nodes of the route after the sender.
+        @param amount_in_msat: the amount the final node should get.
+        @param starting_block: the block number the transaction is sent at.
+        @param use_griefing_penalty: whether to compute the griefing penalties (otherwise they are all 0).
+        """
+        self.nodes = nodes
+        self.total_fee = RoutePlan.calculate_fee_for_route(nodes[:-1], amount_in_msat)
+        delta_wait_times = range((len(nodes) + 1) * BLOCKS_IN_DAY, 0, -BLOCKS_IN_DAY)
+        self.delta_wait_times = list(delta_wait_times)
+        self.expiration_block_numbers = [starting_block + delta_wait_time for delta_wait_time in delta_wait_times]
+        # every node adds the penalty for the amount it got (for its own waiting time) and forwards that amount minus its fee.
+        amount = amount_in_msat + self.total_fee
+        penalty = 0
+        self.amounts = [amount]
+        self.penalties = [penalty]
+        for node, delta_wait_time in zip(nodes, delta_wait_times[1:]):
+            if use_griefing_penalty:
+                penalty += calculate_griefing_penalty(node.griefing_penalty_rate, amount, delta_wait_time)
+            self.penalties.append(penalty)
+            amount -= node.get_fee_for_transfer_amount(amount)
+            self.amounts.append(amount)
+        self.amounts[-1] = 0  # the final node forwards nothing.
+
+    @staticmethod
+    def calculate_fee_for_route(path_nodes: List['LightningNode'], amount_in_msat: int) -> int:
+        """
+        returns the fee the nodes in `path_nodes` will consume for transferring `amount_in_msat` through them.
+        """
+        transfer_amount = amount_in_msat
+        for node in reversed(path_nodes):
+            transfer_amount = (transfer_amount + node.base_fee) / (1 - node.fee_percentage)
+        return int(round(transfer_amount) - amount_in_msat)
+
+
 class TransactionInfo:
     """
     Holds all the information regrading a specific transaction.
     """
+    __slots__ = ('_id', '_amount_in_mast', '_penalty', '_hash_x', '_hash_r', '_expiration_block_number', '_delta_wait_time',
+                 '_previous_node', '_next_node', '_starting_block', '_path_length')
 
     def __init__(self, transaction_id: int, amount_in_msat: int, penalty: int, hash_x: int, hash_r: int,
                  expiration_block_number: int, delta_wait_time: int, starting_block: int, path_length: int,
@@ -103,48 +182,92 @@ class TransactionInfo:
     def path_length(self) -> int:
         return self._path_length
 
-    @staticmethod
-    def generate_id() -> int:
-        id_str = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        return hash(id_str)
+
+class TransactionRecord:
+    """
+    Holds everything a node keeps regarding a specific transaction (a missing item is `None`).
+    """
+    __slots__ = ('info', 'final_node', 'forward_contract', 'cancellation_contract', 'htlc_contract', 'recyclables')
+
+    def __init__(self, info: Optional[TransactionInfo] = None, final_node: Optional['LightningNode'] = None,
+                 keep_recyclables: bool = False):
+        """
+        @param info: the information of the transaction.
+        @param final_node: the node the transaction is sent to (only kept by the sender).
+        @param keep_recyclables: whether to keep the objects created for the transaction (if the object pool is enabled).
+        """
+        self.info: Optional[TransactionInfo] = info
+        self.final_node: Optional['LightningNode'] = final_node
+        self.forward_contract: Optional['cn.ContractForward'] = None  # the forward contract sent to the next node.
+        self.cancellation_contract: Optional['cn.ContractCancellation'] = None  # sent to the previous node.
+        self.htlc_contract: Optional['cn.Contract_HTLC'] = None  # the htlc received from the previous node.
+        # the objects this node created for the transaction, released to the object pool when the record retires (only
+        # kept if the pool is enabled).
+        self.recyclables: Optional[list] = [] if keep_recyclables else None
+
+    @property
+    def is_empty(self) -> bool:
+        """
+        True iff nothing is kept regarding the transaction.
+        """
+        return self.info is None and self.final_node is None and self.forward_contract is None and \
+            self.cancellation_contract is None and self.htlc_contract is None
 
 
 class LightningNode:
     """
-    Represents an honest node in the network.
+    Represents an honest node in the network. Its scalar state (fees, penalty rate, delays and flags) is kept by
+    the node state store of its simulation context under the node's id.
     """
-
-    def __init__(self, balance: int, base_fee: int, fee_percentage: float = 0.01, griefing_penalty_rate: float = 0.01,
-                 delta: int = 40, max_number_of_block_to_respond: int = 4):
-        self._address = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        self._other_nodes_to_channels: Dict[str, cm.Channel] = {}
-        self._hash_image_x_to_preimage: Dict[int, str] = {}
-        self._hash_image_r_to_preimage: Dict[int, str] = {}
-        self._channels: Dict[str, cm.Channel] = {}
-        self._locked_funds: int = 0
-        self._locked_funds_since_block: int = 0
-        self._base_fee = base_fee
-        self._fee_percentage = fee_percentage
-        self._griefing_penalty_rate = griefing_penalty_rate
-        self._transaction_id_to_transaction_info: Dict[int, TransactionInfo] = {}
-        self._transaction_id_to_final_node: Dict[int, 'LightningNode'] = {}
-        self._transaction_id_to_forward_contracts: Dict[int, 'cn.ContractForward'] = {}
-        self._transaction_id_to_cancellation_contracts: Dict[int, 'cn.ContractCancellation'] = {}
-        self._transaction_id_to_htlc_contracts: Dict[int, 'cn.Contract_HTLC'] = {}
-        self._delta = delta
-        self._max_number_of_block_to_respond = max_number_of_block_to_respond
-        self._is_victim = False
-
-        BLOCKCHAIN_INSTANCE.add_node(self, balance)
+    __slots__ = ('_context', '_address', '_node_id', '_other_nodes_to_channels', '_hash_image_to_preimage', '_channels',
+                 '_transaction_id_to_record')
+
+    def __init__(self, context: 'simulation_context.SimulationContext', balance: int, base_fee: int,
+                 fee_percentage: float = 0.01, griefing_penalty_rate: float = 0.01, delta: int = 40,
+                 max_number_of_block_to_respond: int = 4):
+        self._context = context
+        self._address = self._context.secret_generator.generate_address()  # only used for output.
+        self._other_nodes_to_channels: Dict[int, cm.Channel] = {}  # other node id to the channel with it.
+        # the secrets `x` and `r` this node generated by their hashes (different secrets never share a hash).
+        self._hash_image_to_preimage: Dict[int, int] = {}
+        self._channels: Dict[int, cm.Channel] = {}  # channel id to channel.
+        self._transaction_id_to_record: Dict[int, TransactionRecord] = {}
+
+        self._node_id: int = self._context.blockchain.add_node(self, balance)
+        self._context.node_state_store.add_node(self._node_id, base_fee, fee_percentage, griefing_penalty_rate, delta,
+                                                max_number_of_block_to_respond)
+        self._context.locked_funds_integrator.add_node(self)
+
+    def clone(self, context: 'simulation_context.SimulationContext') -> 'LightningNode':
+        """
+        Returns a copy of this node (type, id, address and attacker settings) in `context`, without channels or transactions.
+        The state `context` keeps for the node under its id is copied separately (see `network.NetworkTemplate`).
+        """
+        node = object.__new__(type(self))
+        node._context = context
+        node._address = self._address
+        node._node_id = self._node_id
+        node._other_nodes_to_channels = {}
+        node._hash_image_to_preimage = {}
+        node._channels = {}
+        node._transaction_id_to_record = {}
+        return node
+
+    def add_channel(self, other_node: 'LightningNode', channel: cm.Channel):
+        """
+        Adds `channel`, an existing channel with `other_node` (used when copying a network).
+        """
+        self._other_nodes_to_channels[other_node.node_id] = channel
+        self._channels[channel.channel_state.channel_data.channel_id] = channel
 
     def set_as_victim(self):
-        self._is_victim = True
+        self._context.node_state_store.set_flag(self._node_id, utils.NodeStateStore.VICTIM)
 
     def set_base_fee(self, base_fee):
-        self._base_fee = base_fee
+        self._context.node_state_store.base_fees[self._node_id] = base_fee
 
     def set_fee_percentage(self, fee_percentage):
-        self._fee_percentage = fee_percentage
+        self._context.node_state_store.fee_percentages[self._node_id] = fee_percentage
 
     @property
     def address(self):
@@ -153,39 +276,123 @@ class LightningNode:
         """
         return self._address
 
+    @property
+    def context(self) -> 'simulation_context.SimulationContext':
+        """
+        Returns the simulation context this node lives in.
+        """
+        return self._context
+
+    @property
+    def node_id(self) -> int:
+        """
+        Returns the id of this node (assigned by the blockchain).
+        """
+        return self._node_id
+
     @property
     def locked_funds(self):
         """
-        Returns the address of this node.
+        Returns the funds this node currently has locked in its channels.
         """
-        return self._locked_funds
+        return self._context.locked_funds_integrator.get_locked_funds(self._node_id)
 
     @property
     def fee_percentage(self):
-        return self._fee_percentage
+        return self._context.node_state_store.fee_percentages[self._node_id]
 
     @property
     def base_fee(self):
-        return self._base_fee
+        return self._context.node_state_store.base_fees[self._node_id]
+
+    @property
+    def griefing_penalty_rate(self):
+        return self._context.node_state_store.griefing_penalty_rates[self._node_id]
+
+    @property
+    def delta(self):
+        return self._context.node_state_store.deltas[self._node_id]
+
+    @property
+    def max_number_of_block_to_respond(self):
+        return self._context.node_state_store.max_numbers_of_blocks_to_respond[self._node_id]
 
     def _get_log_prefix(self):
-        return "Victim: " if self._is_victim else ""
+        return "Victim: " if self._context.node_state_store.has_flag(self._node_id, utils.NodeStateStore.VICTIM) else ""
+
+    @property
+    def log_prefix(self):
+        """
+        Returns the prefix of the metrics this node logs.
+        """
+        return self._get_log_prefix()
 
     def log_avg_metric(self, key, value):
-        METRICS_COLLECTOR_INSTANCE.average(self._get_log_prefix() + key, value)
+        self._context.metrics_collector.average(self._get_log_prefix() + key, value)
 
     def log_sum_metric(self, key, value):
-        METRICS_COLLECTOR_INSTANCE.sum(self._get_log_prefix() + key, value)
+        self._context.metrics_collector.sum(self._get_log_prefix() + key, value)
 
     def log_count_metric(self, key):
-        METRICS_COLLECTOR_INSTANCE.count(self._get_log_prefix() + key)
+        self._context.metrics_collector.count(self._get_log_prefix() + key)
+
+    def _set_info(self, info: TransactionInfo, retire_block_number: int) -> TransactionRecord:
+        """
+        sets `info` in the record of its transaction, creates the record if it does not exist and tracks it so it is retired
+        after `retire_block_number`.
+        """
+        record = self._transaction_id_to_record.get(info.id)
+        if record is None:
+            record = self._transaction_id_to_record[info.id] = TransactionRecord(
+                keep_recyclables=self._context.object_pool.enabled)
+            self._context.transaction_lifecycle.track(self, info.id, retire_block_number, record)
+        record.info = info
+        if record.recyclables is not None:
+            record.recyclables.append(info)
+        return record
+
+    def _get_info(self, transaction_id: int) -> Optional[TransactionInfo]:
+        """
+        returns the information of the given transaction, `None` if it is not kept.
+        """
+        record = self._transaction_id_to_record.get(transaction_id)
+        return record.info if record is not None else None
+
+    def _discard_record_if_empty(self, transaction_id: int, record: TransactionRecord):
+        if record.is_empty:
+            self._retire_record(transaction_id, record, False)
+
+    def _retire_record(self, transaction_id: int, record: TransactionRecord, expired: bool):
+        """
+        Deletes the record of the given transaction, and if this node is its sender, the secrets the final node generated for
+        it (they are no longer needed by anyone once the sender is done).
+        """
+        del self._transaction_id_to_record[transaction_id]
+        if record.final_node is not None and record.info is not None:
+            record.final_node.forget_secrets(record.info.hash_x, record.info.hash_r)
+        self._context.transaction_lifecycle.notify_of_retired(expired)
+
+    def retire_expired_transaction(self, transaction_id: int):
+        """
+        Used to retire whatever this node still keeps regarding `transaction_id` after its expiration block passed.
+        """
+        record = self._transaction_id_to_record.get(transaction_id)
+        if record is not None:
+            self._retire_record(transaction_id, record, True)
+
+    @property
+    def live_transactions_count(self) -> int:
+        """
+        Returns the number of transactions this node currently keeps state for.
+        """
+        return len(self._transaction_id_to_record)
 
     def get_capacity_left(self, other_node):
         """
         returns the capacity left in the channel between `self` and `other_node`.
         """
-        if other_node.address in self._other_nodes_to_channels:
-            channel = self._other_nodes_to_channels[other_node.address]
+        channel = self._other_nodes_to_channels.get(other_node.node_id)
+        if channel is not None:
             return channel.amount_owner1_can_transfer_to_owner2 if channel.is_owner1(self) else \
                 channel.amount_owner2_can_transfer_to_owner1
 
@@ -193,7 +400,7 @@ class LightningNode:
         """
         returns the fee this node will consume for the given amount.
         """
-        return self.base_fee + int(self._fee_percentage * amount_in_mast)
+        return self.base_fee + int(self.fee_percentage * amount_in_mast)
 
     def establish_channel(self, other_node: 'LightningNode', amount_in_msat: int, is_bad_channel=False) -> cm.Channel:
         """
@@ -202,8 +409,8 @@ class LightningNode:
         channel_data = cm.ChannelData(self, other_node)
         default_split = cm.MessageState(amount_in_msat, 0)
         channel = other_node.notify_of_channel(channel_data, default_split, is_bad_channel)
-        self._other_nodes_to_channels[other_node.address] = channel
-        self._channels[channel_data.address] = channel
+        self._other_nodes_to_channels[other_node.node_id] = channel
+        self._channels[channel_data.channel_id] = channel
 
         return channel
 
@@ -212,9 +419,8 @@ class LightningNode:
         Used for notifying this node of a channel being created.
         """
         channel = cm.Channel(channel_data, default_split, is_bad_channel)
-        default_split.channel_address = channel_data.address
-        self._other_nodes_to_channels[channel_data.owner1.address] = channel
-        self._channels[channel_data.address] = channel
+        self._other_nodes_to_channels[channel_data.owner1.node_id] = channel
+        self._channels[channel_data.channel_id] = channel
         return channel
 
     def add_money_to_channel(self, channel: cm.Channel, amount_in_mast: int):
@@ -233,91 +439,83 @@ class LightningNode:
         hash_x, hash_r = final_node.generate_secret_x_hash(), final_node.generate_secret_r_hash()
         node_to_send = nodes_between[0]
 
-        total_fee = self._calculate_fee_for_route(nodes_between[:-1], amount_in_msat)
-        self.log_avg_metric(TOTAL_FEE, total_fee)
+        block_number = self._context.blockchain.block_number
+        plan = RoutePlan(nodes_between, amount_in_msat, block_number, True)
+        self.log_avg_metric(TOTAL_FEE, plan.total_fee)
 
-        id = TransactionInfo.generate_id()
-        delta_waiting_time = ((len(nodes_between) + 1) * BLOCKS_IN_DAY)
-        info = TransactionInfo(id, amount_in_msat + total_fee, 0, hash_x, hash_r,
-                               BLOCKCHAIN_INSTANCE.block_number + delta_waiting_time, delta_waiting_time,
-                               BLOCKCHAIN_INSTANCE.block_number, len(nodes_between), next_node=node_to_send)
-        self._transaction_id_to_transaction_info[id] = info
-        self._transaction_id_to_final_node[id] = final_node
-        self.send_transaction_information(node_to_send, info, nodes_between[1:])
-
-    @staticmethod
-    def _calculate_fee_for_route(path_nodes: List['LightningNode'], amount_in_msat: int) -> int:
-        transfer_amount = amount_in_msat
-        for node in reversed(path_nodes):
-            transfer_amount = (transfer_amount + node.base_fee) / (1 - node.fee_percentage)
-        return int(round(transfer_amount) - amount_in_msat)
-
-    def _calculate_griefing_penalty(self, amount_in_msat: int, waiting_time):
-        return int(self._griefing_penalty_rate * amount_in_msat * waiting_time * 10)
+        id = self._context.secret_generator.generate_id()
+        info = self._context.object_pool.acquire(TransactionInfo, id, plan.amounts[0], plan.penalties[0], hash_x, hash_r,
+                                                 plan.expiration_block_numbers[0], plan.delta_wait_times[0], block_number,
+                                                 len(nodes_between), next_node=node_to_send)
+        self._set_info(info, info.expiration_block_number).final_node = final_node
+        walk_route(self.send_transaction_information(node_to_send, info, plan, 1))
 
     def send_transaction_information(self, node_to_send: 'LightningNode', transaction_info: TransactionInfo,
-                                     nodes_between: List['LightningNode']):
+                                     plan: RoutePlan, index: int) -> Hop:
         """
-        Sends a transaction information `transaction_info` to the next node `node_to_send` in the path `nodes_between`.
+        Sends a transaction information `transaction_info` to the next node `node_to_send` in the route of `plan` (at `index`
+        in it).
+        @return: the hop of `node_to_send`.
         """
-        node_to_send.receive_transaction_information(self, transaction_info, nodes_between)
+        return node_to_send.receive_transaction_information, (self, transaction_info, plan, index)
 
     def receive_transaction_information(self, sender: 'LightningNode', previous_transaction_info: TransactionInfo,
-                                        nodes_between: List['LightningNode']):
+                                        plan: RoutePlan, index: int) -> Optional[Hop]:
         """
-        Receives a transaction information `previous_transaction_info`, deduces it's own `TransactionInfo` from it and
-        sends information (via `send_transaction_information`) to the next node in the path `nodes_between` if exists, otherwise
-        starts sending cancellation contracts backwards in the path.
+        Receives a transaction information `previous_transaction_info`, deduces it's own `TransactionInfo` from it (and its
+        amounts from `plan`, this node is at `index` in it) and sends information (via `send_transaction_information`) to the
+        next node in the route if exists, otherwise starts sending cancellation contracts backwards in the path.
+        @return: the next hop.
         """
-        fee = self.get_fee_for_transfer_amount(previous_transaction_info.amount_in_msat)
-        amount_in_msat = previous_transaction_info.amount_in_msat - fee
-        waiting_time = previous_transaction_info.expiration_block_number - BLOCKS_IN_DAY
-        delta_waiting_time = previous_transaction_info.delta_wait_time - BLOCKS_IN_DAY
-        griefing_penalty = previous_transaction_info.penalty + \
-                           self._calculate_griefing_penalty(previous_transaction_info.amount_in_msat, delta_waiting_time)
-
-        if nodes_between:
-            node_to_send = nodes_between[0]
+        if index < len(plan.nodes):
+            node_to_send = plan.nodes[index]
             if type(node_to_send) == LightningNode:
                 self.log_count_metric(TRANSACTIONS_PASSED_THROUGH)
-            info = TransactionInfo(previous_transaction_info.id, amount_in_msat, griefing_penalty,
-                                   previous_transaction_info.hash_x, previous_transaction_info.hash_r, waiting_time,
-                                   delta_waiting_time, previous_transaction_info.starting_block,
-                                   previous_transaction_info.path_length, sender, node_to_send)
-            self._transaction_id_to_transaction_info[previous_transaction_info.id] = info
-            self.send_transaction_information(node_to_send, info, nodes_between[1:])
         else:
-            info = TransactionInfo(previous_transaction_info.id, 0, griefing_penalty,
-                                   previous_transaction_info.hash_x, previous_transaction_info.hash_r, waiting_time,
-                                   delta_waiting_time, previous_transaction_info.starting_block,
-                                   previous_transaction_info.path_length, sender)
-            self._transaction_id_to_transaction_info[info.id] = info
-            FUNCTION_COLLECTOR_INSTANCE.append(lambda: self._check_if_forward_contract_is_available(info.id),
-                                               BLOCKCHAIN_INSTANCE.block_number + self._delta)
-            self.send_cancellation_contract(info.id)
+            node_to_send = None
+        info = self._context.object_pool.acquire(TransactionInfo, previous_transaction_info.id, plan.amounts[index],
+                                                 plan.penalties[index], previous_transaction_info.hash_x,
+                                                 previous_transaction_info.hash_r, plan.expiration_block_numbers[index],
+                                                 plan.delta_wait_times[index], previous_transaction_info.starting_block,
+                                                 previous_transaction_info.path_length, sender, node_to_send)
+        self._set_info(info, info.expiration_block_number)
+        if node_to_send is not None:
+            return self.send_transaction_information(node_to_send, info, plan, index + 1)
+        else:
+            transaction_id = info.id  # info might be recycled before the check
+            self._context.function_collector.append(functools.partial(self._check_if_forward_contract_is_available,
+                                                                      transaction_id),
+                                                    self._context.blockchain.block_number + self.delta)
+            return self.send_cancellation_contract(transaction_id)
 
-    def send_cancellation_contract(self, transaction_id: int):
+    def send_cancellation_contract(self, transaction_id: int) -> Hop:
         """
         Sends a cancellation contract to the previous node in the path of the transaction. All needed information is in the
         transaction information this node got when received it in `receive_transaction_information`, which corresponds to
         `transaction_id`.
+        @return: the hop of the previous node.
         """
-        assert transaction_id in self._transaction_id_to_transaction_info
-        info = self._transaction_id_to_transaction_info[transaction_id]
-        channel = self._other_nodes_to_channels[info.previous_node.address]
+        record = self._transaction_id_to_record.get(transaction_id)
+        assert record is not None and record.info is not None
+        info = record.info
+        channel = self._other_nodes_to_channels[info.previous_node.node_id]
 
-        cancellation_contract = cn.ContractCancellation(transaction_id, info.penalty, info.hash_x, info.hash_r,
-                                                        info.expiration_block_number, channel, self, info.previous_node)
-        self._transaction_id_to_cancellation_contracts[transaction_id] = cancellation_contract
-        info.previous_node.receive_cancellation_contract(transaction_id, cancellation_contract)
+        cancellation_contract = self._context.object_pool.acquire(cn.ContractCancellation, transaction_id, info.penalty,
+                                                                  info.hash_x, info.hash_r, info.expiration_block_number,
+                                                                  channel, self, info.previous_node)
+        record.cancellation_contract = cancellation_contract
+        if record.recyclables is not None:
+            record.recyclables.append(cancellation_contract)
+        return info.previous_node.receive_cancellation_contract, (transaction_id, cancellation_contract)
 
-    def receive_cancellation_contract(self, transaction_id: id, contract: 'cn.ContractCancellation'):
+    def receive_cancellation_contract(self, transaction_id: id, contract: 'cn.ContractCancellation') -> Optional[Hop]:
         """
         Receives the cancellation contract `contract` and accepts it if can be accepted. Uses the information that corresponds to
         `transaction_id` for calling the previous node in the transaction's path if exists, otherwise starts sending a forward
         contract.
+        @return: the next hop.
         """
-        info = self._transaction_id_to_transaction_info[transaction_id]
+        info = self._transaction_id_to_record[transaction_id].info
 
         if not contract.attached_channel.add_contract(contract):
             self.log_count_metric(ADD_CANCELLATION_CONTRACT_FAILED)
@@ -325,44 +523,48 @@ class LightningNode:
         contract.accept_contract()
 
         if info.previous_node is not None:
-            self.send_cancellation_contract(transaction_id)
-        else:
-            self.send_forward_contract(transaction_id)
+            return self.send_cancellation_contract(transaction_id)
+        return self.send_forward_contract(transaction_id)
 
     def _check_if_forward_contract_is_available(self, transaction_id: int):
-        if transaction_id not in self._transaction_id_to_cancellation_contracts or \
-                transaction_id in self._transaction_id_to_forward_contracts:
+        record = self._transaction_id_to_record.get(transaction_id)
+        if record is None or record.cancellation_contract is None or record.forward_contract is not None:
             return
 
-        info = self._transaction_id_to_transaction_info[transaction_id]
-        r = self._hash_image_r_to_preimage[info.hash_r]
+        r = self._hash_image_to_preimage[record.info.hash_r]
         self.terminate_transaction(transaction_id, r)
 
-    def send_forward_contract(self, transaction_id: int):
+    def send_forward_contract(self, transaction_id: int) -> Hop:
         """
         Sends a forward contract to the next node in the path of the transaction. All needed information is in the
         transaction information this node got when received it in `receive_transaction_information`, which corresponds to
         `transaction_id`.
+        @return: the hop of the next node.
         """
-        assert transaction_id in self._transaction_id_to_transaction_info
+        record = self._transaction_id_to_record.get(transaction_id)
+        assert record is not None and record.info is not None
 
-        info = self._transaction_id_to_transaction_info[transaction_id]
-        channel = self._other_nodes_to_channels[info.next_node.address]
+        info = record.info
+        channel = self._other_nodes_to_channels[info.next_node.node_id]
 
-        forward_contract = cn.ContractForward(transaction_id, info.amount_in_msat, info.hash_x, info.hash_r,
-                                              info.expiration_block_number, channel, self, info.next_node)
-        self._transaction_id_to_forward_contracts[transaction_id] = forward_contract
-        info.next_node.receive_forward_contract(transaction_id, forward_contract)
+        forward_contract = self._context.object_pool.acquire(cn.ContractForward, transaction_id, info.amount_in_msat,
+                                                             info.hash_x, info.hash_r, info.expiration_block_number,
+                                                             channel, self, info.next_node)
+        record.forward_contract = forward_contract
+        if record.recyclables is not None:
+            record.recyclables.append(forward_contract)
+        return info.next_node.receive_forward_contract, (transaction_id, forward_contract)
 
-    def receive_forward_contract(self, transaction_id: int, contract: 'cn.ContractForward'):
+    def receive_forward_contract(self, transaction_id: int, contract: 'cn.ContractForward') -> Optional[Hop]:
         """
         Receives the forward contract `contract` and accepts it if can be accepted. Uses the information that corresponds to
         `transaction_id` for calling the next node in the transaction's path if exists, otherwise starts resolving the
         transaction with the previous node in the path.
+        @return: the next hop.
         """
-        if transaction_id not in self._transaction_id_to_transaction_info:
+        info = self._get_info(transaction_id)
+        if info is None:
             return
-        info = self._transaction_id_to_transaction_info[transaction_id]
 
         if not contract.attached_channel.add_contract(contract):
             self.log_count_metric(ADD_FORWARD_CONTRACT_FAILED)
@@ -370,67 +572,75 @@ class LightningNode:
         contract.accept_contract()
 
         if info.next_node is not None:
-            self.send_forward_contract(transaction_id)
-        else:
-            self._resolve_transaction_after_receiving_forward_contract(info)
+            return self.send_forward_contract(transaction_id)
+        self._resolve_transaction_after_receiving_forward_contract(info)
 
     def _resolve_transaction_after_receiving_forward_contract(self, transaction_info: 'TransactionInfo'):
-        x = self._hash_image_x_to_preimage[transaction_info.hash_x]
-        del self._hash_image_x_to_preimage[transaction_info.hash_x]
+        x = self._hash_image_to_preimage[transaction_info.hash_x]
+        del self._hash_image_to_preimage[transaction_info.hash_x]
         self.resolve_transaction(transaction_info.id, x)
 
     @random_delay_node
-    def resolve_transaction(self, transaction_id: int, x: str):
+    def resolve_transaction(self, transaction_id: int, x: int):
         """
         Settles the contracts that correspond to the given `transaction_id` with the given pre image `x` and calls
         `resolve_transaction` on the previous node in the transaction path if exists.
         """
-        if transaction_id not in self._transaction_id_to_transaction_info:
+        record = self._transaction_id_to_record.get(transaction_id)
+        if record is None or record.info is None:
             return  # might get terminated beforehand
-        info = self._transaction_id_to_transaction_info[transaction_id]
+        info = record.info
 
-        if info.next_node is not None and transaction_id in self._transaction_id_to_forward_contracts:
-            forward_contract = self._transaction_id_to_forward_contracts[transaction_id]
-            del self._transaction_id_to_forward_contracts[transaction_id]
+        if info.next_node is not None and record.forward_contract is not None:
+            forward_contract = record.forward_contract
+            record.forward_contract = None
             if forward_contract.is_expired:
                 return
             forward_contract.report_x(x)
             self.log_count_metric(TRANSACTIONS_PASSED_SUCCESSFUL)
 
         if info.previous_node is None:
-            del self._transaction_id_to_final_node[info.id]
+            self._retire_record(transaction_id, record, False)
             self.log_count_metric(TRANSACTION_SUCCESSFUL_COUNT)
             self.log_avg_metric(TRANSACTION_WAITING_TIME_BEFORE_COMPLETING,
-                                BLOCKCHAIN_INSTANCE.block_number - info.starting_block)
+                                self._context.blockchain.block_number - info.starting_block)
             return
 
-        if transaction_id not in self._transaction_id_to_cancellation_contracts:
+        if record.cancellation_contract is None:
             return
-        cancellation_contract = self._transaction_id_to_cancellation_contracts[transaction_id]
-        del self._transaction_id_to_cancellation_contracts[transaction_id]
+        cancellation_contract = record.cancellation_contract
+        record.cancellation_contract = None
         if cancellation_contract.is_expired:
             return
         cancellation_contract.report_x(x)
 
-        if transaction_id in self._transaction_id_to_transaction_info:
-            del self._transaction_id_to_transaction_info[transaction_id]
+        record.info = None
+        self._discard_record_if_empty(transaction_id, record)
 
         info.previous_node.resolve_transaction(transaction_id, x)
 
-    def terminate_transaction(self, transaction_id: int, r: str):
+    def terminate_transaction(self, transaction_id: int, r: int):
         """
-        Terminates the contracts that correspond to the given `transaction_id` with the given pre image `r` and calls
-        `resolve_transaction` on the previous node in the transaction path if exists.
+        Terminates the contracts that correspond to the given `transaction_id` with the given pre image `r`, and so on backwards
+        in the transaction path.
+        """
+        walk_route((self._terminate_transaction_hop, (transaction_id, r)))
+
+    def _terminate_transaction_hop(self, transaction_id: int, r: int) -> Optional[Hop]:
+        """
+        Terminates the contracts of this node that correspond to the given `transaction_id` with the given pre image `r`.
+        @return: the hop of the previous node in the transaction path if exists.
         """
-        if transaction_id not in self._transaction_id_to_transaction_info:
+        record = self._transaction_id_to_record.get(transaction_id)
+        if record is None or record.info is None:
             return
-        info = self._transaction_id_to_transaction_info[transaction_id]
+        info = record.info
         if type(self) == LightningNode and info.next_node is None:
             self.log_count_metric(TERMINATE_TRANSACTION)
 
-        if transaction_id in self._transaction_id_to_forward_contracts:
-            forward_contract = self._transaction_id_to_forward_contracts[transaction_id]
-            del self._transaction_id_to_forward_contracts[transaction_id]
+        if record.forward_contract is not None:
+            forward_contract = record.forward_contract
+            record.forward_contract = None
             if forward_contract.is_expired or not forward_contract.is_valid:
                 return
             forward_contract.report_r(r)
@@ -438,14 +648,15 @@ class LightningNode:
         if info.previous_node is None:
             return
 
-        cancellation_contract = self._transaction_id_to_cancellation_contracts[transaction_id]
-        del self._transaction_id_to_cancellation_contracts[transaction_id]
+        cancellation_contract = record.cancellation_contract
+        record.cancellation_contract = None
         if cancellation_contract.is_expired or not cancellation_contract.is_valid:
             return
         cancellation_contract.report_r(r)
 
-        del self._transaction_id_to_transaction_info[transaction_id]
-        info.previous_node.terminate_transaction(transaction_id, r)
+        record.info = None
+        self._discard_record_if_empty(transaction_id, record)
+        return info.previous_node._terminate_transaction_hop, (transaction_id, r)
 
     def start_regular_htlc_transaction(self, final_node: 'LightningNode', amount_in_msat: int,
                                        nodes_between: List['LightningNode']):
@@ -456,77 +667,88 @@ class LightningNode:
         hash_x = final_node.generate_secret_x_hash()
         assert nodes_between
         node_to_send = nodes_between[0]
-        total_fee = self._calculate_fee_for_route(nodes_between[:-1], amount_in_msat)
-        self.log_avg_metric(TOTAL_FEE, total_fee)
+        block_number = self._context.blockchain.block_number
+        plan = RoutePlan(nodes_between, amount_in_msat, block_number, False)
+        self.log_avg_metric(TOTAL_FEE, plan.total_fee)
 
-        id = TransactionInfo.generate_id()
-        delta_waiting_time = ((len(nodes_between) + 1) * BLOCKS_IN_DAY)
-        info = TransactionInfo(id, amount_in_msat + total_fee, 0, hash_x, 0, BLOCKCHAIN_INSTANCE.block_number + delta_waiting_time,
-                               delta_waiting_time, BLOCKCHAIN_INSTANCE.block_number, len(nodes_between), next_node=node_to_send)
-        self._transaction_id_to_transaction_info[id] = info
-        self.send_regular_htlc(info, nodes_between[1:])
+        id = self._context.secret_generator.generate_id()
+        info = self._context.object_pool.acquire(TransactionInfo, id, plan.amounts[0], 0, hash_x, 0,
+                                                 plan.expiration_block_numbers[0], plan.delta_wait_times[0], block_number,
+                                                 len(nodes_between), next_node=node_to_send)
+        self._set_info(info, info.expiration_block_number).final_node = final_node
+        walk_route(self.send_regular_htlc(info, plan, 1))
 
-    def send_regular_htlc(self, transaction_info: TransactionInfo, nodes_between: List['LightningNode']):
+    def send_regular_htlc(self, transaction_info: TransactionInfo, plan: RoutePlan, index: int) -> Hop:
         """
         Creates a forward contract (which acts as a regular htlc) `ContractForward` and sends it with the
-        current `TransactionInfo` to the `next_node` in `transaction_info`
+        current `TransactionInfo` to the `next_node` in `transaction_info` (at `index` in the route of `plan`).
+        @return: the hop of the next node.
         """
-        channel = self._other_nodes_to_channels[transaction_info.next_node.address]
+        channel = self._other_nodes_to_channels[transaction_info.next_node.node_id]
 
-        contract = cn.ContractForward(transaction_info.id, transaction_info.amount_in_msat, transaction_info.hash_x, 0,
-                                      transaction_info.expiration_block_number, channel, self, transaction_info.next_node)
-        transaction_info.next_node.receive_regular_htlc(self, transaction_info, contract, nodes_between)
+        contract = self._context.object_pool.acquire(cn.ContractForward, transaction_info.id,
+                                                     transaction_info.amount_in_msat, transaction_info.hash_x, 0,
+                                                     transaction_info.expiration_block_number, channel, self,
+                                                     transaction_info.next_node)
+        recyclables = self._transaction_id_to_record[transaction_info.id].recyclables
+        if recyclables is not None:
+            recyclables.append(contract)
+        return transaction_info.next_node.receive_regular_htlc, (self, transaction_info, contract, plan, index)
 
     def receive_regular_htlc(self, sender: 'LightningNode', previous_transaction_info: TransactionInfo,
-                             contract: 'cn.Contract_HTLC', nodes_between: List['LightningNode']):
-        """
-        Receives a forward contract from `sender`, uses `previous_transaction_info` to deduce it's own `TransactionInfo` and sends
-        a new contract to the next node in `nodes_between` if exists, otherwise starts resolving the transaction with the
-        previous node.
-        """
-        node_to_send = nodes_between[0] if nodes_between else None
-        fee = self.get_fee_for_transfer_amount(previous_transaction_info.amount_in_msat)
-        amount_in_msat = previous_transaction_info.amount_in_msat - fee if nodes_between else 0
-        delta_waiting_time = previous_transaction_info.delta_wait_time - BLOCKS_IN_DAY
-        new_info = TransactionInfo(previous_transaction_info.id, amount_in_msat, 0, previous_transaction_info.hash_x, 0,
-                                   previous_transaction_info.expiration_block_number - BLOCKS_IN_DAY, delta_waiting_time,
-                                   previous_transaction_info.starting_block, previous_transaction_info.path_length,
-                                   sender, node_to_send)
-
-        self._transaction_id_to_transaction_info[new_info.id] = new_info
-        self._transaction_id_to_htlc_contracts[new_info.id] = contract
+                             contract: 'cn.Contract_HTLC', plan: RoutePlan, index: int) -> Optional[Hop]:
+        """
+        Receives a forward contract from `sender`, uses `previous_transaction_info` to deduce it's own `TransactionInfo` (and
+        `plan` for its amounts, this node is at `index` in it) and sends a new contract to the next node in the route if
+        exists, otherwise starts resolving the transaction with the previous node.
+        @return: the next hop.
+        """
+        has_next_node = index < len(plan.nodes)
+        node_to_send = plan.nodes[index] if has_next_node else None
+        new_info = self._context.object_pool.acquire(TransactionInfo, previous_transaction_info.id, plan.amounts[index],
+                                                     0, previous_transaction_info.hash_x, 0,
+                                                     plan.expiration_block_numbers[index], plan.delta_wait_times[index],
+                                                     previous_transaction_info.starting_block,
+                                                     previous_transaction_info.path_length, sender, node_to_send)
+
+        # the received contract expires after this node's info, so keep the record until it does.
+        record = self._set_info(new_info, contract.expiration_block_number)
+        record.htlc_contract = contract
         if not contract.attached_channel.add_contract(contract):
             return
         contract.accept_contract()
 
-        if nodes_between:
+        if has_next_node:
             self.log_count_metric(TRANSACTIONS_PASSED_THROUGH)
-            self.send_regular_htlc(new_info, nodes_between[1:])
+            return self.send_regular_htlc(new_info, plan, index + 1)
         else:
-            x = self._hash_image_x_to_preimage[new_info.hash_x]
+            x = self._hash_image_to_preimage[new_info.hash_x]
             self.resolve_htlc_transaction(new_info.id, x)
 
     @random_delay_node
-    def resolve_htlc_transaction(self, transaction_id: int, x: str):
+    def resolve_htlc_transaction(self, transaction_id: int, x: int):
         """
         Resolves the transaction the corresponds to `transaction_id` with the given pre-image `x`.
         """
-        if transaction_id not in self._transaction_id_to_transaction_info:
+        record = self._transaction_id_to_record.get(transaction_id)
+        if record is None or record.info is None:
             return
-        info = self._transaction_id_to_transaction_info[transaction_id]
-        del self._transaction_id_to_transaction_info[transaction_id]
+        info = record.info
 
         if info.previous_node is not None:
-            contract = self._transaction_id_to_htlc_contracts[transaction_id]
-            del self._transaction_id_to_htlc_contracts[transaction_id]
+            contract = record.htlc_contract
+            record.info = None
+            record.htlc_contract = None
+            self._discard_record_if_empty(transaction_id, record)
             if contract.is_expired:
                 return
             contract.report_x(x)
             self.log_count_metric(TRANSACTIONS_PASSED_SUCCESSFUL)
         else:
+            self._retire_record(transaction_id, record, False)
             self.log_count_metric(TRANSACTION_SUCCESSFUL_COUNT)
             self.log_avg_metric(TRANSACTION_WAITING_TIME_BEFORE_COMPLETING,
-                                BLOCKCHAIN_INSTANCE.block_number - info.starting_block)
+                                self._context.blockchain.block_number - info.starting_block)
             return
 
         info.previous_node.resolve_htlc_transaction(transaction_id, x)
@@ -535,85 +757,118 @@ class LightningNode:
         """
         Generates a new random key `x` (acts as a transaction confirmation key) and returns it's hash.
         """
-        x = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        hash_image = hash(x)
-        self._hash_image_x_to_preimage[hash_image] = x
+        x = self._context.secret_generator.generate_secret()
+        hash_image = utils.hash_secret(x)
+        self._hash_image_to_preimage[hash_image] = x
         return hash_image
 
     def generate_secret_r_hash(self) -> int:
         """
         Generates a new random key `r` (acts as a transaction cancellation key) and returns it's hash.
         """
-        r = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        hash_image = hash(r)
-        self._hash_image_r_to_preimage[hash_image] = r
+        r = self._context.secret_generator.generate_secret()
+        hash_image = utils.hash_secret(r)
+        self._hash_image_to_preimage[hash_image] = r
         return hash_image
 
+    def forget_secrets(self, hash_x: int, hash_r: int):
+        """
+        Deletes the secrets this node generated with the given hashes (if still kept).
+        """
+        self._hash_image_to_preimage.pop(hash_x, None)
+        self._hash_image_to_preimage.pop(hash_r, None)
+
     def close_channel(self, node):
         """
         Closing the channel between `self` and `node`.
         """
-        if node.address not in self._other_nodes_to_channels:
-            return
+        channel = self.detach_channel(node)
+        if channel is not None:
+            channel.close_channel()
 
-        channel = self._other_nodes_to_channels[node.address]
-        del self._other_nodes_to_channels[node.address]
-        if channel.channel_state.channel_data.address not in self._channels:
-            return
-        channel.close_channel()
+    def detach_channel(self, node) -> Optional[cm.Channel]:
+        """
+        Stops using the channel between `self` and `node`.
+        @return: the channel if it should be closed, `None` if there is none or it is already closed.
+        """
+        if node.node_id not in self._other_nodes_to_channels:
+            return None
+
+        channel = self._other_nodes_to_channels[node.node_id]
+        del self._other_nodes_to_channels[node.node_id]
+        if channel.channel_state.channel_data.channel_id not in self._channels:
+            return None
+        return channel
 
     def notify_of_change_in_locked_funds(self, locked_fund):
         """
         Used to notify this node of a change in its locked funds in one of its channels.
         """
-        total_last_locked_fund = self._locked_funds * (BLOCKCHAIN_INSTANCE.block_number - self._locked_funds_since_block)
-        assert total_last_locked_fund >= 0
-        if total_last_locked_fund > 0:
-            self.log_sum_metric(TOTAL_LOCKED_FUND_IN_EVERY_BLOCKS, total_last_locked_fund)
-
-        self._locked_funds += locked_fund
-        self._locked_funds_since_block = BLOCKCHAIN_INSTANCE.block_number
+        self._context.locked_funds_integrator.update(self._node_id, locked_fund)
 
     def notify_of_closed_channel(self, channel: 'cm.Channel', other_node: 'LightningNode'):
         """
         Used to notify this node that one of its channels closed.
         """
-        if channel.channel_state.channel_data.address not in self._channels:
+        if channel.channel_state.channel_data.channel_id not in self._channels:
             return
-        del self._channels[channel.channel_state.channel_data.address]
+        del self._channels[channel.channel_state.channel_data.channel_id]
 
-        if other_node.address in self._other_nodes_to_channels:
-            del self._other_nodes_to_channels[other_node.address]
+        if other_node.node_id in self._other_nodes_to_channels:
+            del self._other_nodes_to_channels[other_node.node_id]
 
     def notify_of_cancellation_contract_payment(self, contract: 'cn.ContractCancellation'):
         """
         Used to notify this node of cancellation contract payment and to close this chain of cancellation contract off-chain.
         """
-        info = self._transaction_id_to_transaction_info[contract.transaction_id]
+        walk_route((self._cancellation_contract_payment_hop, (contract,)))
+
+    def _cancellation_contract_payment_hop(self, contract: 'cn.ContractCancellation') -> Optional[Hop]:
+        """
+        Pays the cancellation contract this node got from the previous node in the path of the paid `contract`'s transaction.
+        @return: the hop of the previous node if exists.
+        """
+        record = self._transaction_id_to_record.get(contract.transaction_id)
+        if record is None or record.info is None:
+            return  # the transaction already retired
+        info = record.info
 
         previous_node = info.previous_node
         if previous_node is None:
             return
 
-        channel = self._other_nodes_to_channels[previous_node.address]
+        channel = self._other_nodes_to_channels[previous_node.node_id]
 
-        if info.id not in self._transaction_id_to_cancellation_contracts:
+        previous_contract = record.cancellation_contract
+        if previous_contract is None:
             return
-        previous_contract = self._transaction_id_to_cancellation_contracts[info.id]
         if not previous_contract.is_valid:
             return
         channel.pay_amount_to_owner(previous_contract)
         contract.invalidate()
-        previous_node.notify_of_cancellation_contract_payment(previous_contract)
+        return previous_node._cancellation_contract_payment_hop, (previous_contract,)
 
 
 class LightningNodeAttacker(LightningNode):
+    __slots__ = ('_node_to_attack', '_peer', '_block_amount_to_send_transaction')
+
     def __init__(self, *args, block_amount_to_send_transaction: int):
         super(LightningNodeAttacker, self).__init__(*args)
+        self._context.node_state_store.set_flag(self._node_id, utils.NodeStateStore.ATTACKER)
         self._node_to_attack: Optional['LightningNode'] = None
         self._peer: Optional['LightningNode'] = None
         self._block_amount_to_send_transaction = block_amount_to_send_transaction
 
+    def clone(self, context: 'simulation_context.SimulationContext') -> 'LightningNodeAttacker':
+        """
+        Same as `LightningNode.clone`, the victim and peer are still the ones of this node (set them to their copies).
+        """
+        node = super(LightningNodeAttacker, self).clone(context)
+        node._node_to_attack = self._node_to_attack
+        node._peer = self._peer
+        node._block_amount_to_send_transaction = self._block_amount_to_send_transaction
+        return node
+
     def _get_log_prefix(self):
         return "Attacker: "
 
@@ -630,39 +885,50 @@ class LightningNodeAttacker(LightningNode):
         self._peer = peer
 
     def should_send_attack(self) -> bool:
-        return BLOCKCHAIN_INSTANCE.block_number % self._block_amount_to_send_transaction == 0
+        return self._context.blockchain.block_number % self._block_amount_to_send_transaction == 0
 
     def how_much_to_send(self):
         return 100000
 
 
 class LightningNodeSoftGriefing(LightningNodeAttacker):
+    __slots__ = ('_block_number_to_resolve',)
+
     def __init__(self, *args, block_amount_to_send_transaction: int):
         super(LightningNodeSoftGriefing, self).__init__(*args, block_amount_to_send_transaction=block_amount_to_send_transaction)
         self._block_number_to_resolve = 50
 
+    def clone(self, context: 'simulation_context.SimulationContext') -> 'LightningNodeSoftGriefing':
+        node = super(LightningNodeSoftGriefing, self).clone(context)
+        node._block_number_to_resolve = self._block_number_to_resolve
+        return node
+
     def _resolve_transaction_after_receiving_forward_contract(self, transaction_info: 'TransactionInfo'):
         """
         This function only called when attacking, so use function collector to terminate the transaction in the latest time.
         """
-        r = self._hash_image_r_to_preimage[transaction_info.hash_r]
+        r = self._hash_image_to_preimage[transaction_info.hash_r]
         blocks_to_wait = transaction_info.expiration_block_number - \
                          (transaction_info.path_length * self._block_amount_to_send_transaction)
         assert blocks_to_wait > 0
-        FUNCTION_COLLECTOR_INSTANCE.append(lambda: super(LightningNodeSoftGriefing, self)
-                                           .terminate_transaction(transaction_info.id, r),
-                                           BLOCKCHAIN_INSTANCE.block_number + blocks_to_wait)
+        transaction_id = transaction_info.id  # transaction_info might be recycled before terminating
+        self._context.function_collector.append(functools.partial(super(LightningNodeSoftGriefing, self).terminate_transaction,
+                                                                  transaction_id, r),
+                                                self._context.blockchain.block_number + blocks_to_wait)
 
 
 class LightningNodeDosAttack(LightningNodeAttacker):
+    __slots__ = ()
+
     def __init__(self, *args, block_amount_to_send_transaction: int):
         super(LightningNodeDosAttack, self).__init__(*args, block_amount_to_send_transaction=block_amount_to_send_transaction)
 
-    def receive_cancellation_contract(self, transaction_id: id, contract: 'cn.ContractCancellation'):
+    def receive_cancellation_contract(self, transaction_id: id, contract: 'cn.ContractCancellation') -> Optional[Hop]:
         """
         Ignore messages from the node_to_attack, otherwise, ack normal.
         """
-        if self._transaction_id_to_final_node.get(transaction_id) == self._node_to_attack:
+        record = self._transaction_id_to_record.get(transaction_id)
+        if record is not None and record.final_node == self._node_to_attack:
             return
         else:
-            super(LightningNodeDosAttack, self).receive_cancellation_contract(transaction_id, contract)
+            return super(LightningNodeDosAttack, self).receive_cancellation_contract(transaction_id, contract)
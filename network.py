@@ -1,6 +1,9 @@
+import gc
 from collections import defaultdict
-from typing import Dict, List, Tuple, Set
+from typing import Dict, List, Tuple
 import lightning_node
+import channel_manager
+import simulation_context
 
 
 LightningNode = lightning_node.LightningNode
@@ -13,6 +16,8 @@ class Network:
     def __init__(self, nodes=None, edges=None):
         self.nodes: List[LightningNode] = nodes if nodes else []
         self.edges: defaultdict[LightningNode, List[LightningNode]] = edges if edges else defaultdict(list)
+        self.channels: List[channel_manager.Channel] = []  # the channels created by `add_edge`.
+        self._channel_listeners: List[channel_manager.ChannelListener] = []
 
     def add_node(self, value):
         """
@@ -28,6 +33,18 @@ class Network:
         self.edges[to_node].append(from_node)
         channel = to_node.establish_channel(from_node, channel_starting_balance, is_bad_channel)
         from_node.add_money_to_channel(channel, channel_starting_balance)
+        self.channels.append(channel)
+        for listener in self._channel_listeners:
+            channel.subscribe(listener)
+
+    def subscribe_to_channels(self, listener: 'channel_manager.ChannelListener'):
+        """
+        Subscribes `listener` to the changes of every channel in the network, including channels added later (use
+        `channel_manager.ChannelEventBatcher` to get the changes once per block).
+        """
+        self._channel_listeners.append(listener)
+        for channel in self.channels:
+            channel.subscribe(listener)
 
     def find_shortest_path(self, last_node: LightningNode, initial_node: LightningNode, amount_in_msat: int,
                            griefing_penalty_rate: float, is_gp_protocol: bool):
@@ -36,7 +53,7 @@ class Network:
         can lock Griefing penalty.
         The search is done from target to source.
         """
-        nodes: Set[LightningNode] = set(self.nodes)
+        nodes: Dict[LightningNode, None] = dict.fromkeys(self.nodes)  # ordered, so ties are broken by the order of the nodes.
         visited: Dict[LightningNode, int] = {last_node: amount_in_msat}
         path: Dict[LightningNode, List[LightningNode]] = {last_node: []}
 
@@ -52,7 +69,7 @@ class Network:
             if min_node is None:
                 break
 
-            nodes.remove(min_node)
+            del nodes[min_node]
             current_msat = visited[min_node]
 
             neighbors = self.edges[min_node].copy()
@@ -92,9 +109,84 @@ class Network:
         griefing_penalty_sum = 0
         for n in reversed_nodes_in_path:
             amount_to_send = visited.get(prev, new_msat)
-            griefing_penalty_sum += int(amount_to_send * griefing_penalty_rate * length * 1440)
+            # Not a `lightning_node.RoutePlan`: the search checks partial paths, with the (not rounded) amounts in `visited`
+            # and the rate it searches with, while a plan needs the whole route and every node's own rate. The penalty is
+            # computed here as it always was (one int() of the product, which can round differently from
+            # `calculate_griefing_penalty`), so the paths found stay the same.
+            blocks_factor = lightning_node.BLOCKS_IN_DAY * 10
+            griefing_penalty_sum += int(amount_to_send * griefing_penalty_rate * length * blocks_factor)
             if griefing_penalty_sum > n.get_capacity_left(prev):
                 return False
             prev = n
             length -= 1
         return True
+
+
+class NetworkTemplate:
+    """
+    The initial state of a network: its nodes with their parameters and balances, and its channels with their balances.
+    Captured once right after the network is built (before any block passed), into a context of its own, so every run that
+    starts from the same network gets a copy of it (made from typed array and list copies) instead of building it again.
+    """
+    def __init__(self, context: 'simulation_context.SimulationContext', network: Network,
+                 attackers: List[LightningNode], victims: List[LightningNode]):
+        """
+        Initializes a new `NetworkTemplate`.
+        @param context: the context `network` was built in, its secret generator state is captured as well.
+        @param network: the network to capture.
+        @param attackers: the attackers in `network`.
+        @param victims: the victims in `network`.
+        """
+        self._context = simulation_context.SimulationContext()
+        self._network, self._attackers, self._victims = NetworkTemplate._copy(context, self._context, network, attackers,
+                                                                              victims)
+
+    def instantiate(self, context: 'simulation_context.SimulationContext') \
+            -> Tuple[Network, List[LightningNode], List[LightningNode]]:
+        """
+        Copies the captured network into `context` (a new context, with no nodes yet). The run continues exactly as it would
+        have on the network that was captured, given the same state of the `random` module.
+        @return: the copy of the network, of its attackers and of its victims.
+        """
+        return NetworkTemplate._copy(self._context, context, self._network, self._attackers, self._victims)
+
+    @staticmethod
+    def _copy(source_context: 'simulation_context.SimulationContext', context: 'simulation_context.SimulationContext',
+              network: Network, attackers: List[LightningNode], victims: List[LightningNode]) \
+            -> Tuple[Network, List[LightningNode], List[LightningNode]]:
+        # every object the copy allocates stays alive, so garbage collections during it would only traverse them.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return NetworkTemplate._copy_objects(source_context, context, network, attackers, victims)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    @staticmethod
+    def _copy_objects(source_context: 'simulation_context.SimulationContext',
+                      context: 'simulation_context.SimulationContext', network: Network, attackers: List[LightningNode],
+                      victims: List[LightningNode]) -> Tuple[Network, List[LightningNode], List[LightningNode]]:
+        source_blockchain = source_context.blockchain
+        nodes = [source_blockchain.get_node(node_id).clone(context) for node_id in range(source_blockchain.number_of_nodes)]
+        for node in nodes:
+            if isinstance(node, lightning_node.LightningNodeAttacker):
+                if node.get_victim() is not None:
+                    node.set_victim(nodes[node.get_victim().node_id])
+                if node.get_peer() is not None:
+                    node.set_peer(nodes[node.get_peer().node_id])
+        channels = []
+        for channel in network.channels:
+            channel_data = channel.channel_state.channel_data
+            channels.append(channel.clone(nodes[channel_data.owner1.node_id], nodes[channel_data.owner2.node_id]))
+
+        context.blockchain.copy_from(source_blockchain, nodes, channels)
+        context.node_state_store.copy_from(source_context.node_state_store)
+        context.locked_funds_integrator.copy_from(source_context.locked_funds_integrator, nodes)
+        context.secret_generator.copy_from(source_context.secret_generator)
+
+        copy = Network([nodes[node.node_id] for node in network.nodes])
+        for node, other_nodes in network.edges.items():
+            copy.edges[nodes[node.node_id]] = [nodes[other_node.node_id] for other_node in other_nodes]
+        copy.channels = channels
+        return copy, [nodes[node.node_id] for node in attackers], [nodes[node.node_id] for node in victims]
@@ -0,0 +1,148 @@
+import json
+import os
+import random
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Tuple
+
+SNAPSHOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot')
+CACHE_PATH = os.path.join(SNAPSHOT_DIRECTORY, 'distributions.json')
+MIN_COUNT_IN_BUCKET = 50
+
+# the snapshot files to sample from and the width of their buckets.
+CAPACITY = 'capacity'
+FEE_BASE_MSAT = 'fee_base_msat'
+FEE_RATE_MILLI_MSAT = 'fee_rate_milli_msat'
+BUCKET_WIDTHS = {CAPACITY: 500000, FEE_BASE_MSAT: 100, FEE_RATE_MILLI_MSAT: 1}
+
+
+def get_buckets(all_values, bucket_width, min_count_in_bucket=MIN_COUNT_IN_BUCKET) -> Tuple[List[int], Dict[int, int]]:
+    """
+    Counts `all_values` in buckets of `bucket_width` (every bucket is named by its lowest value) and merges every bucket
+    with less than `min_count_in_bucket` values into the nearest kept bucket (the lower one on a tie).
+    @return: the sorted kept buckets and the count of every bucket (0 for the merged ones).
+    """
+    buckets_dict = Counter(c - c % bucket_width for c in all_values)
+    buckets = sorted(buckets_dict)
+    buckets_to_keep = [b for b in buckets if buckets_dict[b] >= min_count_in_bucket] or buckets
+    for b in buckets:
+        if buckets_dict[b] >= min_count_in_bucket:
+            continue
+        index = bisect_left(buckets_to_keep, b)
+        if index == len(buckets_to_keep) or (index > 0 and b - buckets_to_keep[index - 1] <= buckets_to_keep[index] - b):
+            index -= 1
+        b_replace = buckets_to_keep[index]
+        if b_replace != b:
+            buckets_dict[b_replace] += buckets_dict[b]
+            buckets_dict[b] = 0
+    return buckets_to_keep, buckets_dict
+
+
+class AliasSampler:
+    """
+    Samples the buckets of an empirical distribution in O(1) with the alias method, and a value uniformly in the bucket.
+    """
+    def __init__(self, values: List[int], probabilities: List[float], aliases: List[int], bucket_width: int):
+        self._values = values
+        self._probabilities = probabilities
+        self._aliases = aliases
+        self._bucket_width = bucket_width
+
+    @classmethod
+    def from_counts(cls, values: List[int], counts: List[int], bucket_width: int) -> 'AliasSampler':
+        """
+        Builds the alias table (Vose) of the buckets `values` that have `counts` values in them (or any weights).
+        """
+        n = len(values)
+        total = sum(counts)
+        scaled = [count * n / total for count in counts]
+        probabilities = [1.0] * n
+        aliases = list(range(n))
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            i = small.pop()
+            j = large.pop()
+            probabilities[i] = scaled[i]
+            aliases[i] = j
+            scaled[j] -= 1 - scaled[i]
+            (small if scaled[j] < 1 else large).append(j)
+        return cls(values, probabilities, aliases, bucket_width)
+
+    def to_dict(self) -> dict:
+        return {'values': self._values, 'probabilities': self._probabilities, 'aliases': self._aliases,
+                'bucket_width': self._bucket_width}
+
+    @classmethod
+    def from_dict(cls, table: dict) -> 'AliasSampler':
+        return cls(table['values'], table['probabilities'], table['aliases'], table['bucket_width'])
+
+    def sample(self, generator=random) -> int:
+        """
+        @return: a value drawn from the distribution with `generator` (the `random` module by default, so seeding it repeats
+        the draws).
+        """
+        u = generator.random() * len(self._values)
+        i = int(u)
+        value = self._values[i] if u - i < self._probabilities[i] else self._values[self._aliases[i]]
+        return value + generator.randrange(self._bucket_width) if self._bucket_width > 1 else value
+
+    def sample_many(self, k: int, generator=random) -> array:
+        """
+        @return: `k` values drawn from the distribution, the same values `k` calls to `sample` would return.
+        """
+        sample = self.sample
+        return array('q', [sample(generator) for _ in range(k)])
+
+
+def _read_values(name):
+    with open(os.path.join(SNAPSHOT_DIRECTORY, name)) as f:
+        return [int(line) for line in f if line.strip()]
+
+
+def _source_stamp(name):
+    stat = os.stat(os.path.join(SNAPSHOT_DIRECTORY, name))
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _load_cache():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_sampler(name) -> AliasSampler:
+    """
+    Buckets the snapshot file `name` and builds its sampler, or loads it from the cache if the file did not change.
+    """
+    bucket_width = BUCKET_WIDTHS[name]
+    cache = _load_cache()
+    stamp = _source_stamp(name)
+    entry = cache.get(name)
+    if entry and entry['source'] == stamp and entry['table']['bucket_width'] == bucket_width:
+        return AliasSampler.from_dict(entry['table'])
+
+    buckets_to_keep, buckets_dict = get_buckets(_read_values(name), bucket_width)
+    sampler = AliasSampler.from_counts(buckets_to_keep, [buckets_dict[b] for b in buckets_to_keep], bucket_width)
+    cache[name] = {'source': stamp, 'table': sampler.to_dict()}
+    try:
+        with open(CACHE_PATH, 'w', encoding="utf-8") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass  # the cache is only an optimization
+    return sampler
+
+
+_samplers = {}
+
+
+def get_sampler(name) -> AliasSampler:
+    """
+    @return: the sampler of the snapshot file `name`, built once per process.
+    """
+    if name not in _samplers:
+        _samplers[name] = build_sampler(name)
+    return _samplers[name]
@@ -1,12 +1,21 @@
 import random
 import math
+import functools
+import os
 from enum import Enum
 import fire
 import json
 import lightning_node
+import channel_manager
+import demand
+import samplers
+import snapshot_topology
+import synthetic_topology
+import workload
 from datetime import datetime
-from network import Network
-import networkx as nx
+from network import Network, NetworkTemplate
+from checkpoint import Checkpoint
+from simulation_context import SimulationContext
 from singletons import *
 
 
@@ -30,6 +39,26 @@ SOFT_GRIEFING_PROBABILITY = 0.5
 GRIEFING_PROBABILITY = 0.5
 DELTA_DEFAULT = 70
 MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT = 6
+RECORD_LOCKED_FUNDS_TIME_SERIES = False  # if True, every run also writes the locked funds of the network in every block.
+USE_OBJECT_POOL = False  # if True, transaction infos and contracts are recycled once their transaction retires.
+BULK_SETTLEMENT = True  # if True, all channels are closed at the end of a run in bulk instead of one by one (same result).
+USE_SNAPSHOT_DISTRIBUTIONS = False  # if True, fees and redundancy channel capacities are drawn from the snapshot data.
+# if > 0, both runs of a simulation share this many blocks of honest traffic and branch from a checkpoint taken after them.
+WARM_UP_BLOCKS = 0
+CHECKPOINT_DIRECTORY = None  # if set (with WARM_UP_BLOCKS), the warm up checkpoints are saved there (see run_from_checkpoint).
+# if set, the runs replay the payments of this trace (see write_workload_trace) instead of drawing them while they run.
+WORKLOAD_TRACE_PATH = None
+SHARE_WORKLOAD = False  # if True, the payments of a simulation are drawn once into a trace that both its runs replay.
+# the synthetic topology (NetworkType.SYNTHETIC) of NUMBER_OF_NODES nodes, its largest connected component is the network.
+SYNTHETIC_MODEL = synthetic_topology.PREFERENTIAL_ATTACHMENT  # or CONFIGURATION, with the degrees of the snapshot.
+SYNTHETIC_EDGES_PER_NODE = 3  # the channels every new node opens in the preferential attachment model.
+SYNTHETIC_TOPOLOGY_SEED = 0  # the topology is the same for every seed of a simulation (as the snapshot is).
+# how the senders and receivers of payments are chosen among the nodes: demand.UNIFORM, ZIPF, DEGREE or CAPACITY.
+SENDER_DEMAND_MODEL = demand.UNIFORM
+RECEIVER_DEMAND_MODEL = demand.UNIFORM
+ZIPF_EXPONENT = 1.0
+AMOUNT_MODEL = demand.NORMAL  # how much to send: demand.NORMAL (SIGMA around MSAT_AMOUNTS_TO_SEND) or demand.LOGNORMAL.
+AMOUNT_LOGNORMAL_SIGMA = 1.0
 
 
 class AttackerNodeType(str, Enum):
@@ -47,110 +76,198 @@ class NetworkType(str, Enum):
     """
     REDUNDANCY = "redundancy"
     SNAPSHOT = "snapshot"
+    SYNTHETIC = "synthetic"
 
 
 NUMBER_OF_ATTACKERS_TO_CREATE = {NetworkType.REDUNDANCY: {AttackerNodeType.SOFT_GRIEFING: 2, AttackerNodeType.SOFT_GRIEFING_BUSY_NETWORK: 3,
                                                           AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK: 1},
                                  NetworkType.SNAPSHOT: {AttackerNodeType.SOFT_GRIEFING: 2, AttackerNodeType.SOFT_GRIEFING_BUSY_NETWORK: 3,
-                                                        AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK: 1}}
+                                                        AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK: 1},
+                                 NetworkType.SYNTHETIC: {AttackerNodeType.SOFT_GRIEFING: 2, AttackerNodeType.SOFT_GRIEFING_BUSY_NETWORK: 3,
+                                                         AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK: 1}}
 
 
-def how_much_to_send():
+def how_much_to_send(context):
     """
     Choose how much to send.
     """
-    amount = int(min(max(random.gauss(MSAT_AMOUNTS_TO_SEND, SIGMA), MIN_TO_SEND), MAX_TO_SEND))
-    METRICS_COLLECTOR_INSTANCE.average(TRANSACTION_AMOUNT_AVG, amount)
+    amount = draw_amount(random)
+    context.metrics_collector.average(TRANSACTION_AMOUNT_AVG, amount)
     return amount
 
 
-def create_node(delta, max_number_of_block_to_respond, attacker_node_type=None):
+def draw_amount(generator):
+    """
+    Draw how much to send with `generator` in the AMOUNT_MODEL.
+    """
+    sigma = AMOUNT_LOGNORMAL_SIGMA if AMOUNT_MODEL == demand.LOGNORMAL else SIGMA
+    return demand.draw_amount(AMOUNT_MODEL, MSAT_AMOUNTS_TO_SEND, sigma, MIN_TO_SEND, MAX_TO_SEND, generator)
+
+
+def create_node(context, delta, max_number_of_block_to_respond, attacker_node_type=None):
     """
     Create node according to the type.
     """
+    base_fee, fee_rate = BASE_FEE, FEE_RATE
+    if USE_SNAPSHOT_DISTRIBUTIONS:
+        base_fee = samplers.get_sampler(samplers.FEE_BASE_MSAT).sample()
+        fee_rate = samplers.get_sampler(samplers.FEE_RATE_MILLI_MSAT).sample()
     # divide by million to get the rate per msat
-    fee_percentage = FEE_RATE / 1000000
+    fee_percentage = fee_rate / 1000000
     if AttackerNodeType.SOFT_GRIEFING == attacker_node_type:
-        return lightning_node.LightningNodeSoftGriefing(STARTING_BALANCE, BASE_FEE, fee_percentage,
+        return lightning_node.LightningNodeSoftGriefing(context, STARTING_BALANCE, base_fee, fee_percentage,
                                                         GRIEFING_PENALTY_RATE, delta, max_number_of_block_to_respond,
                                                         block_amount_to_send_transaction=10)
     if AttackerNodeType.SOFT_GRIEFING_BUSY_NETWORK == attacker_node_type:
-        return lightning_node.LightningNodeSoftGriefing(STARTING_BALANCE, BASE_FEE, fee_percentage,
+        return lightning_node.LightningNodeSoftGriefing(context, STARTING_BALANCE, base_fee, fee_percentage,
                                                         GRIEFING_PENALTY_RATE, delta, max_number_of_block_to_respond,
                                                         block_amount_to_send_transaction=3)
     if AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK == attacker_node_type:
-        return lightning_node.LightningNodeDosAttack(STARTING_BALANCE, BASE_FEE, fee_percentage,
+        return lightning_node.LightningNodeDosAttack(context, STARTING_BALANCE, base_fee, fee_percentage,
                                                      GRIEFING_PENALTY_RATE, delta, max_number_of_block_to_respond,
                                                      block_amount_to_send_transaction=7)
-    return lightning_node.LightningNode(STARTING_BALANCE, BASE_FEE, fee_percentage, GRIEFING_PENALTY_RATE, delta,
+    return lightning_node.LightningNode(context, STARTING_BALANCE, base_fee, fee_percentage, GRIEFING_PENALTY_RATE, delta,
                                         max_number_of_block_to_respond)
 
 
-def run_simulation(network, use_gp_protocol, attackers, victims, simulate_attack):
+def run_simulation(context, network, use_gp_protocol, attackers, victims, simulate_attack):
     """
     Run the simulation itself. Choose each block sender and receiver, and send transaction. In addition, if there is attackers,
     let them choose if needed to send attack, and then send the attack. run until reach NUMBER_OF_BLOCKS and then wait for the
     last block that function in Function Collector needs. Return all metrics from the simulation.
     """
-    counter = 0
+    run_blocks(context, network, use_gp_protocol, attackers, victims, simulate_attack, NUMBER_OF_BLOCKS)
+    return finish_simulation(context, network, victims)
+
+
+def run_blocks(context, network, use_gp_protocol, attackers, victims, simulate_attack, last_block_number):
+    """
+    Run the simulation (as `run_simulation` does) from the current block until reach `last_block_number`, so the run can be
+    checkpointed there and continued.
+    """
+    if context.workload_trace is None:
+        sender_sampler, receiver_sampler = get_node_samplers(network, get_nodes_to_simulate(network, attackers, victims))
+        block_payments = draw_block_payments(context, sender_sampler, receiver_sampler)
+    else:
+        block_payments = replay_block_payments(context, context.workload_trace)
+    for payments in block_payments:
+        if context.blockchain.block_number >= last_block_number:
+            break
+        for sender_node, receiver_node, amount_in_msat in payments:
+            run_payment(context, network, use_gp_protocol, attackers, simulate_attack, sender_node, receiver_node,
+                        amount_in_msat)
+        increase_block(context, 1)
+        if context.blockchain.block_number % 144 == 0:
+            print(f"Increase block number. current is {context.blockchain.block_number}")
+
+
+def get_nodes_to_simulate(network, attackers, victims):
+    """
+    Return the nodes that send and receive the payments of a run: all but the attackers, their peers and the victims.
+    """
     attacker2 = [attacker.get_peer() for attacker in attackers]
-    nodes_to_simulate = [node for node in network.nodes if node not in attackers and node not in victims and node not in
-                         attacker2]
-    while BLOCKCHAIN_INSTANCE.block_number < NUMBER_OF_BLOCKS:
-        sender_node = random.choice(nodes_to_simulate)
-        # find receiver node
-        receiver_node = random.choice(nodes_to_simulate)
-        while receiver_node == sender_node:
-            receiver_node = random.choice(nodes_to_simulate)
-
-        amount_in_msat = how_much_to_send()
-        if simulate_attack:
-            for attacker in attackers:
-                if attacker.should_send_attack():
-                    amount_to_send = attacker.how_much_to_send()
-                    if attacker.get_peer():
-                        if attacker.get_victim():
-                            # soft griefing to specific victim
-                            should_try_to_send_transaction = amount_to_send > 0
-                            while should_try_to_send_transaction:
-                                result = send_attack_transaction(network, attacker.get_victim(), attacker, attacker.get_peer(),
-                                                                 use_gp_protocol, amount_to_send)
-                                amount_to_send = amount_to_send // 2
-                                should_try_to_send_transaction = amount_to_send > 0 and not result
-                        else:
-                            # soft griefing to make busy network
-                            should_try_to_send_transaction = amount_to_send > 0
-                            while should_try_to_send_transaction:
-                                result = find_path_and_send_transaction(network, attacker.get_peer(), attacker, use_gp_protocol,
-                                                                        amount_to_send)
-                                amount_to_send = amount_to_send // 2
-                                should_try_to_send_transaction = amount_to_send > 0 and not result
+    return [node for node in network.nodes if node not in attackers and node not in victims and node not in attacker2]
+
+
+def get_node_samplers(network, nodes_to_simulate):
+    """
+    Return the samplers of the senders and receivers of payments among `nodes_to_simulate`, in SENDER_DEMAND_MODEL and
+    RECEIVER_DEMAND_MODEL (their alias tables are built here, once for a run).
+    """
+    return demand.NodeSampler(SENDER_DEMAND_MODEL, network, nodes_to_simulate, ZIPF_EXPONENT), \
+        demand.NodeSampler(RECEIVER_DEMAND_MODEL, network, nodes_to_simulate, ZIPF_EXPONENT)
+
+
+def draw_block_payments(context, sender_sampler, receiver_sampler):
+    """
+    Generate the payments of every block from the current one on (endless), each a generator of the HTLCS_PER_BLOCK
+    (sender, receiver, amount) of the block, drawn as they are sent.
+    """
+    while True:
+        yield (draw_payment(context, sender_sampler, receiver_sampler) for _ in range(HTLCS_PER_BLOCK))
+
+
+def draw_payment(context, sender_sampler, receiver_sampler):
+    """
+    Choose sender and receiver (another node) and how much to send.
+    """
+    sender_node = sender_sampler.sample()
+    # find receiver node
+    receiver_node = receiver_sampler.sample()
+    while receiver_node == sender_node:
+        receiver_node = receiver_sampler.sample()
+    return sender_node, receiver_node, how_much_to_send(context)
+
+
+def replay_block_payments(context, trace):
+    """
+    Generate the payments of every block from the current one on (endless, there are none after the end of `trace`), each
+    a generator of the (sender, receiver, amount) of the block as `trace` has them, read as they are sent.
+    """
+    get_node = context.blockchain.get_node
+    for payments in trace.get_block_payments(context.blockchain.block_number):
+        yield ((get_node(sender_id), get_node(receiver_id), replay_amount(context, amount_in_msat))
+               for sender_id, receiver_id, amount_in_msat in payments)
+
+
+def replay_amount(context, amount_in_msat):
+    context.metrics_collector.average(TRANSACTION_AMOUNT_AVG, amount_in_msat)
+    return amount_in_msat
+
+
+def run_payment(context, network, use_gp_protocol, attackers, simulate_attack, sender_node, receiver_node, amount_in_msat):
+    """
+    Let the attackers choose if needed to send attack and send it, then send the payment.
+    """
+    if simulate_attack:
+        for attacker in attackers:
+            if attacker.should_send_attack():
+                amount_to_send = attacker.how_much_to_send()
+                if attacker.get_peer():
+                    if attacker.get_victim():
+                        # soft griefing to specific victim
+                        should_try_to_send_transaction = amount_to_send > 0
+                        while should_try_to_send_transaction:
+                            result = send_attack_transaction(network, attacker.get_victim(), attacker, attacker.get_peer(),
+                                                             use_gp_protocol, amount_to_send)
+                            amount_to_send = amount_to_send // 2
+                            should_try_to_send_transaction = amount_to_send > 0 and not result
                     else:
-                        # Dos attack to specific victim
-                        find_path_and_send_transaction(network, attacker.get_victim(), attacker, use_gp_protocol,
-                                                       attacker.how_much_to_send())
+                        # soft griefing to make busy network
                         should_try_to_send_transaction = amount_to_send > 0
                         while should_try_to_send_transaction:
-                            result = find_path_and_send_transaction(network, attacker.get_victim(), attacker, use_gp_protocol,
+                            result = find_path_and_send_transaction(network, attacker.get_peer(), attacker, use_gp_protocol,
                                                                     amount_to_send)
                             amount_to_send = amount_to_send // 2
                             should_try_to_send_transaction = amount_to_send > 0 and not result
-        if find_path_and_send_transaction(network, receiver_node, sender_node, use_gp_protocol, amount_in_msat):
-            METRICS_COLLECTOR_INSTANCE.count(SEND_TRANSACTION)
-        else:
-            METRICS_COLLECTOR_INSTANCE.count(NO_PATH_FOUND)
-
-        counter += 1
-        if counter == HTLCS_PER_BLOCK:
-            counter = 0
-            increase_block(1)
-            if BLOCKCHAIN_INSTANCE.block_number % 144 == 0:
-                print(f"Increase block number. current is {BLOCKCHAIN_INSTANCE.block_number}")
-
-    increase_block(FUNCTION_COLLECTOR_INSTANCE.get_max_k())
-    print(f"Final block number is {BLOCKCHAIN_INSTANCE.block_number}")
-    close_channel_and_log_metrics(network, victims)
-    metrics = METRICS_COLLECTOR_INSTANCE.get_metrics()
+                else:
+                    # Dos attack to specific victim
+                    find_path_and_send_transaction(network, attacker.get_victim(), attacker, use_gp_protocol,
+                                                   attacker.how_much_to_send())
+                    should_try_to_send_transaction = amount_to_send > 0
+                    while should_try_to_send_transaction:
+                        result = find_path_and_send_transaction(network, attacker.get_victim(), attacker, use_gp_protocol,
+                                                                amount_to_send)
+                        amount_to_send = amount_to_send // 2
+                        should_try_to_send_transaction = amount_to_send > 0 and not result
+    if find_path_and_send_transaction(network, receiver_node, sender_node, use_gp_protocol, amount_in_msat):
+        context.metrics_collector.count(SEND_TRANSACTION)
+    else:
+        context.metrics_collector.count(NO_PATH_FOUND)
+
+
+def finish_simulation(context, network, victims):
+    """
+    Wait for the last block that function in Function Collector needs, close all channels and return all metrics from the
+    simulation.
+    """
+    increase_block(context, context.function_collector.get_max_k())
+    print(f"Final block number is {context.blockchain.block_number}")
+    print(f"Transactions state in nodes: {context.transaction_lifecycle.get_counts()}")
+    print(f"Node fees: {context.node_state_store.get_fee_statistics()}")
+    print(f"Funds locked at the end by node type: {context.node_state_store.get_locked_funds_by_type()}")
+    close_channel_and_log_metrics(context, network, victims)
+    metrics = context.metrics_collector.get_metrics()
     add_more_metrics(metrics)
     metrics_str = '\n'.join([f'\t{k}: {v:,}' for k, v in metrics.items()])
     print(f"Metrics of this run: \n{metrics_str}")
@@ -190,7 +307,7 @@ def send_transaction(receiver_node, sender_node, use_gp_protocol, amount_in_msat
     if sender_node in node_to_path:
         nodes_between = list(reversed(node_to_path[sender_node]))[1:]
         nodes_between.append(receiver_node)
-        METRICS_COLLECTOR_INSTANCE.average(PATH_LENGTH_AVG, len(nodes_between))
+        sender_node.context.metrics_collector.average(PATH_LENGTH_AVG, len(nodes_between))
         if use_gp_protocol:
             sender_node.start_transaction(receiver_node, amount_in_msat, nodes_between)
         else:
@@ -199,32 +316,66 @@ def send_transaction(receiver_node, sender_node, use_gp_protocol, amount_in_msat
     return False
 
 
-def increase_block(block_number_to_increase):
+def increase_block(context, block_number_to_increase):
     """
     Increase block number to the min block number needed (to run the next function) from Function Collector, until reach
     block_number_to_increase.
     """
-    block_number_to_reach = BLOCKCHAIN_INSTANCE.block_number + (block_number_to_increase or 0)
-    while BLOCKCHAIN_INSTANCE.block_number < block_number_to_reach:
-        min_block_to_reach = FUNCTION_COLLECTOR_INSTANCE.get_min_k() if FUNCTION_COLLECTOR_INSTANCE.get_min_k() is not None \
-            else block_number_to_reach
+    block_number_to_reach = context.blockchain.block_number + (block_number_to_increase or 0)
+    while context.blockchain.block_number < block_number_to_reach:
+        min_block_to_reach = context.function_collector.get_min_k() \
+            if context.function_collector.get_min_k() is not None else block_number_to_reach
         min_block_to_reach = min(min_block_to_reach, block_number_to_reach)
-        BLOCKCHAIN_INSTANCE.wait_k_blocks(min_block_to_reach - BLOCKCHAIN_INSTANCE.block_number)
-        FUNCTION_COLLECTOR_INSTANCE.run()
+        context.blockchain.wait_k_blocks(min_block_to_reach - context.blockchain.block_number)
+        context.function_collector.run()
+        context.transaction_lifecycle.retire_expired()
 
 
-def close_channel_and_log_metrics(network, victims):
+def close_channel_and_log_metrics(context, network, victims):
     """
     Close all channels and log balance of nodes according to the type.
     """
+    if BULK_SETTLEMENT:
+        settle_channels_and_log_metrics(context, network, victims)
+        return
     for node in network.nodes:
         for other_node in network.edges[node]:
             node.close_channel(other_node)
 
         if node in victims:
-            METRICS_COLLECTOR_INSTANCE.average(VICTIM_NODE_BALANCE_AVG, BLOCKCHAIN_INSTANCE.get_balance_for_node(node))
+            context.metrics_collector.average(VICTIM_NODE_BALANCE_AVG, context.blockchain.get_balance_for_node(node))
+        elif type(node) is lightning_node.LightningNode:
+            context.metrics_collector.average(HONEST_NODE_BALANCE_AVG, context.blockchain.get_balance_for_node(node))
+
+
+def _detach_channels(network):
+    """
+    Generates the channels to close, in the order `close_channel_and_log_metrics` closes them.
+    """
+    for node in network.nodes:
+        for other_node in network.edges[node]:
+            channel = node.detach_channel(other_node)
+            if channel is not None:
+                yield channel
+
+
+def settle_channels_and_log_metrics(context, network, victims):
+    """
+    Same as `close_channel_and_log_metrics`, but closes all channels in bulk and logs the balances once they are all closed.
+    """
+    channel_manager.Channel.close_channels(_detach_channels(network))
+    victims = set(victims)
+    balances_by_metric = {}  # in the order the per channel path logs them.
+    for node in network.nodes:
+        if node in victims:
+            metric = VICTIM_NODE_BALANCE_AVG
         elif type(node) is lightning_node.LightningNode:
-            METRICS_COLLECTOR_INSTANCE.average(HONEST_NODE_BALANCE_AVG, BLOCKCHAIN_INSTANCE.get_balance_for_node(node))
+            metric = HONEST_NODE_BALANCE_AVG
+        else:
+            continue
+        balances_by_metric.setdefault(metric, []).append(context.blockchain.get_balance_for_node(node))
+    for metric, balances in balances_by_metric.items():
+        context.metrics_collector.average_all(metric, balances)
 
 
 def add_more_metrics(metrics):
@@ -240,24 +391,25 @@ def add_more_metrics(metrics):
 
 
 
-def create_network(attacker_node_type, delta, max_number_of_block_to_respond):
+def create_network(context, attacker_node_type, delta, max_number_of_block_to_respond):
     """
     Create network without the edges. With attackers and victim in needed.
     """
     network = Network()
     number_of_attackers_to_create = NUMBER_OF_ATTACKERS_TO_CREATE[NetworkType.REDUNDANCY].get(attacker_node_type, 1)
-    attackers, victims, attackers2 = create_attacker_and_victim(network, attacker_node_type, delta,
+    attackers, victims, attackers2 = create_attacker_and_victim(context, network, attacker_node_type, delta,
                                                                 max_number_of_block_to_respond, number_of_attackers_to_create)
     number_of_special_nodes = len(attackers) + len(victims) + \
                               (len(attackers2) if attacker_node_type != AttackerNodeType.SOFT_GRIEFING else 0)
     number_of_nodes_to_create = NUMBER_OF_NODES - number_of_special_nodes
     for _ in range(number_of_nodes_to_create):
-        network.add_node(create_node(delta, max_number_of_block_to_respond))
+        network.add_node(create_node(context, delta, max_number_of_block_to_respond))
     random.shuffle(network.nodes)
     return network, attackers, victims, attackers2
 
 
-def create_attacker_and_victim(network, attacker_node_type, delta, max_number_of_block_to_respond, number_of_attackers=1):
+def create_attacker_and_victim(context, network, attacker_node_type, delta, max_number_of_block_to_respond,
+                               number_of_attackers=1):
     """
     Create attacker and victim nodes according to the attacker type (not all attacker need victim or 2 attackers).
     """
@@ -266,11 +418,11 @@ def create_attacker_and_victim(network, attacker_node_type, delta, max_number_of
     attackers2 = []
     if attacker_node_type:
         for _ in range(number_of_attackers):
-            attacker = create_node(delta, max_number_of_block_to_respond, attacker_node_type)
+            attacker = create_node(context, delta, max_number_of_block_to_respond, attacker_node_type)
             network.add_node(attacker)
             attackers.append(attacker)
             if attacker_node_type != AttackerNodeType.SOFT_GRIEFING_BUSY_NETWORK:
-                victim = create_node(delta, max_number_of_block_to_respond)
+                victim = create_node(context, delta, max_number_of_block_to_respond)
                 victim.set_as_victim()
                 attacker.set_victim(victim)
                 attacker.set_fee_percentage(victim.fee_percentage)
@@ -278,7 +430,7 @@ def create_attacker_and_victim(network, attacker_node_type, delta, max_number_of
                 network.add_node(victim)
                 victims.append(victim)
             if attacker_node_type != AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK:
-                attacker2 = create_node(delta, max_number_of_block_to_respond, attacker_node_type)
+                attacker2 = create_node(context, delta, max_number_of_block_to_respond, attacker_node_type)
                 attacker.set_peer(attacker2)
                 attackers2.append(attacker2)
                 if attacker_node_type == AttackerNodeType.SOFT_GRIEFING:
@@ -288,44 +440,80 @@ def create_attacker_and_victim(network, attacker_node_type, delta, max_number_of
     return attackers, victims, attackers2
 
 
-def find_largest_connected_component(json_data):
+_largest_connected_components = {}
+
+
+def get_largest_connected_component(topology):
     """
-    Return largest connected component from json object contain snapshot.
+    Return the nodes and edges of the largest connected component of a snapshot topology, found once per topology.
     """
-    G = nx.Graph()
+    if topology not in _largest_connected_components:
+        _largest_connected_components[topology] = snapshot_topology.find_largest_connected_component(
+            topology.number_of_nodes, topology.node1, topology.node2)
+    return _largest_connected_components[topology]
 
-    for node in json_data['nodes']:
-        G.add_node(node['pub_key'])
 
-    for edge in json_data['edges']:
-        G.add_edge(edge['node1_pub'], edge['node2_pub'], capacity=edge['capacity'])
-    G.remove_nodes_from(list(nx.isolates(G)))
+def generate_network_from_snapshot(context, attacker_node_type, delta, max_number_of_block_to_respond):
+    """
+    Load snapshot (compiled once to a cached binary topology, without the edges that miss a policy or are disabled), add
+    nodes and edges, and filter to the largest connected component.
+    """
+    topology = snapshot_topology.load_snapshot(SNAPSHOT_PATH)
+    return generate_network_from_topology(context, attacker_node_type, delta, max_number_of_block_to_respond, topology,
+                                          NetworkType.SNAPSHOT)
+
+
+_synthetic_topologies = {}
+
+
+def get_synthetic_topology():
+    """
+    Return the synthetic topology of NUMBER_OF_NODES nodes in SYNTHETIC_MODEL, generated once per process from
+    SYNTHETIC_TOPOLOGY_SEED. The capacities are drawn from the snapshot data (as USE_SNAPSHOT_DISTRIBUTIONS does).
+    """
+    key = (SYNTHETIC_MODEL, NUMBER_OF_NODES, SYNTHETIC_EDGES_PER_NODE, SYNTHETIC_TOPOLOGY_SEED)
+    if key not in _synthetic_topologies:
+        generator = random.Random(SYNTHETIC_TOPOLOGY_SEED)
+        capacity_sampler = samplers.get_sampler(samplers.CAPACITY)
+        if SYNTHETIC_MODEL == synthetic_topology.PREFERENTIAL_ATTACHMENT:
+            topology = synthetic_topology.generate_preferential_attachment(NUMBER_OF_NODES, SYNTHETIC_EDGES_PER_NODE,
+                                                                           capacity_sampler, generator)
+        elif SYNTHETIC_MODEL == synthetic_topology.CONFIGURATION:
+            snapshot = snapshot_topology.load_snapshot(SNAPSHOT_PATH)
+            _, snapshot_edges = get_largest_connected_component(snapshot)
+            degree_sampler = synthetic_topology.get_degree_sampler(snapshot.node1, snapshot.node2, snapshot_edges)
+            topology = synthetic_topology.generate_configuration_model(NUMBER_OF_NODES, degree_sampler, capacity_sampler,
+                                                                       generator)
+        else:
+            raise Exception(f"got invalid synthetic model {SYNTHETIC_MODEL}, expected one of {synthetic_topology.MODELS}")
+        _synthetic_topologies[key] = topology
+    return _synthetic_topologies[key]
+
 
-    largest_connected_component = max(nx.connected_components(G), key=len)
-    return G.subgraph(largest_connected_component).copy()
+def generate_synthetic_network(context, attacker_node_type, delta, max_number_of_block_to_respond):
+    """
+    Generate the synthetic topology (see get_synthetic_topology), add nodes and edges of its largest connected component.
+    """
+    return generate_network_from_topology(context, attacker_node_type, delta, max_number_of_block_to_respond,
+                                          get_synthetic_topology(), NetworkType.SYNTHETIC)
 
 
-def generate_network_from_snapshot(attacker_node_type, delta, max_number_of_block_to_respond):
+def generate_network_from_topology(context, attacker_node_type, delta, max_number_of_block_to_respond, topology,
+                                   network_topology):
     """
-    Load snapshot, add nodes and edges, and filter to the largest connected component.
+    Add the nodes and edges of the largest connected component of `topology` (a snapshot or synthetic topology), with the
+    attackers and victims in place of random nodes.
     """
-    with open(SNAPSHOT_PATH, encoding="utf-8") as f:
-        json_data = json.load(f)
-    json_data['edges'] = list(filter(lambda x: x['node1_policy'] and x['node2_policy'], json_data['edges']))
-    json_data['edges'] = list(filter(lambda x: not (x['node1_policy']['disabled'] or
-                                                    x['node2_policy']['disabled']), json_data['edges']))
-    largest_connected_component = find_largest_connected_component(json_data)
-    pub_key_to_create = list(largest_connected_component.nodes)
-    edges_to_create = largest_connected_component.edges
+    pub_key_to_create, edges_to_create = get_largest_connected_component(topology)
 
     nodes = {}
     network = Network()
-    number_of_attackers_to_create = NUMBER_OF_ATTACKERS_TO_CREATE[NetworkType.SNAPSHOT].get(attacker_node_type, 1)
-    attackers, victims, attackers2 = create_attacker_and_victim(network, attacker_node_type, delta,
+    number_of_attackers_to_create = NUMBER_OF_ATTACKERS_TO_CREATE[network_topology].get(attacker_node_type, 1)
+    attackers, victims, attackers2 = create_attacker_and_victim(context, network, attacker_node_type, delta,
                                                                 max_number_of_block_to_respond, number_of_attackers_to_create)
 
     for pub_key in pub_key_to_create:
-        nodes[pub_key] = create_node(delta, max_number_of_block_to_respond)
+        nodes[pub_key] = create_node(context, delta, max_number_of_block_to_respond)
 
     number_of_special_nodes = len(attackers) + len(victims) + \
                               (len(attackers2) if attacker_node_type != AttackerNodeType.SOFT_GRIEFING else 0)
@@ -343,8 +531,11 @@ def generate_network_from_snapshot(attacker_node_type, delta, max_number_of_bloc
             node_index += 1
 
     network.nodes = list(nodes.values())
-    for edge in edges_to_create:
-        network.add_edge(nodes[edge[0]], nodes[edge[1]], int(int(edges_to_create[edge]['capacity']) / 2))
+    for edge_index in edges_to_create:
+        node1, node2 = topology.node1[edge_index], topology.node2[edge_index]
+        if node1 > node2:
+            node1, node2 = node2, node1
+        network.add_edge(nodes[node1], nodes[node2], int(topology.capacity[edge_index] / 2))
 
     for attacker2 in attackers2:
         if attacker2 not in network.nodes:
@@ -354,19 +545,42 @@ def generate_network_from_snapshot(attacker_node_type, delta, max_number_of_bloc
 
 
 # Redundancy network functions
-def generate_redundancy_network(attacker_node_type, delta, max_number_of_block_to_respond):
+_redundancy_edges = {}
+
+
+def get_redundancy_edges(number_of_nodes):
+    """
+    Return the edges (as pairs of node indexes) of a redundancy network of `number_of_nodes` nodes, computed once per size.
+    """
     # connect 2 nodes if differ by 10 to the power of n(1...floor(log_10(number_of_nodes))+1)
     #   modulo 10^floor(log_10(number_of_nodes))
-    network, attackers, victims, attackers2 = create_network(attacker_node_type, delta, max_number_of_block_to_respond)
-    n = int(math.log(NUMBER_OF_NODES, 10))
-    jump_indexes = [10 ** i for i in range(n + 1)]
-    for i in range(NUMBER_OF_NODES):
-        for index_to_jump in jump_indexes:
-            next_index = i + index_to_jump
-            if next_index >= NUMBER_OF_NODES:
-                next_index -= NUMBER_OF_NODES
-            if next_index != i:
-                network.add_edge(network.nodes[i], network.nodes[next_index], MSAT_CHANNEL_CAPACITY)
+    if number_of_nodes not in _redundancy_edges:
+        n = int(math.log(number_of_nodes, 10))
+        jump_indexes = [10 ** i for i in range(n + 1)]
+        edges = []
+        for i in range(number_of_nodes):
+            for index_to_jump in jump_indexes:
+                next_index = i + index_to_jump
+                if next_index >= number_of_nodes:
+                    next_index -= number_of_nodes
+                if next_index != i:
+                    edges.append((i, next_index))
+        _redundancy_edges[number_of_nodes] = edges
+    return _redundancy_edges[number_of_nodes]
+
+
+def generate_redundancy_network(context, attacker_node_type, delta, max_number_of_block_to_respond):
+    network, attackers, victims, attackers2 = create_network(context, attacker_node_type, delta,
+                                                             max_number_of_block_to_respond)
+    edges = get_redundancy_edges(NUMBER_OF_NODES)
+    if USE_SNAPSHOT_DISTRIBUTIONS:
+        # a snapshot capacity is the whole channel, and add_edge funds both sides with the balance it gets (as the snapshot
+        # network does, with half the capacity).
+        capacities = [capacity // 2 for capacity in samplers.get_sampler(samplers.CAPACITY).sample_many(len(edges))]
+    else:
+        capacities = [MSAT_CHANNEL_CAPACITY] * len(edges)
+    for (i, next_index), capacity in zip(edges, capacities):
+        network.add_edge(network.nodes[i], network.nodes[next_index], capacity)
 
     if attackers2:
         for attacker2 in attackers2:
@@ -378,65 +592,262 @@ def generate_redundancy_network(attacker_node_type, delta, max_number_of_block_t
 def build_and_run_simulation(file_to_write, attacker_node_type, delta, max_number_of_block_to_respond, network_topology):
     random.seed()
     seed = random.randint(0, 10000000000000)
+    for run_result in build_and_run_simulation_with_seed(seed, attacker_node_type, delta, max_number_of_block_to_respond,
+                                                         network_topology):
+        file_to_write.write(f"{json.dumps(run_result)}\n")
+        file_to_write.flush()
+
+
+def generate_network(context, attacker_node_type, delta, max_number_of_block_to_respond, network_topology):
+    """
+    Build the network of the given topology, with its attackers and victims placed in it.
+    """
+    if network_topology == NetworkType.REDUNDANCY:
+        return generate_redundancy_network(context, attacker_node_type, delta, max_number_of_block_to_respond)
+    if network_topology == NetworkType.SNAPSHOT:
+        return generate_network_from_snapshot(context, attacker_node_type, delta, max_number_of_block_to_respond)
+    if network_topology == NetworkType.SYNTHETIC:
+        return generate_synthetic_network(context, attacker_node_type, delta, max_number_of_block_to_respond)
+    raise Exception("got invalid network_topology name!")
+
+
+def generate_workload_trace(network, nodes_to_simulate, seed):
+    """
+    Draw the payments of a run (HTLCS_PER_BLOCK in every block until NUMBER_OF_BLOCKS) between `nodes_to_simulate` in the
+    demand models, column by column from a generator of their own derived from `seed` (the `random` module is not used).
+    """
+    # not random.Random(seed): it would draw the same numbers random.seed(seed) drew to build the network.
+    generator = random.Random(f"{seed}|workload")
+    number_of_payments = NUMBER_OF_BLOCKS * HTLCS_PER_BLOCK
+    blocks = [block_number for block_number in range(NUMBER_OF_BLOCKS) for _ in range(HTLCS_PER_BLOCK)]
+    if SENDER_DEMAND_MODEL == RECEIVER_DEMAND_MODEL == demand.UNIFORM:
+        number_of_nodes = len(nodes_to_simulate)
+        node_ids = [node.node_id for node in nodes_to_simulate]
+        sender_indexes = generator.choices(range(number_of_nodes), k=number_of_payments)
+        # the receiver is one of the other nodes: the sender moved by 1 to number_of_nodes - 1 places.
+        offsets = generator.choices(range(1, number_of_nodes), k=number_of_payments)
+        senders = [node_ids[sender] for sender in sender_indexes]
+        receivers = [node_ids[(sender + offset) % number_of_nodes] for sender, offset in zip(sender_indexes, offsets)]
+    else:
+        sender_sampler, receiver_sampler = get_node_samplers(network, nodes_to_simulate)
+        senders = [sender_sampler.sample(generator).node_id for _ in range(number_of_payments)]
+        receivers = []
+        for sender in senders:
+            receiver = receiver_sampler.sample(generator).node_id
+            while receiver == sender:
+                receiver = receiver_sampler.sample(generator).node_id
+            receivers.append(receiver)
+    amounts = [draw_amount(generator) for _ in range(number_of_payments)]
+    return workload.WorkloadTrace.from_columns(blocks, senders, receivers, amounts)
+
+
+def get_workload_trace(seed, network, attackers, victims):
+    """
+    Return the trace the runs of the simulation of `network` (built from `seed`) replay: the one in WORKLOAD_TRACE_PATH, one
+    drawn from `seed` if SHARE_WORKLOAD is set, or None if the runs draw their payments while they run.
+    """
+    if WORKLOAD_TRACE_PATH:
+        trace = workload.WorkloadTrace.read(WORKLOAD_TRACE_PATH)
+        node_ids = {node.node_id for node in network.nodes}
+        if not node_ids.issuperset(trace.sender) or not node_ids.issuperset(trace.receiver):
+            raise ValueError(f"the trace {WORKLOAD_TRACE_PATH} has payments of nodes that are not in the network")
+        return trace
+    if SHARE_WORKLOAD:
+        return generate_workload_trace(network, get_nodes_to_simulate(network, attackers, victims), seed)
+    return None
+
+
+def write_workload_trace(path, seed=0, network_topology=NetworkType.REDUNDANCY.value, attacker_node_type=None):
+    """
+    Write the trace of the payments of a run (as SHARE_WORKLOAD draws them) of the network built from `seed`, to replay it
+    with WORKLOAD_TRACE_PATH. The trace has the ids of the nodes in the network: a redundancy network of the same size and
+    attacker type has the same ids whatever its seed, a snapshot network only for the same seed.
+    """
+    attacker_node_type = AttackerNodeType(attacker_node_type) if attacker_node_type else None
+    context = SimulationContext(seed)
+    random.seed(seed)
+    network, attackers, victims = generate_network(context, attacker_node_type, DELTA_DEFAULT,
+                                                   MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT, NetworkType(network_topology))
+    trace = generate_workload_trace(network, get_nodes_to_simulate(network, attackers, victims), seed)
+    trace.write(path)
+    print(f"wrote {trace.number_of_payments:,} payments to {path}")
+
+
+def get_run_parameters(attacker_node_type, delta, max_number_of_block_to_respond, network_topology, change_param):
+    """
+    Return the parameters of a run, `change_param` chooses between the runs of a simulation: with and without the attack,
+    or with and without the griefing penalty protocol if there is no attacker.
+    """
+    return {"attacker_node_type": attacker_node_type,
+            "use_gp_protocol": attacker_node_type is not None or change_param,
+            "simulate_attack": attacker_node_type is not None and change_param,
+            "delta": delta,
+            "max_number_of_block_to_respond": max_number_of_block_to_respond,
+            'network_topology': network_topology}
+
+
+def run_and_get_result(context, network, attackers, victims, parameters):
+    """
+    Run the simulation (from the current block) with the given run parameters.
+    @return: the result of the run, as written to the `_rawdata` files.
+    """
+    if context.workload_trace is not None:
+        parameters['workload_trace'] = WORKLOAD_TRACE_PATH or 'shared'
+    if (SENDER_DEMAND_MODEL, RECEIVER_DEMAND_MODEL, AMOUNT_MODEL) != (demand.UNIFORM, demand.UNIFORM, demand.NORMAL):
+        parameters['demand'] = {'sender': SENDER_DEMAND_MODEL, 'receiver': RECEIVER_DEMAND_MODEL, 'amount': AMOUNT_MODEL,
+                                'zipf_exponent': ZIPF_EXPONENT}
+    print(f"parameters for the run: {parameters}")
+    run_blocks(context, network, parameters['use_gp_protocol'], attackers, victims, parameters['simulate_attack'],
+               NUMBER_OF_BLOCKS)
+    metrics = finish_simulation(context, network, victims)
+    add_more_metrics(metrics)
+    run_result = {'metrics': metrics, 'parameters': parameters}
+    if RECORD_LOCKED_FUNDS_TIME_SERIES:
+        run_result['locked_funds_time_series'] = context.locked_funds_integrator.get_time_series()
+    return run_result
+
+
+def warm_up(seed, attacker_node_type, delta, max_number_of_block_to_respond, network_topology):
+    """
+    Build the network from `seed` and run WARM_UP_BLOCKS blocks of honest traffic (as the run without the attack, or without
+    the griefing penalty protocol if there is no attacker).
+    @return: a checkpoint of the run at the end of the warm up.
+    """
+    random.seed(seed)
+    context = SimulationContext(seed, USE_OBJECT_POOL, RECORD_LOCKED_FUNDS_TIME_SERIES)
+    network, attackers, victims = generate_network(context, attacker_node_type, delta, max_number_of_block_to_respond,
+                                                   network_topology)
+    context.workload_trace = get_workload_trace(seed, network, attackers, victims)
+    parameters = {"attacker_node_type": attacker_node_type,
+                  "delta": delta,
+                  "max_number_of_block_to_respond": max_number_of_block_to_respond,
+                  'network_topology': network_topology}
+    warm_up_parameters = get_run_parameters(change_param=False, **parameters)
+    print(f"warming up for {WARM_UP_BLOCKS} blocks: {warm_up_parameters}")
+    run_blocks(context, network, warm_up_parameters['use_gp_protocol'], attackers, victims, False, WARM_UP_BLOCKS)
+    return Checkpoint(context, network, attackers, victims, parameters)
+
+
+def run_branch(checkpoint, change_param):
+    """
+    Continue the run of `checkpoint` (taken by `warm_up`) as one of the runs of its simulation.
+    @return: the result of the run, as written to the `_rawdata` files.
+    """
+    context, network, attackers, victims = checkpoint.restore()
+    parameters = get_run_parameters(change_param=change_param, **checkpoint.parameters)
+    parameters['warm_up_blocks'] = checkpoint.block_number
+    return run_and_get_result(context, network, attackers, victims, parameters)
+
+
+def run_branches(checkpoint):
+    """
+    Run both runs of the simulation of `checkpoint` from it (in forked processes where possible).
+    @return: the results of the runs, as written to the `_rawdata` files.
+    """
+    return checkpoint.branch([functools.partial(run_branch, change_param=change_param) for change_param in [True, False]])
+
+
+def get_checkpoint_path(seed, attacker_node_type, delta, max_number_of_block_to_respond, network_topology):
+    attacker = attacker_node_type.name.lower() if attacker_node_type else 'none'
+    return os.path.join(CHECKPOINT_DIRECTORY, f"{network_topology.name.lower()}_{attacker}_{delta}_"
+                                              f"{max_number_of_block_to_respond}_{seed}.checkpoint")
+
+
+def build_and_run_simulation_with_seed(seed, attacker_node_type, delta, max_number_of_block_to_respond, network_topology):
+    """
+    Runs the simulation of the parameters twice from `seed` (with and without the attack, or with and without the griefing
+    penalty protocol if there is no attacker). The network is built once, the second run starts from a copy of it. If
+    WARM_UP_BLOCKS is set, both runs continue from a checkpoint of the warm up instead (saved to CHECKPOINT_DIRECTORY if it
+    is set). If WORKLOAD_TRACE_PATH or SHARE_WORKLOAD is set, both runs replay the same payments (see get_workload_trace).
+    @return: a generator of the result of every run, as written to the `_rawdata` files.
+    """
+    if WARM_UP_BLOCKS:
+        checkpoint = warm_up(seed, attacker_node_type, delta, max_number_of_block_to_respond, network_topology)
+        if CHECKPOINT_DIRECTORY:
+            os.makedirs(CHECKPOINT_DIRECTORY, exist_ok=True)
+            checkpoint.save(get_checkpoint_path(seed, attacker_node_type, delta, max_number_of_block_to_respond,
+                                                network_topology))
+        yield from run_branches(checkpoint)
+        return
+
+    template = None
+    random_state = None
+    workload_trace = None
     for change_param in [True, False]:
-        random.seed(seed)
-        if network_topology == NetworkType.REDUNDANCY:
-            network, attackers, victims = generate_redundancy_network(attacker_node_type, delta, max_number_of_block_to_respond)
-        elif network_topology == NetworkType.SNAPSHOT:
-            network, attackers, victims = generate_network_from_snapshot(attacker_node_type, delta,
-                                                                         max_number_of_block_to_respond)
+        context = SimulationContext(seed, USE_OBJECT_POOL, RECORD_LOCKED_FUNDS_TIME_SERIES)
+        if template is None:
+            random.seed(seed)
+            network, attackers, victims = generate_network(context, attacker_node_type, delta,
+                                                           max_number_of_block_to_respond, network_topology)
+            template = NetworkTemplate(context, network, attackers, victims)
+            random_state = random.getstate()
+            workload_trace = get_workload_trace(seed, network, attackers, victims)
         else:
-            raise Exception("got invalid network_topology name!")
-        use_gp_protocol = attacker_node_type is not None or change_param
-        simulate_attack = attacker_node_type is not None and change_param
-        parameters = {"attacker_node_type": attacker_node_type,
-                      "use_gp_protocol": use_gp_protocol,
-                      "simulate_attack": simulate_attack,
-                      "delta": delta,
-                      "max_number_of_block_to_respond": max_number_of_block_to_respond,
-                      'network_topology': network_topology}
-        print(f"parameters for the run: {parameters}")
-        metrics = run_simulation(network, use_gp_protocol, attackers, victims, simulate_attack)
-        add_more_metrics(metrics)
-        file_to_write.write(f"{json.dumps({'metrics': metrics, 'parameters': parameters})}\n")
-        file_to_write.flush()
-        BLOCKCHAIN_INSTANCE.init_parameters()
-        METRICS_COLLECTOR_INSTANCE.init_parameters()
-        FUNCTION_COLLECTOR_INSTANCE.init_parameters()
+            network, attackers, victims = template.instantiate(context)
+            random.setstate(random_state)
+        context.workload_trace = workload_trace
+        parameters = get_run_parameters(attacker_node_type, delta, max_number_of_block_to_respond, network_topology,
+                                        change_param)
+        yield run_and_get_result(context, network, attackers, victims, parameters)
 
 
-def run_multiple_simulation():
+def get_simulations_to_run():
     """
-    Run simulation with all parameters we choose to test.
+    @return: the (network_topology, attacker_node_type, delta, max_number_of_block_to_respond) of every simulation we choose
+    to test, in the order they run.
     """
-    # Can add NetworkType.SNAPSHOT to the list to run on Snapshot
+    # Can add NetworkType.SNAPSHOT to the list to run on Snapshot (or NetworkType.SYNTHETIC on a generated topology)
     network_topologies = [NetworkType.REDUNDANCY]
     node_types = [AttackerNodeType.SOFT_GRIEFING, AttackerNodeType.SOFT_GRIEFING_BUSY_NETWORK, AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK]
     delta_node_type = AttackerNodeType.SOFT_GRIEFING_DOS_ATTACK
     deltas = [40, 70, 100]
     max_numbers_of_block_to_respond = [2, 6, 10]
+    simulations = []
+    for network_topology in network_topologies:
+        for node_type in node_types:
+            simulations.append((network_topology, node_type, DELTA_DEFAULT, MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT))
+
+        for max_number_of_block_to_respond in max_numbers_of_block_to_respond:
+            simulations.append((network_topology, None, DELTA_DEFAULT, max_number_of_block_to_respond))
+
+        for delta in deltas:
+            # use dos attack to test the affect
+            simulations.append((network_topology, delta_node_type, delta, MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT))
+    return simulations
+
+
+def run_multiple_simulation():
+    """
+    Run simulation with all parameters we choose to test.
+    """
     try:
         current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         with open(f"simulation_results/{current_time}_rawdata", 'w') as f:
-            for network_topology in network_topologies:
-                for node_type in node_types:
-                    build_and_run_simulation(f, node_type, DELTA_DEFAULT, MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT,
-                                             network_topology)
-
-                for max_number_of_block_to_respond in max_numbers_of_block_to_respond:
-                    build_and_run_simulation(f, None, DELTA_DEFAULT, max_number_of_block_to_respond, network_topology)
-
-                for delta in deltas:
-                    # use dos attack to test the affect
-                    build_and_run_simulation(f, delta_node_type, delta, MAX_NUMBER_OF_BLOCKS_TO_RESPONSE_DEFAULT,
-                                             network_topology)
+            for network_topology, node_type, delta, max_number_of_block_to_respond in get_simulations_to_run():
+                build_and_run_simulation(f, node_type, delta, max_number_of_block_to_respond, network_topology)
 
     finally:
         f.close()
 
 
+def run_from_checkpoint(checkpoint_path, output=None):
+    """
+    Run both runs of a simulation from the checkpoint saved in `checkpoint_path` (see CHECKPOINT_DIRECTORY), appending
+    their results to the `_rawdata` file `output` (a new file in simulation_results by default).
+    """
+    if output is None:
+        current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output = f"simulation_results/{current_time}_rawdata"
+    run_results = run_branches(Checkpoint.load(checkpoint_path))
+    with open(output, 'a') as f:
+        for run_result in run_results:
+            f.write(f"{json.dumps(run_result)}\n")
+    return output
+
+
 def main():
-    fire.Fire({'run_all': run_multiple_simulation})
+    fire.Fire({'run_all': run_multiple_simulation, 'run_from_checkpoint': run_from_checkpoint,
+               'write_workload_trace': write_workload_trace})
 
 
 if __name__ == '__main__':
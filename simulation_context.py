@@ -0,0 +1,32 @@
+from typing import Optional
+import blockchain
+import utils
+import workload
+
+
+class SimulationContext:
+    """
+    Holds the state of a run of the simulation: its blockchain, metrics, scheduled functions and the rest of the components
+    the nodes, channels and contracts of the run use. Every node is created in a context and its channels and contracts
+    reach it through the node, so any number of runs can live in one process without resetting anything between them.
+    """
+    def __init__(self, seed: int = 0, use_object_pool: bool = False, record_locked_funds_time_series: bool = False):
+        """
+        Initializes a new `SimulationContext`.
+        @param seed: the seed of the secrets, transaction ids and addresses of the run.
+        @param use_object_pool: whether to recycle the transaction infos and contracts once their transaction retires.
+        @param record_locked_funds_time_series: whether to record the locked funds of the network in every block.
+        """
+        self.blockchain = blockchain.BlockChain()
+        self.object_pool = utils.ObjectPool()
+        self.object_pool.set_enabled(use_object_pool)
+        self.locked_funds_integrator = utils.LockedFundsIntegrator(self.blockchain)
+        self.locked_funds_integrator.set_record_time_series(record_locked_funds_time_series)
+        self.metrics_collector = utils.MetricsCollector(self.locked_funds_integrator)
+        self.function_collector = utils.FunctionCollector(self.blockchain)
+        self.contract_expiry_sweeper = utils.ContractExpirySweeper(self.function_collector)
+        self.transaction_lifecycle = utils.TransactionLifecycleManager(self.blockchain, self.object_pool)
+        self.node_state_store = utils.NodeStateStore(self.locked_funds_integrator)
+        self.secret_generator = utils.SecretGenerator()
+        self.secret_generator.init_parameters(seed)
+        self.workload_trace: Optional['workload.WorkloadTrace'] = None  # if set, the run replays its payments (see `run_blocks`).
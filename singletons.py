@@ -1,6 +1,3 @@
-import blockchain
-import utils
-
 # Metrics names
 TRANSACTION_WAITING_TIME_BEFORE_COMPLETING = "Transactions waiting time (in blocks) before completing avg"
 TRANSACTION_SUCCESSFUL_COUNT = "Transactions successful count"
@@ -18,8 +15,3 @@ ADD_FORWARD_CONTRACT_FAILED = "Failed transaction - could not add forward contra
 TERMINATE_TRANSACTION = "Terminated transactions count"
 HONEST_NODE_BALANCE_AVG = "Honest node final balance avg"
 VICTIM_NODE_BALANCE_AVG = "Victim: node final balance avg"
-
-# singleton for all runs
-BLOCKCHAIN_INSTANCE: blockchain.BlockChain = blockchain.BlockChain()
-METRICS_COLLECTOR_INSTANCE: utils.MetricsCollector = utils.MetricsCollector()
-FUNCTION_COLLECTOR_INSTANCE: utils.FunctionCollector = utils.FunctionCollector()
@@ -1,4 +1,8 @@
-from collections import defaultdict
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from samplers import get_buckets  # noqa: E402
 
 
 def capacity():
@@ -35,22 +39,6 @@ def fee_rate_milli_msat():
                                        total_fee_rate_milli_msat))
 
 
-def get_buckets(all_values, buckets_value):
-    buckets_dict = defaultdict(int)
-    for c in all_values:
-        buckets_dict[c - (c % buckets_value)] += 1
-    buckets = sorted(buckets_dict.keys())
-    buckets_to_remove = [b for b in buckets if buckets_dict[b] < 50]
-    buckets_to_keep = [b for b in buckets if b not in buckets_to_remove]
-
-    for b in buckets_to_remove:
-        temp = [abs(kb - b) for kb in buckets_to_keep]
-        b_replace = buckets_to_keep[temp.index(min(temp))]
-        buckets_dict[b_replace] += buckets_dict[b]
-        buckets_dict[b] = 0
-    return buckets_to_keep, buckets_dict
-
-
 def main():
     # fee_base_msat()
     fee_rate_milli_msat()
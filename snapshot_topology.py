@@ -0,0 +1,402 @@
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot', 'cache')
+_INDEX_FILE_NAME = 'index.json'
+_MAGIC = b'LNTOPO01'
+_HEADER_SIZE_FORMAT = '<Q'
+_ALIGNMENT = 8
+
+# the arrays of a topology (one item per node or per edge) and their types.
+_ARRAY_TYPECODES = {'key_offsets': 'Q', 'node1': 'I', 'node2': 'I', 'capacity': 'q',
+                    'node1_fee_base_msat': 'q', 'node1_fee_rate_milli_msat': 'q', 'node1_time_lock_delta': 'I',
+                    'node2_fee_base_msat': 'q', 'node2_fee_rate_milli_msat': 'q', 'node2_time_lock_delta': 'I'}
+
+
+class SnapshotTopology:
+    """
+    The nodes and the usable edges (both policies exist and neither is disabled) of a describegraph snapshot, as arrays.
+    Nodes are numbered in the order they first appear in the snapshot (nodes list, then edge endpoints) and edges are kept
+    in the snapshot order, so the topology builds the same network the snapshot JSON does.
+    """
+    def __init__(self, keys: bytes, arrays: Dict[str, memoryview]):
+        self._keys = keys
+        self._arrays = arrays
+        self.key_offsets = arrays['key_offsets']  # the keys of node i are keys[key_offsets[i]:key_offsets[i + 1]].
+        self.node1 = arrays['node1']
+        self.node2 = arrays['node2']
+        self.capacity = arrays['capacity']
+        self.node1_fee_base_msat = arrays['node1_fee_base_msat']
+        self.node1_fee_rate_milli_msat = arrays['node1_fee_rate_milli_msat']
+        self.node1_time_lock_delta = arrays['node1_time_lock_delta']
+        self.node2_fee_base_msat = arrays['node2_fee_base_msat']
+        self.node2_fee_rate_milli_msat = arrays['node2_fee_rate_milli_msat']
+        self.node2_time_lock_delta = arrays['node2_time_lock_delta']
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.key_offsets) - 1
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.node1)
+
+    def get_pub_key(self, node_index: int) -> str:
+        return bytes(self._keys[self.key_offsets[node_index]:self.key_offsets[node_index + 1]]).decode()
+
+    def write(self, path: str):
+        """
+        Writes this topology to `path` (see `write_arrays`), so it can be used straight from a memory map.
+        """
+        sections = [('keys', 'B', memoryview(self._keys))] + \
+                   [(name, typecode, self._arrays[name]) for name, typecode in _ARRAY_TYPECODES.items()]
+        write_arrays(path, _MAGIC, sections)
+
+    @classmethod
+    def read(cls, path: str) -> 'SnapshotTopology':
+        """
+        Maps the topology written to `path` to memory (the arrays are read only views over the file).
+        """
+        sections = read_arrays(path, _MAGIC)
+        keys = sections.pop('keys')
+        return cls(keys, sections)
+
+
+def write_arrays(path: str, magic: bytes, sections: List[Tuple[str, str, memoryview]]):
+    """
+    Writes the arrays `sections` (name, typecode, data) to `path`: `magic`, a header (JSON) with the place of every array,
+    then the arrays, each aligned so it can be used straight from a memory map.
+    """
+    header = {'byteorder': sys.byteorder, 'sections': []}
+    offset = 0
+    for name, typecode, data in sections:
+        header['sections'].append({'name': name, 'typecode': typecode, 'offset': offset, 'length': len(data)})
+        offset += _aligned(len(data) * data.itemsize)
+    header_bytes = json.dumps(header).encode()
+    data_start = _aligned(len(magic) + struct.calcsize(_HEADER_SIZE_FORMAT) + len(header_bytes))
+    with atomic_write(path, 'wb') as f:
+        f.write(magic + struct.pack(_HEADER_SIZE_FORMAT, len(header_bytes)) + header_bytes)
+        for section, (_, _, data) in zip(header['sections'], sections):
+            f.seek(data_start + section['offset'])
+            f.write(data.cast('B'))
+        f.truncate(data_start + offset)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str, **kwargs):
+    """
+    Opens a temp file of its own next to `path` and moves it to `path` once it is written, so processes that write the same
+    file at once never see (or truncate) each other's partial files.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                     dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def read_arrays(path: str, magic: bytes) -> Dict[str, memoryview]:
+    """
+    Maps the arrays written to `path` by `write_arrays` to memory.
+    @return: read only views over the file by array name (copies if the file was written with another byte order).
+    """
+    with open(path, 'rb') as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if bytes(data[:len(magic)]) != magic:
+        raise ValueError(f"{path} is not a {magic.decode()} file")
+    header_size_end = len(magic) + struct.calcsize(_HEADER_SIZE_FORMAT)
+    header_size, = struct.unpack(_HEADER_SIZE_FORMAT, data[len(magic):header_size_end])
+    header = json.loads(bytes(data[header_size_end:header_size_end + header_size]))
+    data_start = _aligned(header_size_end + header_size)
+    sections = {}
+    for section in header['sections']:
+        start = data_start + section['offset']
+        view = data[start:start + section['length'] * array(section['typecode']).itemsize].cast(section['typecode'])
+        if header['byteorder'] != sys.byteorder:
+            swapped = array(section['typecode'], view)
+            swapped.byteswap()
+            view = memoryview(swapped)
+        sections[section['name']] = view
+    return sections
+
+
+def _aligned(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class TopologyBuilder:
+    """
+    Builds a `SnapshotTopology` from the nodes and edges of a snapshot, added in the snapshot order.
+    """
+    def __init__(self):
+        self._node_indexes: Dict[str, int] = {}
+        self._keys = bytearray()
+        self._arrays = {name: array(typecode) for name, typecode in _ARRAY_TYPECODES.items()}
+        self._arrays['key_offsets'].append(0)
+
+    def add_node(self, pub_key: str) -> int:
+        """
+        @return: the index of the node with `pub_key`, added if it is new.
+        """
+        index = self._node_indexes.get(pub_key)
+        if index is None:
+            index = self._node_indexes[pub_key] = len(self._node_indexes)
+            self._keys += pub_key.encode()
+            self._arrays['key_offsets'].append(len(self._keys))
+        return index
+
+    def add_edge(self, edge: dict):
+        """
+        Adds `edge`, a describegraph edge that is usable (see `is_usable_edge`).
+        """
+        arrays = self._arrays
+        arrays['node1'].append(self.add_node(edge['node1_pub']))
+        arrays['node2'].append(self.add_node(edge['node2_pub']))
+        arrays['capacity'].append(int(edge['capacity']))
+        for prefix in ['node1_', 'node2_']:
+            policy = edge[prefix + 'policy']
+            arrays[prefix + 'fee_base_msat'].append(int(policy.get('fee_base_msat') or 0))
+            arrays[prefix + 'fee_rate_milli_msat'].append(int(policy.get('fee_rate_milli_msat') or 0))
+            arrays[prefix + 'time_lock_delta'].append(int(policy.get('time_lock_delta') or 0))
+
+    def build(self) -> SnapshotTopology:
+        return SnapshotTopology(bytes(self._keys), {name: memoryview(values) for name, values in self._arrays.items()})
+
+
+def is_usable_edge(edge: dict) -> bool:
+    """
+    True iff both policies of `edge` exist and neither is disabled.
+    """
+    node1_policy = edge.get('node1_policy')
+    node2_policy = edge.get('node2_policy')
+    return bool(node1_policy and node2_policy) and not (node1_policy['disabled'] or node2_policy['disabled'])
+
+
+def _find_root(parents: List[int], node: int) -> int:
+    while parents[node] != node:
+        parents[node] = parents[parents[node]]
+        node = parents[node]
+    return node
+
+
+def find_largest_connected_component(number_of_nodes: int, node1, node2) -> Tuple[List[int], List[int]]:
+    """
+    Finds the largest connected component (isolated nodes excluded) of the graph with `number_of_nodes` nodes and the edges
+    `node1[i]` - `node2[i]`, with a union-find over the edge arrays. On a tie, the component with the lowest node wins.
+    Parallel edges are one edge: the last of them is kept, in the place of the first.
+    @return: the indexes of the nodes of the component in increasing order, and the indexes of its edges ordered by their
+    lower node (then by their place in the arrays).
+    """
+    parents = list(range(number_of_nodes))
+    sizes = [1] * number_of_nodes
+    has_edge = bytearray(number_of_nodes)
+    for u, v in zip(node1, node2):
+        has_edge[u] = has_edge[v] = 1
+        root_u = _find_root(parents, u)
+        root_v = _find_root(parents, v)
+        if root_u == root_v:
+            continue
+        if sizes[root_u] < sizes[root_v]:
+            root_u, root_v = root_v, root_u
+        parents[root_v] = root_u
+        sizes[root_u] += sizes[root_v]
+
+    roots = [_find_root(parents, node) for node in range(number_of_nodes)]
+    largest_root = None
+    for node in range(number_of_nodes):
+        if has_edge[node] and (largest_root is None or sizes[roots[node]] > sizes[largest_root]):
+            largest_root = roots[node]
+    if largest_root is None:
+        raise ValueError("the graph has no edges")
+    nodes = [node for node in range(number_of_nodes) if roots[node] == largest_root]
+
+    first_edges: Dict[Tuple[int, int], int] = {}
+    last_edges: Dict[Tuple[int, int], int] = {}
+    for edge_index, (u, v) in enumerate(zip(node1, node2)):
+        if roots[u] != largest_root:
+            continue
+        pair = (u, v) if u <= v else (v, u)
+        first_edges.setdefault(pair, edge_index)
+        last_edges[pair] = edge_index
+    pairs = sorted(first_edges, key=lambda pair: (pair[0], first_edges[pair]))
+    return nodes, [last_edges[pair] for pair in pairs]
+
+
+class _JSONStream:
+    """
+    Reads JSON values one by one from a text file, holding only the unread part of the current chunk in memory.
+    """
+    _WHITESPACE = ' \t\n\r'
+
+    def __init__(self, f, chunk_size: int):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buffer = ''
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read_chunk(self) -> bool:
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        @return: the next non whitespace character (without consuming it), '' at the end of the file.
+        """
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in self._WHITESPACE:
+                self._position += 1
+            if self._position < len(self._buffer) or not self._read_chunk():
+                return self._buffer[self._position:self._position + 1]
+
+    def expect(self, character: str):
+        if self.peek() != character:
+            raise ValueError(f"expected {character!r} in the snapshot, got {self.peek()!r}")
+        self._position += 1
+
+    def read_value(self):
+        """
+        @return: the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if self._eof or not self._read_chunk():
+                    raise
+                continue
+            # a number might continue in the next chunk.
+            if end == len(self._buffer) and not self._eof and self._read_chunk():
+                continue
+            self._position = end
+            return value
+
+    def read_items(self):
+        """
+        Generates the items of the next JSON array one by one.
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self._position += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.peek() == ',':
+                self._position += 1
+                continue
+            self.expect(']')
+            return
+
+
+def stream_describegraph(snapshot_path: str, chunk_size: int = 1 << 20):
+    """
+    Parses the describegraph JSON in `snapshot_path` incrementally, so the memory used does not depend on the file size.
+    @return: a generator of ('node', node) for every node and ('edge', edge) for every usable edge (see `is_usable_edge`),
+    in the file order.
+    """
+    with open(snapshot_path, encoding="utf-8") as f:
+        stream = _JSONStream(f, chunk_size)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.read_value()
+            stream.expect(':')
+            if key == 'nodes':
+                for node in stream.read_items():
+                    yield 'node', node
+            elif key == 'edges':
+                for edge in stream.read_items():
+                    if is_usable_edge(edge):
+                        yield 'edge', edge
+            else:
+                stream.read_value()
+            if stream.peek() == ',':
+                stream.expect(',')
+
+
+def compile_snapshot(snapshot_path: str) -> SnapshotTopology:
+    """
+    Parses the describegraph JSON in `snapshot_path` into a topology, streaming it into the builder.
+    """
+    builder = TopologyBuilder()
+    for kind, item in stream_describegraph(snapshot_path):
+        if kind == 'node':
+            builder.add_node(item['pub_key'])
+        else:
+            builder.add_edge(item)
+    return builder.build()
+
+
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _get_snapshot_hash(snapshot_path: str, cache_directory: str) -> str:
+    """
+    @return: the hash of the snapshot file, hashed again only if its size or modification time changed.
+    """
+    index_path = os.path.join(cache_directory, _INDEX_FILE_NAME)
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    stat = os.stat(snapshot_path)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    key = os.path.abspath(snapshot_path)
+    entry = index.get(key)
+    if entry and entry['stamp'] == stamp:
+        return entry['hash']
+    index[key] = {'stamp': stamp, 'hash': hash_file(snapshot_path)}
+    with atomic_write(index_path, 'w', encoding="utf-8") as f:
+        json.dump(index, f)
+    return index[key]['hash']
+
+
+_loaded_topologies: Dict[str, SnapshotTopology] = {}
+
+
+def load_snapshot(snapshot_path: str, cache_directory: Optional[str] = None) -> SnapshotTopology:
+    """
+    @return: the topology of the snapshot in `snapshot_path`. It is compiled once and cached in `cache_directory` under the
+    hash of the snapshot file, later calls map the compiled file to memory (and reuse it within the process).
+    """
+    cache_directory = cache_directory or CACHE_DIRECTORY
+    os.makedirs(cache_directory, exist_ok=True)
+    snapshot_hash = _get_snapshot_hash(snapshot_path, cache_directory)
+    topology = _loaded_topologies.get(snapshot_hash)
+    if topology is not None:
+        return topology
+    compiled_path = os.path.join(cache_directory, f"{snapshot_hash}.topology")
+    if not os.path.exists(compiled_path):
+        try:
+            compile_snapshot(snapshot_path).write(compiled_path)
+        except OSError:
+            # another process compiled the snapshot at the same time (and holds the file, where it cannot be replaced).
+            if not os.path.exists(compiled_path):
+                raise
+    topology = _loaded_topologies[snapshot_hash] = SnapshotTopology.read(compiled_path)
+    return topology
+
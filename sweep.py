@@ -0,0 +1,130 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import traceback
+from datetime import datetime
+import fire
+import simulation
+
+
+def get_task_id(simulation_index, network_topology, attacker_node_type, delta, max_number_of_block_to_respond, replica):
+    """
+    @return: the id of a replica of the simulation in place `simulation_index` of `get_simulations_to_run` (the same
+    simulation might be listed more than once, every time it is a task of its own).
+    """
+    return f"{simulation_index}|{network_topology}|{attacker_node_type}|{delta}|{max_number_of_block_to_respond}|{replica}"
+
+
+def get_task_seed(base_seed, task_id):
+    """
+    @return: the seed of the task, which depends only on `base_seed` and the task (not on the process or order it runs in).
+    """
+    digest = hashlib.sha256(f"{base_seed}|{task_id}".encode()).digest()
+    return int.from_bytes(digest[:8], 'big') % 10000000000000
+
+
+def get_tasks(number_of_replicas, base_seed):
+    """
+    @return: the id, seed and simulation parameters of every replica of every simulation we choose to test.
+    """
+    tasks = []
+    for replica in range(number_of_replicas):
+        for simulation_index, (network_topology, attacker_node_type, delta, max_number_of_block_to_respond) in \
+                enumerate(simulation.get_simulations_to_run()):
+            task_id = get_task_id(simulation_index, network_topology.value,
+                                  attacker_node_type.value if attacker_node_type else None, delta,
+                                  max_number_of_block_to_respond, replica)
+            tasks.append((task_id, get_task_seed(base_seed, task_id), replica,
+                          (attacker_node_type, delta, max_number_of_block_to_respond, network_topology)))
+    return tasks
+
+
+def run_task(task):
+    """
+    Runs a task in a worker.
+    @return: the task id and the `_rawdata` lines of its runs, or the task id and the traceback if it failed.
+    """
+    task_id, seed, replica, parameters = task
+    try:
+        lines = []
+        for run_result in simulation.build_and_run_simulation_with_seed(seed, *parameters):
+            run_result['task'] = {'id': task_id, 'replica': replica, 'seed': seed}
+            lines.append(f"{json.dumps(run_result)}\n")
+        return task_id, lines, None
+    except Exception:
+        return task_id, None, traceback.format_exc()
+
+
+def get_finished_tasks(output_path, runs_per_task=2):
+    """
+    Reads the `_rawdata` file of an interrupted sweep and drops the lines of tasks that did not write all their runs, and a
+    last line cut in the middle. The file is rewritten only if there are such lines, every other line is kept as is.
+    @return: the ids of the tasks that finished.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path) as f:
+        lines = f.readlines()
+    task_ids = []
+    runs_by_task = {}
+    for line in lines:
+        try:
+            task_id = json.loads(line)['task']['id']
+        except (ValueError, KeyError, TypeError):
+            task_id = None  # not a line of a sweep task.
+        task_ids.append(task_id)
+        if task_id is not None:
+            runs_by_task[task_id] = runs_by_task.get(task_id, 0) + 1
+    finished_tasks = {task_id for task_id, runs in runs_by_task.items() if runs == runs_per_task}
+    lines_to_drop = [i for i, task_id in enumerate(task_ids) if task_id is not None and task_id not in finished_tasks]
+    cut_last_line = bool(lines) and not lines[-1].endswith('\n')
+    if cut_last_line and task_ids[-1] is None:
+        lines_to_drop.append(len(lines) - 1)
+    if lines_to_drop or cut_last_line:
+        if lines_to_drop:
+            unfinished_tasks = sorted(set(runs_by_task) - finished_tasks)
+            print(f"dropping {len(lines_to_drop)} lines from {output_path}: the lines of the unfinished tasks "
+                  f"{unfinished_tasks}{' and a cut last line' if cut_last_line and task_ids[-1] is None else ''}")
+        dropped = set(lines_to_drop)
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.writelines(line if line.endswith('\n') else line + '\n' for i, line in enumerate(lines) if i not in dropped)
+        os.replace(temp_path, output_path)
+    return finished_tasks
+
+
+def run_sweep(number_of_replicas=1, processes=None, output=None, base_seed=0):
+    """
+    Runs `number_of_replicas` replicas of every simulation of `run_multiple_simulation` on a pool of `processes` workers
+    (all the cpus by default). The main process is the only writer of the `_rawdata` file `output` (a new file in
+    simulation_results by default). Running again with the same `output` and `base_seed` only runs the tasks that did
+    not finish.
+    """
+    if output is None:
+        current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output = f"simulation_results/{current_time}_rawdata"
+    finished_tasks = get_finished_tasks(output)
+    tasks = [task for task in get_tasks(number_of_replicas, base_seed) if task[0] not in finished_tasks]
+    print(f"{len(finished_tasks)} tasks already finished, running {len(tasks)} tasks")
+    failed_tasks = []
+    with open(output, 'a') as f, multiprocessing.Pool(processes) as pool:
+        for task_id, lines, error in pool.imap_unordered(run_task, tasks):
+            if error is not None:
+                print(f"task {task_id} failed:\n{error}")
+                failed_tasks.append(task_id)
+                continue
+            f.writelines(lines)
+            f.flush()
+            print(f"task {task_id} finished")
+    if failed_tasks:
+        print(f"{len(failed_tasks)} tasks failed, run again with output={output} to retry them: {failed_tasks}")
+    return output
+
+
+def main():
+    fire.Fire({'run_sweep': run_sweep})
+
+
+if __name__ == '__main__':
+    main()
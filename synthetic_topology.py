@@ -0,0 +1,91 @@
+import random
+from array import array
+from collections import Counter
+from typing import List
+from samplers import AliasSampler
+
+# the models of synthetic topologies.
+PREFERENTIAL_ATTACHMENT = 'preferential_attachment'  # every new node opens channels to nodes in proportion to their degree.
+CONFIGURATION = 'configuration'  # the degrees are drawn from a distribution and the channel ends are paired at random.
+MODELS = [PREFERENTIAL_ATTACHMENT, CONFIGURATION]
+
+
+class SyntheticTopology:
+    """
+    The nodes and edges of a generated LN-like graph, as arrays (the edge arrays of `snapshot_topology.SnapshotTopology`,
+    so the network is built from it the same way). Edge i is a channel of `capacity[i]` between `node1[i]` and `node2[i]`.
+    """
+    def __init__(self, number_of_nodes: int, node1: array, node2: array, capacity: array):
+        self._number_of_nodes = number_of_nodes
+        self.node1 = node1
+        self.node2 = node2
+        self.capacity = capacity
+
+    @property
+    def number_of_nodes(self) -> int:
+        return self._number_of_nodes
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.node1)
+
+
+def get_degree_sampler(node1, node2, edge_indexes: List[int]) -> AliasSampler:
+    """
+    @return: a sampler of the degrees of the nodes of the edges `node1[i]` - `node2[i]` for i in `edge_indexes` (the
+    largest connected component of a snapshot, to match its degree distribution).
+    """
+    degrees = Counter()
+    for i in edge_indexes:
+        degrees[node1[i]] += 1
+        degrees[node2[i]] += 1
+    counts = Counter(degrees.values())
+    values = sorted(counts)
+    return AliasSampler.from_counts(values, [counts[value] for value in values], 1)
+
+
+def generate_preferential_attachment(number_of_nodes: int, edges_per_node: int, capacity_sampler: AliasSampler,
+                                     generator=random) -> SyntheticTopology:
+    """
+    Generates a Barabasi-Albert graph: nodes are added one by one and each opens `edges_per_node` channels to distinct
+    earlier nodes, drawn in proportion to their degree (uniformly from the list of all channel ends so far). The degrees
+    are heavy tailed, as in the Lightning Network. Capacities are drawn from `capacity_sampler`.
+    """
+    if not 1 <= edges_per_node < number_of_nodes:
+        raise ValueError(f"edges_per_node must be in [1, {number_of_nodes}), got {edges_per_node}")
+    node1 = array('I')
+    node2 = array('I')
+    channel_ends = array('I')
+    targets = list(range(edges_per_node))
+    for node in range(edges_per_node, number_of_nodes):
+        node1.extend([node] * edges_per_node)
+        node2.extend(targets)
+        channel_ends.extend(targets)
+        channel_ends.extend([node] * edges_per_node)
+        chosen = set()
+        while len(chosen) < edges_per_node:
+            chosen.add(channel_ends[int(generator.random() * len(channel_ends))])
+        targets = list(chosen)
+    return SyntheticTopology(number_of_nodes, node1, node2, capacity_sampler.sample_many(len(node1), generator))
+
+
+def generate_configuration_model(number_of_nodes: int, degree_sampler: AliasSampler, capacity_sampler: AliasSampler,
+                                 generator=random) -> SyntheticTopology:
+    """
+    Generates a graph with the degrees drawn from `degree_sampler`: every node gets that many channel ends, and the
+    shuffled ends are paired into channels. Self loops are dropped (as are parallel channels later, with the rest of the
+    largest connected component). Capacities are drawn from `capacity_sampler`.
+    """
+    degrees = degree_sampler.sample_many(number_of_nodes, generator)
+    channel_ends = array('I')
+    for node, degree in enumerate(degrees):
+        channel_ends.extend([node] * degree)
+    channel_ends = list(channel_ends)
+    generator.shuffle(channel_ends)
+    node1 = array('I')
+    node2 = array('I')
+    for u, v in zip(channel_ends[0::2], channel_ends[1::2]):
+        if u != v:
+            node1.append(u)
+            node2.append(v)
+    return SyntheticTopology(number_of_nodes, node1, node2, capacity_sampler.sample_many(len(node1), generator))
@@ -1,13 +1,25 @@
+import functools
+import heapq
+import random
+import string
+import sys
+from array import array
 from collections import defaultdict
-from typing import List, Callable, Tuple
+from itertools import compress
+from typing import List, Callable, Tuple, Dict, Type, TypeVar
 import singletons
+import blockchain
+import lightning_node
+
+T = TypeVar('T')
 
 
 class MetricsCollector:
     """
-    Class for a singleton to collects metric about a run of a simulation.
+    Class to collects metric about a run of a simulation (part of its `SimulationContext`).
     """
-    def __init__(self):
+    def __init__(self, locked_funds_integrator: 'LockedFundsIntegrator'):
+        self._locked_funds_integrator = locked_funds_integrator
         self.init_parameters()
 
     def init_parameters(self):
@@ -25,6 +37,16 @@ class MetricsCollector:
         self._average_metrics[key] += value
         self._average_metrics_count[key] += 1
 
+    def average_all(self, key, values: List):
+        """
+        Adds all `values` to the average count of `key` (the same as calling `average` with each of them in order).
+        """
+        total = self._average_metrics[key]
+        for value in values:
+            total += value
+        self._average_metrics[key] = total
+        self._average_metrics_count[key] += len(values)
+
     # Assume all values > 0
     def max(self, key, value):
         """
@@ -56,47 +78,510 @@ class MetricsCollector:
         @return: a dictionary of all metrics.
         """
         average_metrics = {metric: sum / self._average_metrics_count[metric] for metric, sum in self._average_metrics.items()}
-        return {**self._metrics, **average_metrics}
+        metrics = {**self._metrics, **average_metrics}
+        for metric, value in self._locked_funds_integrator.get_metrics().items():
+            metrics[metric] = metrics.get(metric, 0) + value
+        return metrics
+
+
+class LockedFundsIntegrator:
+    """
+    Class to sum the funds each node has locked in every block (locked amount * number of blocks it was locked). Holds the
+    locked amount and the block it changed at for every node (indexed by node id) and only accumulates when it changes, the
+    metrics are computed when requested.
+    """
+    def __init__(self, blockchain: 'blockchain.BlockChain'):
+        self._blockchain = blockchain
+        self._record_time_series = False
+        self.init_parameters()
+
+    def init_parameters(self):
+        """
+        Resets this instance.
+        """
+        self._nodes: List['lightning_node.LightningNode'] = []
+        self._locked_funds: List[int] = []
+        self._locked_funds_since_block: List[int] = []
+        self._total_locked_funds: List[int] = []
+        self._network_locked_funds = 0
+        self._time_series_blocks: List[int] = []
+        self._time_series_locked_funds: List[int] = []
+
+    def set_record_time_series(self, record_time_series: bool):
+        """
+        Sets whether to record the locked funds of the whole network in every block (see `get_time_series`).
+        """
+        self._record_time_series = record_time_series
+
+    def add_node(self, node: 'lightning_node.LightningNode'):
+        """
+        Adds `node`, its id is expected to be the next index.
+        """
+        assert node.node_id == len(self._nodes)
+        self._nodes.append(node)
+        self._locked_funds.append(0)
+        self._locked_funds_since_block.append(0)
+        self._total_locked_funds.append(0)
+
+    def copy_from(self, other: 'LockedFundsIntegrator', nodes: List['lightning_node.LightningNode']):
+        """
+        Sets this (empty) instance to the state of `other`, whose nodes never locked funds, with `nodes` (the copies of the
+        nodes of `other`, by id) in place of the originals.
+        """
+        assert not self._nodes and not other._network_locked_funds
+        self._nodes = list(nodes)
+        self._locked_funds = [0] * len(nodes)
+        self._locked_funds_since_block = [0] * len(nodes)
+        self._total_locked_funds = [0] * len(nodes)
+
+    def get_locked_funds(self, node_id: int) -> int:
+        """
+        @return: the funds currently locked by the node with id `node_id`.
+        """
+        return self._locked_funds[node_id]
+
+    def update(self, node_id: int, locked_fund: int):
+        """
+        Adds `locked_fund` (might be negative) to the locked funds of the node with id `node_id` from the current block.
+        """
+        if not locked_fund:
+            return
+        block_number = self._blockchain.block_number
+        total_last_locked_fund = self._locked_funds[node_id] * (block_number - self._locked_funds_since_block[node_id])
+        assert total_last_locked_fund >= 0
+        self._total_locked_funds[node_id] += total_last_locked_fund
+        self._locked_funds[node_id] += locked_fund
+        self._locked_funds_since_block[node_id] = block_number
+
+        if self._record_time_series:
+            self._network_locked_funds += locked_fund
+            if self._time_series_blocks and self._time_series_blocks[-1] == block_number:
+                self._time_series_locked_funds[-1] = self._network_locked_funds
+            else:
+                self._time_series_blocks.append(block_number)
+                self._time_series_locked_funds.append(self._network_locked_funds)
+
+    def get_all_locked_funds(self) -> List[int]:
+        """
+        @return: the funds currently locked by every node, indexed by node id (must not be changed).
+        """
+        return self._locked_funds
+
+    def get_total_locked_funds(self, node_id: int) -> int:
+        """
+        @return: the summation of the funds locked by the node with id `node_id` in every block until the current block.
+        """
+        block_number = self._blockchain.block_number
+        return self._total_locked_funds[node_id] + \
+            self._locked_funds[node_id] * (block_number - self._locked_funds_since_block[node_id])
+
+    def get_metrics(self) -> Dict[str, int]:
+        """
+        @return: the summation of the locked funds in every block, for every type of node (by its log prefix).
+        """
+        metrics = defaultdict(int)
+        for node in self._nodes:
+            total_locked_funds = self.get_total_locked_funds(node.node_id)
+            if total_locked_funds > 0:
+                metrics[node.log_prefix + singletons.TOTAL_LOCKED_FUND_IN_EVERY_BLOCKS] += total_locked_funds
+        return metrics
+
+    def get_time_series(self) -> List[int]:
+        """
+        @return: the funds locked in the whole network at the end of every block, from block 0 until the current block. Empty
+        if not recorded.
+        """
+        if not self._record_time_series:
+            return []
+        time_series = []
+        locked_funds = 0
+        index = 0
+        for block_number in range(self._blockchain.block_number + 1):
+            while index < len(self._time_series_blocks) and self._time_series_blocks[index] <= block_number:
+                locked_funds = self._time_series_locked_funds[index]
+                index += 1
+            time_series.append(locked_funds)
+        return time_series
+
+
+class NodeStateStore:
+    """
+    Class to hold the scalar state of all the nodes in typed arrays indexed by node id (`LightningNode` is a view
+    over it), so a node's scalars cost a few bytes and network-wide queries run over whole arrays.
+    """
+    VICTIM = 1
+    ATTACKER = 2
+
+    def __init__(self, locked_funds_integrator: LockedFundsIntegrator):
+        self._locked_funds_integrator = locked_funds_integrator
+        self.init_parameters()
+
+    def init_parameters(self):
+        """
+        Resets this instance.
+        """
+        self.base_fees = array('q')
+        self.fee_percentages = array('d')
+        self.griefing_penalty_rates = array('d')
+        self.deltas = array('q')
+        self.max_numbers_of_blocks_to_respond = array('q')
+        self.flags = array('B')
+
+    def add_node(self, node_id: int, base_fee: int, fee_percentage: float, griefing_penalty_rate: float, delta: int,
+                 max_number_of_block_to_respond: int):
+        """
+        Adds the state of a new node, its id is expected to be the next index.
+        """
+        assert node_id == len(self.flags)
+        self.base_fees.append(base_fee)
+        self.fee_percentages.append(fee_percentage)
+        self.griefing_penalty_rates.append(griefing_penalty_rate)
+        self.deltas.append(delta)
+        self.max_numbers_of_blocks_to_respond.append(max_number_of_block_to_respond)
+        self.flags.append(0)
+
+    def copy_from(self, other: 'NodeStateStore'):
+        """
+        Sets this instance to a copy of the state of the nodes in `other`.
+        """
+        self.base_fees = other.base_fees[:]
+        self.fee_percentages = other.fee_percentages[:]
+        self.griefing_penalty_rates = other.griefing_penalty_rates[:]
+        self.deltas = other.deltas[:]
+        self.max_numbers_of_blocks_to_respond = other.max_numbers_of_blocks_to_respond[:]
+        self.flags = other.flags[:]
+
+    def set_flag(self, node_id: int, flag: int):
+        """
+        Sets `flag` (`VICTIM` or `ATTACKER`) for the node with id `node_id`.
+        """
+        self.flags[node_id] |= flag
+
+    def has_flag(self, node_id: int, flag: int) -> bool:
+        return bool(self.flags[node_id] & flag)
+
+    def _get_masks(self) -> Dict[str, List[bool]]:
+        """
+        @return: for every type of node, whether each node (by node id) is of that type.
+        """
+        return {'honest': [not flags for flags in self.flags],
+                'victim': [bool(flags & NodeStateStore.VICTIM) for flags in self.flags],
+                'attacker': [bool(flags & NodeStateStore.ATTACKER) for flags in self.flags]}
+
+    def get_fee_statistics(self) -> Dict[str, float]:
+        """
+        @return: the min, max and average of the base fee and the fee percentage over all the nodes.
+        """
+        number_of_nodes = len(self.flags)
+        if not number_of_nodes:
+            return {}
+        return {'base fee min': min(self.base_fees), 'base fee max': max(self.base_fees),
+                'base fee avg': sum(self.base_fees) / number_of_nodes,
+                'fee percentage min': min(self.fee_percentages), 'fee percentage max': max(self.fee_percentages),
+                'fee percentage avg': sum(self.fee_percentages) / number_of_nodes}
+
+    def get_locked_funds_by_type(self) -> Dict[str, int]:
+        """
+        @return: the funds currently locked by all the honest, victim and attacker nodes.
+        """
+        locked_funds = self._locked_funds_integrator.get_all_locked_funds()
+        return {node_type: sum(compress(locked_funds, mask)) for node_type, mask in self._get_masks().items()}
 
 
 class FunctionCollector:
     """
-    Singleton class to collect function during a simulation run and invoke it on a certain time (block number)
+    Class to collect function during a simulation run and invoke it on a certain time (block number). The functions are
+    kept by block number, with a heap of the block numbers.
     """
-    def __init__(self):
+    def __init__(self, blockchain: 'blockchain.BlockChain'):
+        self._blockchain = blockchain
         self.init_parameters()
 
     def init_parameters(self):
         """
         Resets this instance.
         """
-        self._function_to_run: List[Tuple[Callable[[], None], int]] = []
+        self._functions_by_block: Dict[int, List[Tuple[int, Callable[[], None]]]] = {}  # (sequence number, function)
+        self._blocks: List[int] = []
+        self._sequence_number = 0
 
     def run(self):
         """
-        Invokes all the functions that requested to run on the current block number (or lower).
+        Invokes all the functions that requested to run on the current block number (or lower), in the order they were
+        collected. Functions collected meanwhile are left to the next run.
         """
-        temp_function_to_run = [f for (f, k) in self._function_to_run
-                                if k <= singletons.BLOCKCHAIN_INSTANCE.block_number]
-        for f in temp_function_to_run:
+        block_number = self._blockchain.block_number
+        functions_to_run = []
+        while self._blocks and self._blocks[0] <= block_number:
+            functions_to_run.append(self._functions_by_block.pop(heapq.heappop(self._blocks)))
+        if not functions_to_run:
+            return
+        functions_to_run = functions_to_run[0] if len(functions_to_run) == 1 else sorted(sum(functions_to_run, []))
+        for _, f in functions_to_run:
             f()
-        self._function_to_run = [(f, k) for (f, k) in self._function_to_run
-                                if f not in temp_function_to_run]
 
     def append(self, f: Callable[[], None], k: int):
         """
         Collects function `f` to be invoked on block number `k`.
         """
-        self._function_to_run.append((f, k))
+        functions = self._functions_by_block.get(k)
+        if functions is None:
+            functions = self._functions_by_block[k] = []
+            heapq.heappush(self._blocks, k)
+        functions.append((self._sequence_number, f))
+        self._sequence_number += 1
 
     def get_max_k(self):
         """
         @return: the latest time a function asked to be called.
         """
-        return max([k for (f, k) in self._function_to_run]) if self._function_to_run else None
+        return max(self._functions_by_block) if self._functions_by_block else None
 
     def get_min_k(self):
         """
         @return: the earliest time a function asked to be called.
         """
-        return min([k for (f, k) in self._function_to_run])  if self._function_to_run else None
+        return self._blocks[0] if self._blocks else None
+
+
+class ContractExpirySweeper:
+    """
+    Class to enforce the contracts that expire without being concluded. The contracts are indexed by their
+    expiration block and are all enforced together at that block, grouped by channel so every channel updates its locks and
+    message state once per block.
+    """
+    def __init__(self, function_collector: FunctionCollector):
+        self._function_collector = function_collector
+        self.init_parameters()
+
+    def init_parameters(self):
+        """
+        Resets this instance.
+        """
+        self._contracts_by_block: Dict[int, List['contract_htlc.Contract_HTLC']] = {}
+
+    def add(self, contract: 'contract_htlc.Contract_HTLC'):
+        """
+        Adds `contract` to be checked when it expires.
+        """
+        block_number = contract.expiration_block_number
+        contracts = self._contracts_by_block.get(block_number)
+        if contracts is None:
+            contracts = self._contracts_by_block[block_number] = []
+            self._function_collector.append(functools.partial(self._sweep, block_number), block_number)
+        contracts.append(contract)
+
+    def _sweep(self, block_number: int):
+        contracts_by_channel = defaultdict(list)
+        expired_contracts = []
+        for contract in self._contracts_by_block.pop(block_number):
+            if contract.should_enforce_on_expiry():
+                contract.on_expired()
+                contracts_by_channel[contract.attached_channel].append(contract)
+                expired_contracts.append(contract)
+        for channel, contracts in contracts_by_channel.items():
+            channel.notify_of_end_of_contracts(contracts)
+        for contract in expired_contracts:
+            contract.after_expired()
+
+
+class TransactionLifecycleManager:
+    """
+    Class to retire the state nodes keep regarding transactions once their expiration block passed, and to count the live
+    and retired transaction states.
+    """
+    def __init__(self, blockchain: 'blockchain.BlockChain', object_pool: 'ObjectPool'):
+        self._blockchain = blockchain
+        self._object_pool = object_pool
+        self.init_parameters()
+
+    def init_parameters(self):
+        """
+        Resets this instance.
+        """
+        self._block_to_transactions: Dict[int, List[Tuple['lightning_node.LightningNode', int,
+                                                          'lightning_node.TransactionRecord']]] = defaultdict(list)
+        self._next_block_to_retire = 0
+        self._tracked_count = 0
+        self._completed_count = 0
+        self._expired_count = 0
+
+    def track(self, node: 'lightning_node.LightningNode', transaction_id: int, retire_block_number: int,
+              record: 'lightning_node.TransactionRecord'):
+        """
+        Tracks the state `node` keeps regarding `transaction_id` in `record`, to be retired after block `retire_block_number`.
+        When retired, the objects in `record.recyclables` are released to the object pool.
+        """
+        self._tracked_count += 1
+        self._block_to_transactions[max(retire_block_number, self._next_block_to_retire)].append(
+            (node, transaction_id, record))
+
+    def notify_of_retired(self, expired: bool):
+        """
+        Used to notify that a node retired the state of a tracked transaction, `expired` is True iff it was retired by
+        `retire_expired`, otherwise the transaction reached its end.
+        """
+        if expired:
+            self._expired_count += 1
+        else:
+            self._completed_count += 1
+
+    def retire_expired(self):
+        """
+        Retires the state of all the transactions that their retire block passed.
+        """
+        block_number = self._blockchain.block_number
+        while self._next_block_to_retire < block_number:
+            transactions = self._block_to_transactions.pop(self._next_block_to_retire, None)
+            self._next_block_to_retire += 1
+            if transactions:
+                for node, transaction_id, record in transactions:
+                    node.retire_expired_transaction(transaction_id)
+                    if record.recyclables:
+                        for instance in record.recyclables:
+                            self._object_pool.release(instance)
+                        record.recyclables = None
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        @return: the number of live transaction states and the number of retired ones (by reaching their end or by expiring).
+        """
+        return {'live': self._tracked_count - self._completed_count - self._expired_count,
+                'retired completed': self._completed_count,
+                'retired expired': self._expired_count}
+
+
+class ObjectPool:
+    """
+    Class to hold free lists of retired instances (per class) and recycle them instead of allocating new ones. When
+    disabled (the default) `acquire` always allocates and `release` drops the instance.
+    """
+    def __init__(self, max_free_instances_per_class: int = 100000):
+        self._max_free_instances_per_class = max_free_instances_per_class
+        self._enabled = False
+        self.init_parameters()
+
+    def init_parameters(self):
+        """
+        Resets this instance.
+        """
+        self._free_instances: Dict[type, list] = defaultdict(list)
+        self._allocated_count = 0
+        self._recycled_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def set_enabled(self, enabled: bool):
+        """
+        Sets whether to recycle released instances.
+        """
+        self._enabled = enabled
+
+    def acquire(self, cls: Type[T], *args, **kwargs) -> T:
+        """
+        @return: a free instance of `cls` re-initialized with the given arguments, or a new one if there is none.
+        """
+        free_instances = self._free_instances.get(cls)
+        if free_instances:
+            instance = free_instances.pop()
+            instance.__init__(*args, **kwargs)
+            self._recycled_count += 1
+            return instance
+        self._allocated_count += 1
+        return cls(*args, **kwargs)
+
+    def release(self, instance):
+        """
+        Releases `instance` to be recycled, it must not be used by anyone after that.
+        """
+        if not self._enabled:
+            return
+        free_instances = self._free_instances[type(instance)]
+        if len(free_instances) < self._max_free_instances_per_class:
+            free_instances.append(instance)
+
+    def get_counts(self) -> Dict[str, int]:
+        """
+        @return: the number of instances allocated and recycled by `acquire`.
+        """
+        return {'allocated': self._allocated_count, 'recycled': self._recycled_count}
+
+
+_MASK_64 = (1 << 64) - 1
+_ADDRESS_CHARACTERS = string.ascii_uppercase + string.digits
+
+
+def hash_secret(secret: int) -> int:
+    """
+    Deterministic (unlike `hash` of a `str`, which is salted per process) and cheap hash of a secret. It is the finalizer of
+    splitmix64, a bijection on 64 bits numbers, so different secrets never share a hash and a non zero secret never has the
+    hash 0.
+    """
+    secret = ((secret ^ (secret >> 30)) * 0xbf58476d1ce4e5b9) & _MASK_64
+    secret = ((secret ^ (secret >> 27)) * 0x94d049bb133111eb) & _MASK_64
+    return secret ^ (secret >> 31)
+
+
+class SecretGenerator:
+    """
+    Class to generate the secrets, transaction ids and addresses of a run from its own seeded stream, so a run can be
+    replayed (in any process) and the global `random` stream is left to the simulation. The random numbers are generated in
+    batches of 64 bits numbers.
+    """
+    def __init__(self, batch_size: int = 4096):
+        self._batch_size = batch_size
+        self.init_parameters()
+
+    def init_parameters(self, seed: int = 0):
+        """
+        Resets this instance and seeds its stream with `seed`.
+        """
+        self._random = random.Random(seed)
+        self._batch: List[int] = []
+        self._last_id = 0
+
+    def copy_from(self, other: 'SecretGenerator'):
+        """
+        Sets this instance to the state of `other`, so both generate the same secrets, ids and addresses from now on.
+        """
+        self._batch_size = other._batch_size
+        self._random.setstate(other._random.getstate())
+        self._batch = other._batch.copy()
+        self._last_id = other._last_id
+
+    def _next_random(self) -> int:
+        if not self._batch:
+            numbers = array('Q', self._random.getrandbits(64 * self._batch_size).to_bytes(8 * self._batch_size, 'little'))
+            if sys.byteorder != 'little':
+                numbers.byteswap()
+            self._batch = numbers.tolist()
+        return self._batch.pop()
+
+    def generate_secret(self) -> int:
+        """
+        @return: a new random non zero 64 bits secret (hash it with `hash_secret`).
+        """
+        secret = self._next_random()
+        while not secret:
+            secret = self._next_random()
+        return secret
+
+    def generate_id(self) -> int:
+        """
+        @return: a new transaction id, unique in the run.
+        """
+        self._last_id += 1
+        return self._last_id
+
+    def generate_address(self) -> str:
+        """
+        @return: a new random address of 8 characters (only used for output).
+        """
+        number = self._next_random()
+        characters = []
+        for _ in range(8):
+            number, index = divmod(number, len(_ADDRESS_CHARACTERS))
+            characters.append(_ADDRESS_CHARACTERS[index])
+        return ''.join(characters)
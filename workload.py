@@ -0,0 +1,86 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, Tuple
+import snapshot_topology
+
+_MAGIC = b'LNTRACE1'
+
+# the columns of a trace (one item per payment) and their types.
+_COLUMN_TYPECODES = {'block': 'I', 'sender': 'I', 'receiver': 'I', 'amount': 'q'}
+
+
+class WorkloadTrace:
+    """
+    The payments of a run, as columns: the block every payment is sent in, the ids of its sender and receiver nodes (their
+    ids in the blockchain of the run) and its amount (in msat). Payments are ordered by block, the payments of a block are
+    sent in their order.
+    """
+    def __init__(self, columns: Dict[str, memoryview]):
+        self._columns = columns
+        self.block = columns['block']
+        self.sender = columns['sender']
+        self.receiver = columns['receiver']
+        self.amount = columns['amount']
+
+    @classmethod
+    def from_columns(cls, block, sender, receiver, amount) -> 'WorkloadTrace':
+        """
+        @return: the trace of the payments `(block[i], sender[i], receiver[i], amount[i])`, which must be ordered by block.
+        """
+        columns = {name: memoryview(array(typecode, values))
+                   for (name, typecode), values in zip(_COLUMN_TYPECODES.items(), [block, sender, receiver, amount])}
+        if len({len(column) for column in columns.values()}) > 1:
+            raise ValueError("the columns of a trace must have the same length")
+        blocks = columns['block']
+        if any(blocks[i] > blocks[i + 1] for i in range(len(blocks) - 1)):
+            raise ValueError("the payments of a trace must be ordered by block")
+        return cls(columns)
+
+    @property
+    def number_of_payments(self) -> int:
+        return len(self.block)
+
+    @property
+    def max_node_id(self) -> int:
+        return max(max(self.sender, default=-1), max(self.receiver, default=-1))
+
+    def write(self, path: str):
+        """
+        Writes this trace to `path` (see `snapshot_topology.write_arrays`).
+        """
+        snapshot_topology.write_arrays(path, _MAGIC, [(name, typecode, self._columns[name])
+                                                      for name, typecode in _COLUMN_TYPECODES.items()])
+
+    @classmethod
+    def read(cls, path: str) -> 'WorkloadTrace':
+        """
+        Maps the trace written to `path` to memory, so replaying it reads the payments from the file as they are sent.
+        """
+        return cls(snapshot_topology.read_arrays(path, _MAGIC))
+
+    def __getstate__(self):
+        return {name: column.tobytes() for name, column in self._columns.items()}
+
+    def __setstate__(self, state):
+        columns = {}
+        for name, typecode in _COLUMN_TYPECODES.items():
+            column = array(typecode)
+            column.frombytes(state[name])
+            columns[name] = memoryview(column)
+        self.__init__(columns)
+
+    def get_block_payments(self, first_block_number: int) -> Iterator[Iterator[Tuple[int, int, int]]]:
+        """
+        @return: a generator of the payments of every block from `first_block_number` on (endless, later blocks have no
+        payments), each a generator of the (sender id, receiver id, amount) of the payments of the block.
+        """
+        blocks = self.block
+        index = bisect_left(blocks, first_block_number)
+        block_number = first_block_number
+        while True:
+            end = index
+            while end < len(blocks) and blocks[end] == block_number:
+                end += 1
+            yield zip(self.sender[index:end], self.receiver[index:end], self.amount[index:end])
+            index = end
+            block_number += 1